@@ -1,17 +1,24 @@
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File
+from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, BackgroundTasks
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
 import os
-import shutil
-from typing import List
-from db import get_db
+import json
+import asyncio
+from typing import List, Dict, Any, Optional
+from db import get_db, SessionLocal
 from models import User, Document
 from dependencies import get_current_user
 from rag.document_processor import DocumentProcessor
-from rag.vectorstore import VectorStore
+from rag.vectorstore import get_vectorstore
+from storage import FileStore, FileTooLargeError, acquire_stored_file, release_stored_file, unreference_document_file, remove_unused_file
+from ingestion import index_document, mark_processing_failed, precompute_document_summary, INGEST_SUMMARIES
 
 router = APIRouter()
 
+# Aantal bestanden dat een bulk upload tegelijk opslaat en verwerkt
+BULK_UPLOAD_CONCURRENCY = int(os.getenv("BULK_UPLOAD_CONCURRENCY", "4"))
+
 class DocumentResponse(BaseModel):
     id: int
     filename: str
@@ -21,9 +28,13 @@ class DocumentResponse(BaseModel):
     uploaded_at: str
     is_processed: bool
     chunk_count: int
+    processing_error: Optional[str] = None
+    summary: Optional[str] = None
+    key_facts: Optional[Dict[str, List[str]]] = None
 
 @router.post("/upload", response_model=DocumentResponse)
 async def upload_document(
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
@@ -49,18 +60,17 @@ async def upload_document(
             detail=f"Document limit reached ({tier_limits['documents']} documents). Upgrade to upload more."
         )
     
-    # Create documents directory if it doesn't exist
-    os.makedirs("/app/documents", exist_ok=True)
-    
-    # Save file
+    # Stream file to content-addressed storage off the event loop; hashed on the fly
     filename = f"{current_user.id}_{file.filename}"
-    file_path = f"/app/documents/{filename}"
-    
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-    
-    # Get file size
-    file_size = os.path.getsize(file_path)
+    try:
+        content_hash, file_size, tmp_path = await FileStore().save_upload(file, file_extension)
+    except FileTooLargeError as e:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=str(e)
+        )
+    # Verplaatsen en tellen onder het storage lock; niet op de event loop
+    file_path = await run_in_threadpool(acquire_stored_file, db, content_hash, tmp_path, file_size, file_extension)
     
     # Create document record
     db_document = Document(
@@ -69,61 +79,26 @@ async def upload_document(
         file_path=file_path,
         file_size=file_size,
         file_type=file_extension[1:],  # Remove the dot
-        user_id=current_user.id
+        user_id=current_user.id,
+        content_hash=content_hash
     )
     
-    db.add(db_document)
-    db.commit()
-    db.refresh(db_document)
-    
-    # Process document in background (asynchronous)
     try:
-        print(f"Starting document processing for {file_path}")
-        processor = DocumentProcessor()
-        vectorstore = VectorStore()
-        
-        # Process document - new processor returns list of strings
-        chunks = processor.process_document(file_path)
-        print(f"Document processing completed, got {len(chunks)} chunks")
-        
-        if chunks:
-            # Create metadata for each chunk
-            metadatas = []
-            for i, chunk in enumerate(chunks):
-                metadata = {
-                    'file_path': file_path,
-                    'filename': filename,
-                    'original_filename': file.filename,
-                    'chunk': i + 1,
-                    'user_id': current_user.id,
-                    'upload_date': db_document.uploaded_at.isoformat()
-                }
-                metadatas.append(metadata)
-            
-            # Add to vectorstore
-            print(f"Adding {len(chunks)} chunks to vectorstore")
-            for i, chunk in enumerate(chunks):
-                vectorstore.add_document(chunk, metadatas[i])
-            
-            # Update document record
-            db_document.is_processed = True
-            db_document.chunk_count = len(chunks)
-            db.commit()
-            print(f"Document marked as processed with {len(chunks)} chunks")
-        else:
-            print("No chunks generated from document")
-            # Mark as processed even if no chunks (file was uploaded successfully)
-            db_document.is_processed = True
-            db_document.chunk_count = 0
-            db.commit()
-        
-    except Exception as e:
-        print(f"Error processing document: {e}")
-        # Document is saved but not processed - mark as processed to avoid retry
-        db_document.is_processed = True
-        db_document.chunk_count = 0
+        db.add(db_document)
         db.commit()
-        print(f"Document marked as processed despite processing error")
+        db.refresh(db_document)
+    except Exception:
+        # De referentie is al vastgelegd; geef hem weer vrij
+        db.rollback()
+        await run_in_threadpool(release_stored_file, db, content_hash)
+        raise
+    
+    # Process document in a worker thread (reuses chunks and embeddings for known content)
+    await run_in_threadpool(_index_uploaded_document, db_document.id)
+    db.refresh(db_document)
+    if INGEST_SUMMARIES and db_document.chunk_count:
+        # Samenvatting en kerngegevens na de response, de upload wacht er niet op
+        background_tasks.add_task(precompute_document_summary, db_document.id)
     
     return DocumentResponse(
         id=db_document.id,
@@ -133,11 +108,31 @@ async def upload_document(
         file_type=db_document.file_type,
         uploaded_at=db_document.uploaded_at.isoformat(),
         is_processed=db_document.is_processed,
-        chunk_count=db_document.chunk_count
+        chunk_count=db_document.chunk_count,
+        processing_error=db_document.processing_error,
+        summary=db_document.summary,
+        key_facts=json.loads(db_document.key_facts) if db_document.key_facts else None
     )
 
+def _index_uploaded_document(document_id: int):
+    """Verwerk een geüpload document; draait in een worker thread met een eigen sessie"""
+    db = SessionLocal()
+    try:
+        document = db.query(Document).filter(Document.id == document_id).first()
+        try:
+            index_document(db, document)
+            print(f"Document marked as processed with {document.chunk_count} chunks")
+        except Exception as e:
+            # Document is saved but not processed; the reason is stored on the record
+            print(f"Error processing document: {e}")
+            if not document.processing_error:
+                mark_processing_failed(db, document, e)
+    finally:
+        db.close()
+
 @router.post("/bulk-upload")
 async def bulk_upload_documents(
+    background_tasks: BackgroundTasks,
     files: List[UploadFile] = File(...),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
@@ -150,125 +145,21 @@ async def bulk_upload_documents(
             detail="Only administrators can perform bulk uploads"
         )
     
-    # Check file types
-    allowed_types = ['.pdf', '.docx', '.md', '.txt']
-    results = []
+    # One shared vectorstore so concurrent files don't overwrite each other's chunks
+    vectorstore = await run_in_threadpool(get_vectorstore)
+    semaphore = asyncio.Semaphore(BULK_UPLOAD_CONCURRENCY)
     
-    for file in files:
-        file_extension = os.path.splitext(file.filename)[1].lower()
-        
-        if file_extension not in allowed_types:
-            results.append({
-                "filename": file.filename,
-                "status": "error",
-                "message": f"Unsupported file type: {file_extension}"
-            })
-            continue
-        
-        try:
-            # Create documents directory if it doesn't exist
-            os.makedirs("/app/documents", exist_ok=True)
-            
-            # Save file
-            filename = f"{current_user.id}_{file.filename}"
-            file_path = f"/app/documents/{filename}"
-            
-            with open(file_path, "wb") as buffer:
-                content = await file.read()
-                buffer.write(content)
-            
-            # Get file size
-            file_size = os.path.getsize(file_path)
-            
-            # Create document record
-            db_document = Document(
-                filename=filename,
-                original_filename=file.filename,
-                file_path=file_path,
-                file_size=file_size,
-                file_type=file_extension[1:],  # Remove the dot
-                user_id=current_user.id
-            )
-            
-            db.add(db_document)
-            db.commit()
-            db.refresh(db_document)
-            
-            # Process document
-            try:
-                print(f"Processing bulk upload document: {file_path}")
-                processor = DocumentProcessor()
-                vectorstore = VectorStore()
-                
-                # Process document - new processor returns list of strings
-                chunks = processor.process_document(file_path)
-                print(f"Document processing completed, got {len(chunks)} chunks")
-                
-                if chunks:
-                    # Create metadata for each chunk
-                    metadatas = []
-                    for i, chunk in enumerate(chunks):
-                        metadata = {
-                            'file_path': file_path,
-                            'filename': filename,
-                            'original_filename': file.filename,
-                            'chunk': i + 1,
-                            'user_id': current_user.id,
-                            'upload_date': db_document.uploaded_at.isoformat()
-                        }
-                        metadatas.append(metadata)
-                    
-                    # Add to vectorstore
-                    print(f"Adding {len(chunks)} chunks to vectorstore")
-                    for i, chunk in enumerate(chunks):
-                        vectorstore.add_document(chunk, metadatas[i])
-                    
-                    # Update document record
-                    db_document.is_processed = True
-                    db_document.chunk_count = len(chunks)
-                    db.commit()
-                    print(f"Document marked as processed with {len(chunks)} chunks")
-                    
-                    results.append({
-                        "filename": file.filename,
-                        "status": "success",
-                        "message": f"Uploaded and processed successfully. Created {len(chunks)} chunks.",
-                        "chunks": len(chunks)
-                    })
-                else:
-                    print("No chunks generated from document")
-                    db_document.is_processed = True
-                    db_document.chunk_count = 0
-                    db.commit()
-                    
-                    results.append({
-                        "filename": file.filename,
-                        "status": "warning",
-                        "message": "Uploaded successfully but no text could be extracted.",
-                        "chunks": 0
-                    })
-                
-            except Exception as e:
-                print(f"Error processing document: {e}")
-                db_document.is_processed = True
-                db_document.chunk_count = 0
-                db.commit()
-                
-                results.append({
-                    "filename": file.filename,
-                    "status": "error",
-                    "message": f"Uploaded but processing failed: {str(e)}",
-                    "chunks": 0
-                })
-                
-        except Exception as e:
-            print(f"Error uploading document {file.filename}: {e}")
-            results.append({
-                "filename": file.filename,
-                "status": "error",
-                "message": f"Upload failed: {str(e)}",
-                "chunks": 0
-            })
+    async def upload_with_limit(file: UploadFile) -> Dict[str, Any]:
+        async with semaphore:
+            return await _bulk_upload_file(file, current_user.id, vectorstore)
+    
+    results = await asyncio.gather(*(upload_with_limit(file) for file in files))
+    
+    if INGEST_SUMMARIES:
+        async def precompute_summaries(document_ids: List[int]):
+            for document_id in document_ids:
+                await precompute_document_summary(document_id, vectorstore=vectorstore)
+        background_tasks.add_task(precompute_summaries, [r["document_id"] for r in results if r["status"] == "success"])
     
     # Calculate summary
     successful = len([r for r in results if r["status"] == "success"])
@@ -288,6 +179,109 @@ async def bulk_upload_documents(
         "results": results
     }
 
+async def _bulk_upload_file(file: UploadFile, user_id: int, vectorstore) -> Dict[str, Any]:
+    """Sla één bestand van een bulk upload op en verwerk het"""
+    allowed_types = ['.pdf', '.docx', '.md', '.txt']
+    file_extension = os.path.splitext(file.filename)[1].lower()
+    
+    if file_extension not in allowed_types:
+        return {
+            "filename": file.filename,
+            "status": "error",
+            "message": f"Unsupported file type: {file_extension}"
+        }
+    
+    try:
+        content_hash, file_size, tmp_path = await FileStore().save_upload(file, file_extension)
+    except FileTooLargeError as e:
+        return {
+            "filename": file.filename,
+            "status": "error",
+            "message": f"Upload failed: {str(e)}",
+            "chunks": 0
+        }
+    except Exception as e:
+        print(f"Error uploading document {file.filename}: {e}")
+        return {
+            "filename": file.filename,
+            "status": "error",
+            "message": f"Upload failed: {str(e)}",
+            "chunks": 0
+        }
+    
+    return await run_in_threadpool(
+        _register_and_index, file.filename, file_extension, user_id, content_hash, file_size, tmp_path, vectorstore
+    )
+
+def _register_and_index(original_filename: str, file_extension: str, user_id: int, content_hash: str, file_size: int, tmp_path: str, vectorstore) -> Dict[str, Any]:
+    """Maak het Document record aan en verwerk het; draait in een worker thread met een eigen sessie"""
+    db = SessionLocal()
+    file_path = None
+    try:
+        file_path = acquire_stored_file(db, content_hash, tmp_path, file_size, file_extension)
+        
+        # Create document record
+        db_document = Document(
+            filename=f"{user_id}_{original_filename}",
+            original_filename=original_filename,
+            file_path=file_path,
+            file_size=file_size,
+            file_type=file_extension[1:],  # Remove the dot
+            user_id=user_id,
+            content_hash=content_hash
+        )
+        
+        db.add(db_document)
+        db.commit()
+        db.refresh(db_document)
+    except Exception as e:
+        db.rollback()
+        if file_path is not None:
+            # De referentie is al vastgelegd; geef hem weer vrij
+            release_stored_file(db, content_hash)
+        db.close()
+        print(f"Error uploading document {original_filename}: {e}")
+        return {
+            "filename": original_filename,
+            "status": "error",
+            "message": f"Upload failed: {str(e)}",
+            "chunks": 0
+        }
+    
+    # Process document
+    try:
+        print(f"Processing bulk upload document: {file_path}")
+        chunk_count = index_document(db, db_document, DocumentProcessor(), vectorstore)
+        
+        if chunk_count:
+            print(f"Document marked as processed with {chunk_count} chunks")
+            return {
+                "filename": original_filename,
+                "status": "success",
+                "message": f"Uploaded and processed successfully. Created {chunk_count} chunks.",
+                "chunks": chunk_count,
+                "document_id": db_document.id
+            }
+        return {
+            "filename": original_filename,
+            "status": "warning",
+            "message": "Uploaded successfully but no text could be extracted.",
+            "chunks": 0
+        }
+    except Exception as e:
+        print(f"Error processing document: {e}")
+        if not db_document.processing_error:
+            mark_processing_failed(db, db_document, e)
+        
+        return {
+            "filename": original_filename,
+            "status": "error",
+            "message": f"Uploaded but processing failed: {str(e)}",
+            "chunks": 0
+        }
+    finally:
+        db.close()
+
 @router.get("/documents", response_model=List[DocumentResponse])
 def get_documents(
     current_user: User = Depends(get_current_user),
@@ -305,7 +299,10 @@ def get_documents(
             file_type=doc.file_type,
             uploaded_at=doc.uploaded_at.isoformat(),
             is_processed=doc.is_processed,
-            chunk_count=doc.chunk_count
+            chunk_count=doc.chunk_count,
+            processing_error=doc.processing_error,
+            summary=doc.summary,
+            key_facts=json.loads(doc.key_facts) if doc.key_facts else None
         )
         for doc in documents
     ]
@@ -330,22 +327,17 @@ def delete_document(
     
     try:
         # Remove chunks from vectorstore
-        vectorstore = VectorStore()
-        vectorstore.remove_document_chunks(document.original_filename)
+        vectorstore = get_vectorstore()
+        vectorstore.remove_document_chunks_by_id(document.id, legacy_file_path=document.file_path)
         print(f"Removed chunks for document: {document.original_filename}")
         
-        # Delete file
-        if os.path.exists(document.file_path):
-            os.remove(document.file_path)
-            print(f"Deleted file: {document.file_path}")
-        
-        # Delete from database
+        # Delete from database and release the file in one commit; shared content
+        # is only deleted when no document uses it anymore
         db.delete(document)
+        file_path = unreference_document_file(db, document)
         db.commit()
         print(f"Deleted document record: {document.id}")
         
-        return {"message": "Document deleted successfully"}
-        
     except Exception as e:
         print(f"Error deleting document: {e}")
         # Rollback database changes if vectorstore removal failed
@@ -353,4 +345,13 @@ def delete_document(
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error deleting document: {str(e)}"
-        ) 
\ No newline at end of file
+        )
+    
+    # Bestand pas na de commit weghalen; lukt dat niet, dan is het document toch verwijderd
+    if file_path:
+        try:
+            remove_unused_file(db, file_path)
+        except OSError as e:
+            print(f"Could not delete file {file_path}: {e}")
+    
+    return {"message": "Document deleted successfully"} 
\ No newline at end of file
@@ -1,21 +1,62 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
 import json
-from typing import List, Dict, Any, Optional
+import logging
+import os
+import re
+import time
+import threading
+from typing import List, Dict, Any, Optional, Tuple, Awaitable, AsyncGenerator
 import asyncio
-from db import get_db
+from db import get_db, SessionLocal
 from models import User, Query, Document
 from dependencies import get_current_user
-from rag.vectorstore import VectorStore
-from rag.llm import OllamaLLM
+from rag.vectorstore import get_vectorstore
+from rag.singleflight import SingleFlight
+from rag.admission import admission, AdmissionRejected, AdmissionTicket, mark_service_started
+from rag.llm import get_llm, set_llm_caller, set_llm_cache_mode, cascade
+from rag.metrics import metrics
+from rag.deadline import Deadline, deadline_policy, record
+from rag.summaries import summarize_per_document, stream_per_document
+from rag.compression import compress_sources
+from ingestion import load_stored_summaries
 from datetime import datetime
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
+
+# Gelijktijdige identieke vragen delen retrieval en generatie
+query_flights = SingleFlight("query")
+
+metrics.describe("llm_time_to_first_token_seconds", "Tijd van request tot het eerste gestreamde token")
+metrics.describe("query_stream_duration_seconds", "Totale duur van gestreamde antwoorden")
+metrics.describe("query_cancelled_total", "Queries afgebroken omdat de client de verbinding verbrak")
+metrics.describe("query_batch_questions_total", "Vragen in batch requests per uitkomst (answered, error, limit)")
+
+# Hoe vaak een lopende query controleert of de client nog verbonden is
+DISCONNECT_POLL_SECONDS = float(os.getenv("QUERY_DISCONNECT_POLL_SECONDS", "0.5"))
+# Status voor afgebroken requests (zoals nginx); de client ziet hem niet meer
+CLIENT_CLOSED_REQUEST = 499
+# Maximaal aantal vragen per batch en hoeveel daarvan tegelijk gegenereerd worden
+QUERY_BATCH_MAX_QUESTIONS = int(os.getenv("QUERY_BATCH_MAX_QUESTIONS", "200"))
+QUERY_BATCH_CONCURRENCY = int(os.getenv("QUERY_BATCH_CONCURRENCY", "4"))
+
+class ClientDisconnected(Exception):
+    """De client heeft de verbinding verbroken; het werk is geannuleerd"""
 
 class QueryRequest(BaseModel):
     question: str
     document_id: Optional[int] = None  # None = alle documenten, int = specifiek document
+    deadline_seconds: Optional[float] = None  # None = QUERY_DEADLINE_SECONDS
+
+class BatchQueryRequest(BaseModel):
+    questions: List[str]
+    document_id: Optional[int] = None
+    deadline_seconds: Optional[float] = None  # per vraag, vanaf het moment dat hij aan de beurt is
 
 class SourceResponse(BaseModel):
     id: int
@@ -30,124 +71,59 @@ class QueryResponse(BaseModel):
     document_filter: Optional[str] = None
     processing_time: Optional[float] = None
     warning: Optional[str] = None
+    degradations: List[str] = []  # wat is ingeleverd om binnen de deadline te blijven
 
 @router.post("/query", response_model=QueryResponse)
 async def query_documents(
     query_request: QueryRequest,
+    request: Request,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Stel een vraag over de geüploade documenten"""
-    import time
     start_time = time.time()
+    deadline = deadline_policy.deadline(query_request.deadline_seconds)
     
     # Check user tier limits
-    tier_limits = current_user.get_tier_limits()
-    
-    if tier_limits["queries_per_day"] != float('inf'):
-        # Count queries from today
-        today = datetime.utcnow().date()
-        query_count = db.query(Query).filter(
-            Query.user_id == current_user.id,
-            Query.created_at >= today
-        ).count()
-        
-        if query_count >= tier_limits["queries_per_day"]:
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail=f"Daily query limit reached ({tier_limits['queries_per_day']} queries per day). Upgrade for more queries."
-            )
+    check_query_limit(db, current_user)
+    set_llm_caller(current_user)
+    cache_mode = set_llm_cache_mode(request.headers)
+    ticket = admit_query(current_user)
+    disconnected = False
     
     try:
         # Initialize RAG components
-        vectorstore = VectorStore()
-        llm = OllamaLLM()
+        vectorstore = await run_in_threadpool(get_vectorstore)
+        llm = get_llm()
         
         # Check if specific document is requested
-        document_filter = None
-        if query_request.document_id:
-            # Verify document exists and belongs to user
-            document = db.query(Document).filter(
-                Document.id == query_request.document_id,
-                Document.user_id == current_user.id
-            ).first()
-            
-            if not document:
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detail="Document not found or access denied"
-                )
-            
-            document_filter = document.original_filename
-        
-        # Search for relevant documents
-        sources = vectorstore.search(query_request.question, n_results=10, document_filter=document_filter or "")
+        document_filter = resolve_document_filter(db, current_user, query_request.document_id)
         
-        if not sources:
-            if query_request.document_id:
-                return QueryResponse(
-                    answer=f"Ik heb geen relevante informatie gevonden in het document '{document_filter}'. Probeer een andere vraag of een ander document.",
-                    sources=[],
-                    source_count=0,
-                    document_filter=document_filter,
-                    processing_time=time.time() - start_time,
-                    warning=None
-                )
-            else:
-                return QueryResponse(
-                    answer="Ik heb geen relevante informatie gevonden in je documenten. Probeer een andere vraag of upload meer documenten.",
-                    sources=[],
-                    source_count=0,
-                    document_filter=document_filter,
-                    processing_time=time.time() - start_time,
-                    warning=None
-                )
+        # Identieke vragen die tegelijk binnenkomen delen één zoekactie en LLM-aanroep
+        key = query_flight_key(query_request.question, document_filter, vectorstore.generation, llm.provider, cache_mode)
+        # Haakt de client af, dan stoppen zoeken en generatie (tenzij anderen meewachten)
+        # Een follower met ruimer budget dan de leader nog heeft, rekent zelf
+        result = await until_disconnected(request, query_flights.do(
+            key,
+            lambda: answer_question(query_request.question, document_filter, vectorstore, llm, deadline),
+            context=deadline,
+            joinable=lambda leader: deadline_policy.can_share(leader, deadline),
+            # De LLM-plek hoort bij de leader; een follower wordt vanaf hier bediend
+            on_join=mark_service_started
+        ), "query")
         
-        warning = None
-        result = {}
-        # Detecteer of de vraag om een samenvatting per document vraagt
-        if (
-            'samenvatting per document' in query_request.question.lower() or
-            'samenvatting van elk document' in query_request.question.lower() or
-            'per document een samenvatting' in query_request.question.lower()
-        ):
-            # Bouw context per document
-            doc_contexts = []
-            for i, source in enumerate(sources, 1):
-                doc_name = source['metadata'].get('original_filename') or f"Document {i}"
-                doc_contexts.append(f"Document {i} ({doc_name}):\n{source['content']}\n")
-            context = "\n\n".join(doc_contexts)
-            # Pas de prompt aan
-            question = query_request.question + "\n\nGeef per document een korte, duidelijke samenvatting."
-            answer = await llm.generate(question, context)
-            # Vul result voor consistentie met de rest van de code
-            formatted_sources = []
-            for i, source in enumerate(sources, 1):
-                formatted_sources.append({
-                    "id": i,
-                    "content": source['content'],
-                    "metadata": source.get('metadata', {}),
-                    "relevance": 1.0  # Default relevance voor samenvattingen
-                })
-            result = {"answer": answer, "sources": formatted_sources}
-        else:
-            # Standaard gedrag
-            context = "\n\n".join([s["content"] for s in sources])
-            try:
-                result = await asyncio.wait_for(
-                    llm.generate_with_sources(query_request.question, sources),
-                    timeout=180.0
-                )
-                answer = result["answer"]
-                print(f"[DEBUG] Ruwe LLM-antwoord: {answer}")
-            except asyncio.TimeoutError:
-                warning = "Het genereren van het antwoord duurde langer dan verwacht. Hier is een samenvatting van de gevonden bronnen."
-                answer = ""  # Geen antwoord, alleen warning tonen
-                print(f"[DEBUG] Timeout, geen antwoord.")
-            except Exception as llm_error:
-                warning = f"Er was een probleem met de AI-generatie: {str(llm_error)}. Hier is een samenvatting van de gevonden bronnen."
-                answer = ""  # Geen antwoord, alleen warning tonen
-                print(f"[DEBUG] Exception, geen antwoord.")
+        if not result["found"]:
+            return QueryResponse(
+                answer=no_sources_answer(document_filter),
+                sources=[],
+                source_count=0,
+                document_filter=document_filter,
+                processing_time=time.time() - start_time,
+                warning=result["warning"],
+                degradations=result["degradations"]
+            )
+        answer = result["answer"]
+        warning = result["warning"]
         
         processing_time = time.time() - start_time
         if processing_time > 60 and not warning:
@@ -158,7 +134,7 @@ async def query_documents(
                 user_id=current_user.id,
                 question=query_request.question,
                 answer=answer,
-                sources=json.dumps(result["sources"]) if result and 'sources' in result else json.dumps([])
+                sources=json.dumps(result["sources"])
             )
             db.add(db_query)
             db.commit()
@@ -168,8 +144,7 @@ async def query_documents(
         # Format sources for response, met deduplicatie
         seen = set()
         formatted_sources = []
-        sources_to_format = result["sources"] if result and 'sources' in result else []
-        for source in sources_to_format:
+        for source in result["sources"]:
             # Maak een unieke hash op basis van content en metadata
             unique_key = (source["content"], str(source.get("metadata", {})))
             if unique_key in seen:
@@ -183,22 +158,574 @@ async def query_documents(
                     relevance=source["relevance"]
                 )
             )
-        print(f"[DEBUG] API-response: answer='{answer}', warning='{warning}', processing_time={processing_time}, sources={len(formatted_sources)} uniek")
+        logger.debug("API-response: answer=%r, warning=%r, processing_time=%.2f, sources=%d uniek", answer, warning, processing_time, len(formatted_sources))
         return QueryResponse(
             answer=answer,
             sources=formatted_sources,
             source_count=len(formatted_sources),
             document_filter=document_filter,
             processing_time=processing_time,
-            warning=warning
+            warning=warning,
+            degradations=result["degradations"]
         )
         
+    except ClientDisconnected:
+        disconnected = True
+        return Response(status_code=CLIENT_CLOSED_REQUEST)
     except Exception as e:
         processing_time = time.time() - start_time
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error processing query: {str(e)}"
         )
+    finally:
+        # Afgebroken queries tellen niet mee in de latency-schatting
+        ticket.release(record_latency=not disconnected)
+
+async def until_disconnected(request: Request, work: Awaitable, endpoint: str) -> Any:
+    """Wacht op `work` en annuleer het zodra de client de verbinding verbreekt"""
+    task = asyncio.ensure_future(work)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_SECONDS)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                logger.debug("Client disconnected, query geannuleerd")
+                metrics.inc("query_cancelled_total", endpoint=endpoint)
+                raise ClientDisconnected()
+    finally:
+        if not task.done():
+            task.cancel()
+
+async def stream_until_disconnected(request: Request, source: AsyncGenerator, endpoint: str) -> AsyncGenerator:
+    """Geef de events van `source` door en breek hem af zodra de client weg is
+
+    De bron loopt in een eigen task, zodat ook het wachten op het eerste token
+    (waarin niets naar de client gaat) afgebroken kan worden.
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=1)
+    end = object()
+    finished = False
+
+    async def produce():
+        try:
+            async for item in source:
+                await queue.put((item, None))
+        except Exception as e:
+            await queue.put((end, e))
+            return
+        await queue.put((end, None))
+
+    producer = asyncio.ensure_future(produce())
+    try:
+        while True:
+            try:
+                item, error = await asyncio.wait_for(queue.get(), timeout=DISCONNECT_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                if await request.is_disconnected():
+                    logger.debug("Client disconnected, stream geannuleerd")
+                    return
+                continue
+            if item is end:
+                finished = True
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        if not finished:
+            # Client weg (of de response is afgebroken): stop de LLM-stream
+            producer.cancel()
+            metrics.inc("query_cancelled_total", endpoint=endpoint)
+
+def admit_query(current_user: User) -> AdmissionTicket:
+    """Weiger de query direct (429/503 met Retry-After) als de latency-SLO niet haalbaar is"""
+    try:
+        return admission.admit(current_user.id)
+    except AdmissionRejected as e:
+        raise HTTPException(
+            status_code=e.status_code,
+            detail=e.reason,
+            headers={"Retry-After": str(e.retry_after)}
+        )
+
+def query_flight_key(question: str, document_filter: Optional[str], generation: int, provider: str, cache_mode: str = "use") -> Tuple:
+    """Sleutel voor single-flight: genormaliseerde vraag, filter, indexversie, provider en cache-modus
+
+    Een request met cache-bypass haakt niet aan bij een gewone request (en andersom).
+    """
+    normalized = " ".join(question.lower().split())
+    return (normalized, document_filter or "", generation, provider, cache_mode)
+
+async def answer_question(question: str, document_filter: Optional[str], vectorstore, llm, deadline: Deadline) -> Dict[str, Any]:
+    """Zoek bronnen en genereer een antwoord binnen de deadline; het resultaat kan door meerdere requests gedeeld worden
+
+    Wordt de tijd krap, dan levert elke stap in (zie DeadlinePolicy); de
+    toegepaste degradaties staan in result["degradations"].
+    """
+    degradations = []
+    # Search for relevant documents (inclusief het embedden van de vraag)
+    try:
+        sources = await asyncio.wait_for(search_sources(vectorstore, question, document_filter), timeout=deadline.remaining())
+    except asyncio.TimeoutError:
+        record(degradations, "search_timeout")
+        warning = "Het zoeken in je documenten duurde te lang. Probeer het later opnieuw."
+        return {"found": False, "answer": "", "sources": [], "warning": warning, "degradations": degradations}
+    return await answer_from_sources(question, sources, vectorstore, llm, deadline, degradations)
+
+async def answer_from_sources(question: str, sources: List[Dict[str, Any]], vectorstore, llm, deadline: Deadline, degradations: List[str] = None) -> Dict[str, Any]:
+    """Genereer een antwoord op al gevonden bronnen (zie answer_question)"""
+    degradations = degradations if degradations is not None else []
+    if not sources:
+        return {"found": False, "answer": "", "sources": [], "warning": None, "degradations": degradations}
+    
+    # Context opbouwen: bij weinig resterende tijd minder chunks
+    sources = sources[:deadline_policy.context_chunks(deadline, degradations)]
+    
+    warning = None
+    result = {}
+    prompt_sources = sources
+    options = deadline_policy.generation_options(deadline, llm.provider, degradations)
+    # Detecteer of de vraag om een samenvatting (per document of een overzicht) vraagt
+    if is_summary_per_document(question) or is_overview_question(question):
+        # Vul result voor consistentie met de rest van de code
+        formatted_sources = []
+        for i, source in enumerate(sources, 1):
+            formatted_sources.append({
+                "id": i,
+                "content": source['content'],
+                "metadata": source.get('metadata', {}),
+                "relevance": 1.0  # Default relevance voor samenvattingen
+            })
+        result = {"sources": formatted_sources}
+        if options is not None and "model" not in options and cascade.enabled(llm.provider):
+            # Samenvattingen over meerdere documenten gaan altijd naar het grote model
+            options["model"] = cascade.model_for(llm.provider, "large")
+        # Bij ingestion opgeslagen samenvattingen gaan voor; alleen de rest gaat naar de LLM
+        stored = await run_in_threadpool(load_stored_summaries, source_document_ids(sources))
+        # Map-reduce: elk document apart (gelijktijdig, met cache), daarna samengevoegd
+        generation = summarize_per_document(llm, vectorstore, sources, stored, **options) if options is not None else None
+    else:
+        # Standaard gedrag
+        result = {"sources": format_sources(sources)}
+        if options is not None:
+            # Alleen de relevante zinnen gaan het prompt in; de getoonde bronnen blijven volledig
+            prompt_sources = await run_in_threadpool(compress_sources, vectorstore, question, sources)
+            # De cascade kiest klein of groot model en escaleert bij een zwak antwoord
+            generation = cascade.generate_with_sources(llm, question, prompt_sources, **options)
+        else:
+            generation = None
+    
+    if generation is None:
+        warning = "Er was te weinig tijd om een antwoord te genereren. Hier zijn de gevonden bronnen."
+        answer = ""
+    else:
+        try:
+            answer = await asyncio.wait_for(generation, timeout=deadline.remaining())
+            if isinstance(answer, dict):
+                # generate_with_sources geeft ook de geformatteerde bronnen terug
+                result = answer
+                answer = result["answer"]
+                if prompt_sources is not sources:
+                    # Niet de gecomprimeerde maar de volledige chunks tonen
+                    result["sources"] = format_sources(sources)
+            logger.debug("Ruwe LLM-antwoord: %s", answer)
+        except asyncio.TimeoutError:
+            record(degradations, "generation_timeout")
+            warning = "Het genereren van het antwoord duurde langer dan verwacht. Hier is een samenvatting van de gevonden bronnen."
+            answer = ""  # Geen antwoord, alleen warning tonen
+            logger.debug("Timeout, geen antwoord")
+        except Exception as llm_error:
+            warning = f"Er was een probleem met de AI-generatie: {str(llm_error)}. Hier is een samenvatting van de gevonden bronnen."
+            answer = ""  # Geen antwoord, alleen warning tonen
+            logger.debug("Exception, geen antwoord: %s", llm_error)
+    
+    return {
+        "found": True,
+        "answer": answer,
+        "sources": result["sources"] if result and 'sources' in result else [],
+        "warning": warning,
+        "degradations": degradations
+    }
+
+@router.post("/query/stream")
+async def query_documents_stream(
+    query_request: QueryRequest,
+    request: Request,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Stel een vraag en ontvang eerst de bronnen en daarna het antwoord token voor token (SSE)
+
+    Events: 'sources', daarna 'token' per stuk tekst en tot slot 'done' met
+    query_id, processing_time en time_to_first_token.
+    """
+    start_time = time.time()
+    check_query_limit(db, current_user)
+    set_llm_caller(current_user)
+    set_llm_cache_mode(request.headers)
+    document_filter = resolve_document_filter(db, current_user, query_request.document_id)
+    user_id = current_user.id
+    ticket = admit_query(current_user)
+    
+    try:
+        # Zoeken gebeurt buiten de event loop; het laden van de store is synchroon werk
+        vectorstore = await run_in_threadpool(get_vectorstore)
+        sources = await until_disconnected(request, search_sources(vectorstore, query_request.question, document_filter), "stream")
+        llm = get_llm()
+    except ClientDisconnected:
+        ticket.release(record_latency=False)
+        return Response(status_code=CLIENT_CLOSED_REQUEST)
+    except BaseException:
+        ticket.release()
+        raise
+    provider = llm.provider
+    
+    async def events():
+        try:
+            async for event in stream_until_disconnected(request, stream_answer(), "stream"):
+                yield event
+        finally:
+            ticket.release()
+    
+    async def stream_answer():
+        formatted_sources = dedupe_sources(format_sources(sources))
+        yield sse_event("sources", {
+            "sources": formatted_sources,
+            "source_count": len(formatted_sources),
+            "document_filter": document_filter
+        })
+        
+        if not sources:
+            yield sse_event("token", {"text": no_sources_answer(document_filter)})
+            yield sse_event("done", {"query_id": None, "processing_time": time.time() - start_time, "time_to_first_token": None})
+            return
+        
+        if is_summary_per_document(query_request.question) or is_overview_question(query_request.question):
+            # Per document een stuk tekst zodra die samenvatting klaar is
+            stored = await run_in_threadpool(load_stored_summaries, source_document_ids(sources))
+            texts = stream_per_document(llm, vectorstore, sources, stored)
+        else:
+            prompt_sources = await run_in_threadpool(compress_sources, vectorstore, query_request.question, sources)
+            texts = llm.generate_streaming(query_request.question, "\n\n".join([s["content"] for s in prompt_sources]))
+        
+        parts = []
+        time_to_first_token = None
+        async for text in texts:
+            if not text:
+                continue
+            if time_to_first_token is None:
+                time_to_first_token = time.time() - start_time
+                metrics.observe("llm_time_to_first_token_seconds", time_to_first_token, provider=provider)
+            parts.append(text)
+            yield sse_event("token", {"text": text})
+        
+        processing_time = time.time() - start_time
+        metrics.observe("query_stream_duration_seconds", processing_time, provider=provider)
+        query_id = await run_in_threadpool(save_query, user_id, query_request.question, "".join(parts), formatted_sources)
+        yield sse_event("done", {
+            "query_id": query_id,
+            "processing_time": processing_time,
+            "time_to_first_token": time_to_first_token
+        })
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        # Vangnet als de stream nooit gestart wordt; release() is idempotent
+        background=BackgroundTask(ticket.release)
+    )
+
+@router.post("/query/batch")
+async def query_documents_batch(
+    batch_request: BatchQueryRequest,
+    request: Request,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Stel een lijst vragen in één request; de antwoorden komen als NDJSON zodra ze klaar zijn
+
+    Alle vragen worden in één keer ge-embed en doorzocht, daarna wordt
+    begrensd parallel gegenereerd. Elke regel bevat de index van de vraag;
+    vragen boven het daglimiet of die mislukten krijgen een regel met
+    "error". De laatste regel is {"done": true, ...}. Elke beantwoorde vraag
+    telt als query; het limiet wordt vlak voor het opslaan opnieuw gecontroleerd,
+    zodat gelijktijdige batches het samen niet overschrijden.
+    """
+    start_time = time.time()
+    questions = batch_request.questions
+    if not questions:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No questions provided")
+    if len(questions) > QUERY_BATCH_MAX_QUESTIONS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Too many questions ({len(questions)}); the maximum per batch is {QUERY_BATCH_MAX_QUESTIONS}"
+        )
+    
+    # Alleen zoveel vragen als het daglimiet nog toelaat; de rest wordt niet verwerkt
+    check_query_limit(db, current_user)
+    allowed = int(min(len(questions), remaining_queries(db, current_user)))
+    set_llm_caller(current_user)
+    cache_mode = set_llm_cache_mode(request.headers)
+    document_filter = resolve_document_filter(db, current_user, batch_request.document_id)
+    user_id = current_user.id
+    queries_per_day = current_user.get_tier_limits()["queries_per_day"]
+    limit_message = query_limit_message(current_user)
+    # Eén plek in de admission control voor de hele batch; de concurrency begrenst hij zelf
+    ticket = admit_query(current_user)
+    
+    try:
+        vectorstore = await run_in_threadpool(get_vectorstore)
+        all_sources = await until_disconnected(request, search_sources_batch(vectorstore, questions[:allowed], document_filter), "batch")
+        llm = get_llm()
+    except ClientDisconnected:
+        ticket.release(record_latency=False)
+        return Response(status_code=CLIENT_CLOSED_REQUEST)
+    except BaseException:
+        ticket.release(record_latency=False)
+        raise
+    semaphore = asyncio.Semaphore(max(QUERY_BATCH_CONCURRENCY, 1))
+    
+    async def answer(index: int) -> Tuple[str, Dict[str, Any]]:
+        question = questions[index]
+        async with semaphore:
+            started = time.time()
+            # De deadline loopt pas vanaf het moment dat de vraag aan de beurt is
+            deadline = deadline_policy.deadline(batch_request.deadline_seconds)
+            key = query_flight_key(question, document_filter, vectorstore.generation, llm.provider, cache_mode)
+            result = await query_flights.do(
+                key,
+                lambda: answer_from_sources(question, all_sources[index], vectorstore, llm, deadline),
+                context=deadline,
+                joinable=lambda leader: deadline_policy.can_share(leader, deadline),
+                on_join=mark_service_started
+            )
+        formatted_sources = dedupe_sources(result["sources"])
+        query_id = None
+        if result["found"]:
+            saved, query_id = await run_in_threadpool(
+                save_query_within_limit, user_id, queries_per_day, question, result["answer"], result["sources"]
+            )
+            if not saved:
+                return "limit", {"index": index, "question": question, "error": limit_message}
+        return "answered", {
+            "index": index,
+            "question": question,
+            "answer": result["answer"] if result["found"] else no_sources_answer(document_filter),
+            "sources": formatted_sources,
+            "source_count": len(formatted_sources),
+            "warning": result["warning"],
+            "degradations": result["degradations"],
+            "query_id": query_id,
+            "processing_time": time.time() - started
+        }
+    
+    async def answer_or_error(index: int) -> Tuple[str, Dict[str, Any]]:
+        try:
+            return await answer(index)
+        except Exception as e:
+            logger.warning("Batch question failed: %s", e)
+            return "error", {"index": index, "question": questions[index], "error": f"Error processing question: {str(e)}"}
+    
+    async def lines():
+        counts = {"answered": 0, "error": 0, "limit": len(questions) - allowed}
+        for index in range(allowed, len(questions)):
+            yield ndjson_line({"index": index, "question": questions[index], "error": limit_message})
+        tasks = [asyncio.ensure_future(answer_or_error(index)) for index in range(allowed)]
+        try:
+            for task in asyncio.as_completed(tasks):
+                outcome, line = await task
+                counts[outcome] += 1
+                yield ndjson_line(line)
+        finally:
+            for task in tasks:
+                task.cancel()
+        for outcome, count in counts.items():
+            metrics.inc("query_batch_questions_total", count, result=outcome)
+        yield ndjson_line({
+            "done": True,
+            "count": len(questions),
+            "answered": counts["answered"],
+            "failed": counts["error"],
+            "rejected": counts["limit"],
+            "document_filter": document_filter,
+            "processing_time": time.time() - start_time
+        })
+    
+    async def events():
+        try:
+            async for line in stream_until_disconnected(request, lines(), "batch"):
+                yield line
+        finally:
+            # Een batch is geen losse query; zijn duur hoort niet in de latency-schatting
+            ticket.release(record_latency=False)
+    
+    return StreamingResponse(
+        events(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(ticket.release, record_latency=False)
+    )
+
+async def search_sources(vectorstore, question: str, document_filter: Optional[str]) -> List[Dict[str, Any]]:
+    """Zoek in een thread; bij annuleren stopt de zoekactie na de lopende stap"""
+    cancelled = threading.Event()
+    try:
+        return await run_in_threadpool(vectorstore.search, question, 10, document_filter or "", cancelled)
+    except asyncio.CancelledError:
+        cancelled.set()
+        raise
+
+async def search_sources_batch(vectorstore, questions: List[str], document_filter: Optional[str]) -> List[List[Dict[str, Any]]]:
+    """Zoek voor alle vragen in één vectorized zoekactie in een thread"""
+    cancelled = threading.Event()
+    try:
+        return await run_in_threadpool(vectorstore.search_batch, questions, 10, document_filter or "", cancelled)
+    except asyncio.CancelledError:
+        cancelled.set()
+        raise
+
+def check_query_limit(db: Session, current_user: User):
+    """Controleer het dagelijkse query limiet van de tier"""
+    if remaining_queries(db, current_user) <= 0:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail=query_limit_message(current_user)
+        )
+
+def remaining_queries(db: Session, current_user: User) -> float:
+    """Aantal queries dat de gebruiker vandaag nog mag doen (inf zonder limiet)"""
+    tier_limits = current_user.get_tier_limits()
+    if tier_limits["queries_per_day"] == float('inf'):
+        return float('inf')
+    return max(tier_limits["queries_per_day"] - queries_today(db, current_user.id), 0)
+
+def queries_today(db: Session, user_id: int) -> int:
+    """Aantal queries van de gebruiker sinds middernacht (UTC)"""
+    today = datetime.utcnow().date()
+    return db.query(Query).filter(
+        Query.user_id == user_id,
+        Query.created_at >= today
+    ).count()
+
+def query_limit_message(current_user: User) -> str:
+    limit = current_user.get_tier_limits()["queries_per_day"]
+    return f"Daily query limit reached ({limit} queries per day). Upgrade for more queries."
+
+def resolve_document_filter(db: Session, current_user: User, document_id: Optional[int]) -> Optional[str]:
+    """Geef de bestandsnaam om op te filteren, na controle dat het document van de gebruiker is"""
+    if not document_id:
+        return None
+    
+    # Verify document exists and belongs to user
+    document = db.query(Document).filter(
+        Document.id == document_id,
+        Document.user_id == current_user.id
+    ).first()
+    
+    if not document:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Document not found or access denied"
+        )
+    
+    return document.original_filename
+
+def no_sources_answer(document_filter: Optional[str]) -> str:
+    if document_filter:
+        return f"Ik heb geen relevante informatie gevonden in het document '{document_filter}'. Probeer een andere vraag of een ander document."
+    return "Ik heb geen relevante informatie gevonden in je documenten. Probeer een andere vraag of upload meer documenten."
+
+def is_summary_per_document(question: str) -> bool:
+    """Detecteer of de vraag om een samenvatting per document vraagt"""
+    question = question.lower()
+    return (
+        'samenvatting per document' in question or
+        'samenvatting van elk document' in question or
+        'per document een samenvatting' in question
+    )
+
+# Alleen expliciete verzoeken om het document als geheel; "Waar gaat de huurverhoging in?" of
+# "Geef een overzicht van de bedragen" zijn gewone vragen en gaan via retrieval
+DOCUMENT_REFERENCE = r"(?:dit|het|de|deze|dat|alle|mijn|elk|ieder)\s+(?:document|documenten|bestand|bestanden|contract|stuk|stukken)"
+OVERVIEW_PATTERNS = [re.compile(pattern) for pattern in (
+    rf"^(?:kun je |kan je |wil je )?(?:geef|maak|schrijf)(?: me| mij)? (?:een )?(?:korte |beknopte )?samenvatting(?: van {DOCUMENT_REFERENCE})?$",
+    rf"^(?:kun je |kan je |wil je )?(?:geef|maak)(?: me| mij)? (?:een )?overzicht van {DOCUMENT_REFERENCE}$",
+    rf"^(?:kun je |kan je |wil je )?vat {DOCUMENT_REFERENCE} samen$",
+    rf"^waar(?:over)? gaat {DOCUMENT_REFERENCE}(?: over)?$",
+    rf"^(?:kun|kan|wil) je(?: me| mij)? (?:een )?(?:korte |beknopte )?samenvatting(?: van {DOCUMENT_REFERENCE})? (?:geven|maken)$",
+)]
+
+def is_overview_question(question: str) -> bool:
+    """Detecteer of de vraag expliciet om een samenvatting of overzicht van de documenten zelf vraagt"""
+    question = " ".join(question.lower().split()).rstrip("?!. ")
+    return any(pattern.match(question) for pattern in OVERVIEW_PATTERNS)
+
+def source_document_ids(sources: List[Dict[str, Any]]) -> List[int]:
+    return [source.get('metadata', {}).get('document_id') for source in sources]
+
+def format_sources(sources: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Format bronnen voor weergave, zoals de LLM providers dat doen"""
+    return [
+        {
+            "id": i,
+            "content": source['content'][:200] + "..." if len(source['content']) > 200 else source['content'],
+            "metadata": source.get('metadata', {}),
+            "relevance": 1 - source.get('distance', 0)  # Convert distance to relevance score
+        }
+        for i, source in enumerate(sources, 1)
+    ]
+
+def dedupe_sources(sources: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Verwijder bronnen met dezelfde content en metadata"""
+    seen = set()
+    unique = []
+    for source in sources:
+        unique_key = (source["content"], str(source.get("metadata", {})))
+        if unique_key in seen:
+            continue
+        seen.add(unique_key)
+        unique.append(source)
+    return unique
+
+def save_query(user_id: int, question: str, answer: str, sources: List[Dict[str, Any]]) -> Optional[int]:
+    """Sla een query op met een eigen sessie (de request sessie is dan al gesloten)"""
+    db = SessionLocal()
+    try:
+        db_query = Query(user_id=user_id, question=question, answer=answer, sources=json.dumps(sources))
+        db.add(db_query)
+        db.commit()
+        return db_query.id
+    except Exception as db_error:
+        print(f"Warning: Could not save query to database: {db_error}")
+        db.rollback()
+        return None
+    finally:
+        db.close()
+
+# Tellen en opslaan onder één lock, zodat gelijktijdige batches samen het daglimiet niet overschrijden
+_query_quota_lock = threading.Lock()
+
+def save_query_within_limit(user_id: int, queries_per_day: float, question: str, answer: str, sources: List[Dict[str, Any]]) -> Tuple[bool, Optional[int]]:
+    """Sla een query op als het daglimiet dat nog toelaat; geeft (toegestaan, query_id)"""
+    with _query_quota_lock:
+        if queries_per_day != float('inf'):
+            db = SessionLocal()
+            try:
+                if queries_today(db, user_id) >= queries_per_day:
+                    return False, None
+            finally:
+                db.close()
+        return True, save_query(user_id, question, answer, sources)
+
+def ndjson_line(data: Dict[str, Any]) -> str:
+    return json.dumps(data, ensure_ascii=False) + "\n"
+
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    """Formatteer één server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
 
 @router.get("/queries", response_model=List[Dict[str, Any]])
 def get_query_history(
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Benchmark: offset-based chunker tegenover de oude string-concatenatie splitter
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rag.document_processor import DocumentProcessor
+
+WORDS = (
+    "de het een huurder verhuurder servicekosten factuur bedrag totaal periode "
+    "betaling voorschot afrekening woning contract jaar maand euro korting "
+    "onderhoud verwarming water elektra schoonmaak tuin lift"
+).split()
+
+def legacy_split_into_chunks(text):
+    """Kopie van de oorspronkelijke DocumentProcessor._split_into_chunks"""
+    if not text:
+        return []
+    chunks = []
+    paragraphs = re.split(r'\n\s*\n', text)
+    current_chunk = ""
+    for paragraph in paragraphs:
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if len(current_chunk) + len(paragraph) > 3000:
+            if current_chunk:
+                chunks.append(current_chunk.strip())
+            current_chunk = paragraph
+        else:
+            if current_chunk:
+                current_chunk += "\n\n" + paragraph
+            else:
+                current_chunk = paragraph
+    if current_chunk:
+        chunks.append(current_chunk.strip())
+    if len(chunks) < 2:
+        chunks = []
+        sentences = re.split(r'[.!?]+', text)
+        current_chunk = ""
+        for sentence in sentences:
+            sentence = sentence.strip()
+            if not sentence:
+                continue
+            if len(current_chunk) + len(sentence) > 3000:
+                if current_chunk:
+                    chunks.append(current_chunk.strip())
+                current_chunk = sentence
+            else:
+                if current_chunk:
+                    current_chunk += ". " + sentence
+                else:
+                    current_chunk = sentence
+        if current_chunk:
+            chunks.append(current_chunk.strip())
+    if not chunks:
+        chunks = [text[i:i+3000] for i in range(0, len(text), 2500)]
+    return [chunk.strip() for chunk in chunks if len(chunk.strip()) > 50]
+
+def make_pages(page_count, words_per_page, seed=42):
+    """Genereer opgeschoonde pagina's zoals _clean_text ze oplevert (geen newlines)"""
+    rng = random.Random(seed)
+    pages = []
+    for _ in range(page_count):
+        sentences = []
+        remaining = words_per_page
+        while remaining > 0:
+            length = min(rng.randint(6, 20), remaining)
+            sentences.append(" ".join(rng.choice(WORDS) for _ in range(length)).capitalize() + ".")
+            remaining -= length
+        pages.append(" ".join(sentences))
+    return pages
+
+def timed(func, repeat):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", type=int, default=500)
+    parser.add_argument("--words-per-page", type=int, default=450)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    pages = make_pages(args.pages, args.words_per_page)
+    megabytes = sum(len(page) for page in pages) / 1e6
+    print(f"Corpus: {args.pages} pagina's, {megabytes:.2f} MB tekst")
+
+    processor = DocumentProcessor()
+    # Opschonen valt buiten de meting; alleen het splitsen wordt vergeleken
+    legacy_text = processor._clean_text("\n\n".join(pages))
+    text, page_starts = processor._join_pages([processor._clean_text(page) for page in pages])
+
+    def legacy():
+        return legacy_split_into_chunks(legacy_text)
+
+    def offsets():
+        return processor._chunk_spans(text, page_starts)
+
+    for name, func in [("legacy", legacy), ("offset/chars", offsets)]:
+        seconds, chunks = timed(func, args.repeat)
+        print(f"{name:>14}: {seconds * 1000:8.1f} ms  {megabytes / seconds:6.1f} MB/s  {len(chunks)} chunks")
+
+    processor.chunk_unit = 'tokens'
+    processor.chunk_size, processor.chunk_overlap = 400, 40
+    seconds, chunks = timed(offsets, args.repeat)
+    print(f"{'offset/tokens':>14}: {seconds * 1000:8.1f} ms  {megabytes / seconds:6.1f} MB/s  {len(chunks)} chunks")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Benchmark: extractieve contextcompressie voor het genereren
+
+Zoekt per vraag de bronnen in de vectorstore en meet hoeveel kleiner de
+context wordt en hoe lang de compressie duurt. Met --provider wordt ook het
+antwoord gegenereerd, één keer met de volledige chunks en één keer met de
+gecomprimeerde, zodat het effect op de end-to-end latency zichtbaar is
+(OpenAI: minder input tokens, Ollama: kortere prefill).
+
+Voorbeeld:
+    python benchmarks/bench_compression.py --questions vragen.txt --provider ollama
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rag.vectorstore import EmbeddingVectorStore, DEFAULT_STORAGE_PATH
+from rag.compression import ContextCompressor
+from rag.llm import get_llm, close_llms
+
+DEFAULT_QUESTIONS = [
+    "Wat is de huurprijs per maand?",
+    "Hoe hoog zijn de servicekosten?",
+    "Wanneer moet de huur betaald worden?",
+    "Wie is verantwoordelijk voor het onderhoud?",
+    "Wat is de opzegtermijn?",
+    "Hoeveel borg moet er betaald worden?"
+]
+
+def load_questions(path: str):
+    if not path:
+        return DEFAULT_QUESTIONS
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+async def timed_generation(llm, question, sources) -> float:
+    start = time.perf_counter()
+    await llm.generate_with_sources(question, sources)
+    return time.perf_counter() - start
+
+async def run(args):
+    vectorstore = EmbeddingVectorStore(args.store)
+    compressor = ContextCompressor(vectorstore.model, budget_chars=args.budget, neighbours=args.neighbours)
+    llm = get_llm(args.provider) if args.provider else None
+
+    ratios, seconds, full_latency, compressed_latency = [], [], [], []
+    try:
+        for question in load_questions(args.questions):
+            sources = vectorstore.search(question, args.chunks)
+            if not sources:
+                print(f"  (geen bronnen) {question}")
+                continue
+            # Zinnen worden per chunk één keer ge-embed; latere vragen over dezelfde chunks komen uit de cache
+            start = time.perf_counter()
+            compressed = compressor.compress(question, sources)
+            seconds.append(time.perf_counter() - start)
+            before = sum(len(s["content"]) for s in sources)
+            after = sum(len(s["content"]) for s in compressed)
+            ratios.append(after / before)
+            line = f"  {before:6d} -> {after:6d} tekens ({after / before:.0%}) in {seconds[-1] * 1000:.0f}ms"
+            if llm:
+                full_latency.append(await timed_generation(llm, question, sources))
+                compressed_latency.append(await timed_generation(llm, question, compressed))
+                line += f"  genereren {full_latency[-1]:.2f}s -> {compressed_latency[-1]:.2f}s"
+            print(f"{line}  {question}")
+    finally:
+        await close_llms()
+
+    if not ratios:
+        print("Geen vragen met bronnen; is de vectorstore gevuld?")
+        return
+    print("")
+    print(f"Vragen:        {len(ratios)} (budget {args.budget} tekens, {args.neighbours} buurzinnen)")
+    print(f"Compressie:    gemiddeld {statistics.mean(ratios):.0%} van de oorspronkelijke context")
+    print(f"Duur:          mediaan {statistics.median(seconds) * 1000:.0f}ms, max {max(seconds) * 1000:.0f}ms")
+    if full_latency:
+        full, compressed = statistics.median(full_latency), statistics.median(compressed_latency)
+        print(f"End-to-end:    mediaan {full:.2f}s -> {compressed:.2f}s ({(compressed - full) / full:+.0%}, "
+              f"incl. compressie {compressed + statistics.median(seconds):.2f}s)")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--store", default=DEFAULT_STORAGE_PATH, help="Pad van de vectorstore")
+    parser.add_argument("--questions", help="Bestand met één vraag per regel")
+    parser.add_argument("--chunks", type=int, default=10, help="Aantal bronnen per vraag")
+    parser.add_argument("--budget", type=int, default=4000, help="Contextbudget in tekens")
+    parser.add_argument("--neighbours", type=int, default=1, help="Buurzinnen aan weerszijden")
+    parser.add_argument("--provider", help="LLM provider om ook de generatie te meten (bijv. ollama, openai)")
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Benchmark: OCR pagina's per seconde per engine (pytesseract subprocess vs in-process tesserocr)
+
+Als fixture worden de pagina's van een PDF als afbeelding gerenderd, zodat ze
+zich gedragen als gescande pagina's zonder tekstlaag.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pdf2image import convert_from_path
+from rag.document_processor import OCR_ENGINES
+
+DEFAULT_FIXTURE = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "documents", "1_Brief aan DGW nav servicekosten 1 juli 2025.pdf"
+)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("pdf", nargs="?", default=DEFAULT_FIXTURE, help="PDF om als gescande fixture te gebruiken")
+    parser.add_argument("--pages", type=int, default=20, help="Aantal pagina's (fixture wordt herhaald)")
+    parser.add_argument("--dpi", type=int, default=200)
+    parser.add_argument("--lang", default="nld+eng")
+    args = parser.parse_args()
+
+    images = convert_from_path(args.pdf, dpi=args.dpi)
+    pages = [images[i % len(images)] for i in range(args.pages)]
+    print(f"Fixture: {args.pdf} ({len(images)} pagina's, herhaald tot {len(pages)})")
+
+    for name, engine_class in OCR_ENGINES.items():
+        try:
+            start = time.perf_counter()
+            engine = engine_class(args.lang)
+            startup = time.perf_counter() - start
+        except Exception as e:
+            print(f"{name:>12}: niet beschikbaar ({e})")
+            continue
+
+        start = time.perf_counter()
+        characters = sum(len(engine.image_to_string(page)) for page in pages)
+        seconds = time.perf_counter() - start
+        print(f"{name:>12}: {len(pages) / seconds:6.2f} pagina's/s  (start {startup * 1000:.0f} ms, {characters} tekens)")
+
+if __name__ == "__main__":
+    main()
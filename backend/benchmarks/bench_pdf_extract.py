@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Benchmark: extractie van de tekstlaag van een grote PDF, serieel vs parallel
+
+De fixture wordt opgebouwd door de pagina's van een bestaande PDF te herhalen.
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PyPDF2 import PdfReader, PdfWriter
+from rag.document_processor import DocumentProcessor
+
+DEFAULT_FIXTURE = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "documents", "1_Brief aan DGW nav servicekosten 1 juli 2025.pdf"
+)
+
+def build_fixture(source: str, pages: int) -> str:
+    reader = PdfReader(source)
+    writer = PdfWriter()
+    for i in range(pages):
+        writer.add_page(reader.pages[i % len(reader.pages)])
+    fd, path = tempfile.mkstemp(suffix=".pdf")
+    with os.fdopen(fd, "wb") as f:
+        writer.write(f)
+    return path
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("pdf", nargs="?", default=DEFAULT_FIXTURE, help="PDF om als fixture te gebruiken")
+    parser.add_argument("--pages", type=int, default=500, help="Aantal pagina's van de fixture")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, os.cpu_count() or 1])
+    args = parser.parse_args()
+
+    path = build_fixture(args.pdf, args.pages)
+    print(f"Fixture: {args.pages} pagina's, {os.path.getsize(path) / (1024 * 1024):.1f} MB")
+    try:
+        baseline = None
+        for workers in sorted(set(args.workers)):
+            processor = DocumentProcessor()
+            processor.pdf_workers = workers
+            processor.ocr_cache.max_bytes = 0  # Alleen de tekstlaag meten
+            with contextlib.redirect_stdout(io.StringIO()):
+                if workers > 1:
+                    # Start de pool vooraf; opstarten van workers hoort niet bij de meting
+                    processor._extract_pages(path)
+                start = time.perf_counter()
+                pages = processor._extract_pages(path)
+                seconds = time.perf_counter() - start
+            baseline = baseline or seconds
+            print(f"{workers:>3} workers: {seconds:6.2f}s  {len(pages) / seconds:7.1f} pagina's/s  (x{baseline / seconds:.2f})")
+    finally:
+        os.remove(path)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+Nep LLM-server: Ollama /api/generate en OpenAI /v1/chat/completions
+
+Spreekt dezelfde protocollen als de echte providers (NDJSON-streaming voor
+Ollama, SSE voor OpenAI), zodat het hele querypad inclusief HTTP-pooling,
+streaming, retries en timeouts zonder netwerk te testen en te benchmarken
+is. Time-to-first-token, tokens per seconde, jitter, foutpercentage en
+vastlopers zijn instelbaar; met een vaste --seed zijn antwoorden en
+vertragingen reproduceerbaar.
+
+Voorbeeld:
+    python benchmarks/fake_llm_server.py --port 11434 --ttft 0.5 --tps 30 --error-rate 0.05
+    LLM_PROVIDER=ollama OLLAMA_BASE_URL=http://localhost:11434 uvicorn main:app
+    LLM_PROVIDER=openai OPENAI_API_KEY=x OPENAI_BASE_URL=http://localhost:11434/v1 uvicorn main:app
+
+In een testproces kan create_app(FakeLLMConfig(...)) direct met uvicorn of
+een TestClient gebruikt worden.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Any, AsyncGenerator, Dict, List
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+WORDS = (
+    "de huurder betaalt maandelijks een voorschot voor servicekosten en de verhuurder "
+    "stelt jaarlijks een afrekening op waarin het totaalbedrag per periode staat vermeld"
+).split()
+
+@dataclass
+class FakeLLMConfig:
+    ttft: float = 0.3  # seconden tot het eerste token (prefill)
+    tokens_per_second: float = 40.0
+    tokens: int = 60  # antwoordlengte als het verzoek geen maximum geeft
+    jitter: float = 0.1  # relatieve spreiding op alle vertragingen
+    error_rate: float = 0.0  # kans op een 500 (of error_status)
+    error_status: int = 500
+    stall_rate: float = 0.0  # kans dat een verzoek blijft hangen (timeouts testen)
+    stall_seconds: float = 600.0
+    load_seconds: float = 0.0  # laadtijd als een model voor het eerst (of na keep_alive) gevraagd wordt
+    seed: int = 0
+    loaded: Dict[str, float] = field(default_factory=dict)
+
+    def __post_init__(self):
+        # Fouten en vastlopers volgen één reeks per server: reproduceerbaar, en een retry van
+        # hetzelfde prompt kan wel slagen
+        self.events = random.Random(self.seed)
+
+    def rng(self, prompt: str) -> random.Random:
+        """Per prompt een eigen, reproduceerbare random generator"""
+        digest = hashlib.sha256(f"{self.seed}:{prompt}".encode("utf-8")).digest()
+        return random.Random(int.from_bytes(digest[:8], "big"))
+
+    def delay(self, rng: random.Random, seconds: float) -> float:
+        return max(0.0, seconds * (1 + rng.uniform(-self.jitter, self.jitter)))
+
+class FakeLLM:
+    """Gedrag van één verzoek: fout, vastlopen, laden, prefill en tokens"""
+    def __init__(self, config: FakeLLMConfig, model: str, prompt: str, max_tokens: int = None, keep_alive: float = 300.0):
+        self.config = config
+        self.model = model
+        self.prompt = prompt
+        self.rng = config.rng(prompt)
+        # max_tokens/num_predict is een bovengrens, geen doel
+        self.max_tokens = min(max_tokens, config.tokens) if max_tokens else config.tokens
+        self.keep_alive = keep_alive
+        self.fails = config.events.random() < config.error_rate
+        self.stalls = config.events.random() < config.stall_rate
+        self.load_duration = 0.0
+        self.prompt_eval_duration = 0.0
+        self.eval_duration = 0.0
+
+    @property
+    def prompt_tokens(self) -> int:
+        return max(1, len(self.prompt) // 4)
+
+    def words(self) -> List[str]:
+        return [self.rng.choice(WORDS) for _ in range(self.max_tokens)]
+
+    async def prefill(self, load_only: bool = False):
+        if self.stalls:
+            await asyncio.sleep(self.config.stall_seconds)
+        now = time.monotonic()
+        expires = self.config.loaded.get(self.model)
+        if self.config.load_seconds and (expires is None or expires < now):
+            self.load_duration = self.config.delay(self.rng, self.config.load_seconds)
+            await asyncio.sleep(self.load_duration)
+        if load_only:
+            return
+        self.prompt_eval_duration = self.config.delay(self.rng, self.config.ttft)
+        await asyncio.sleep(self.prompt_eval_duration)
+
+    async def tokens(self) -> AsyncGenerator[str, None]:
+        await self.prefill()
+        for i, word in enumerate(self.words()):
+            seconds = self.config.delay(self.rng, 1 / self.config.tokens_per_second) if i else 0.0
+            self.eval_duration += seconds
+            await asyncio.sleep(seconds)
+            yield word if i == 0 else " " + word
+        self.config.loaded[self.model] = time.monotonic() + self.keep_alive
+
+    def stats(self) -> Dict[str, Any]:
+        """Statistieken zoals Ollama ze in het laatste antwoord meestuurt (nanoseconden)"""
+        ns = lambda seconds: int(seconds * 1e9)
+        return {
+            "total_duration": ns(self.load_duration + self.prompt_eval_duration + self.eval_duration),
+            "load_duration": ns(self.load_duration),
+            "prompt_eval_count": self.prompt_tokens,
+            "prompt_eval_duration": ns(self.prompt_eval_duration),
+            "eval_count": self.max_tokens,
+            "eval_duration": ns(self.eval_duration)
+        }
+
+def parse_keep_alive(value: Any) -> float:
+    """Ollama keep_alive ('30m', '10s', '-1', 300) in seconden"""
+    if value is None:
+        return 300.0
+    if isinstance(value, (int, float)):
+        return float("inf") if value < 0 else float(value)
+    value = str(value).strip()
+    units = {"s": 1, "m": 60, "h": 3600}
+    if value and value[-1] in units:
+        return float(value[:-1]) * units[value[-1]]
+    seconds = float(value)
+    return float("inf") if seconds < 0 else seconds
+
+def create_app(config: FakeLLMConfig = None) -> FastAPI:
+    config = config or FakeLLMConfig()
+    app = FastAPI(title="Fake LLM server")
+    app.state.config = config
+    app.state.requests = 0
+
+    def error(body: Dict[str, Any]) -> JSONResponse:
+        return JSONResponse(body, status_code=config.error_status)
+
+    @app.post("/api/generate")
+    async def ollama_generate(request: Request):
+        app.state.requests += 1
+        payload = await request.json()
+        model = payload.get("model", "fake")
+        prompt = payload.get("prompt", "")
+        options = payload.get("options") or {}
+        llm = FakeLLM(config, model, prompt, options.get("num_predict"), parse_keep_alive(payload.get("keep_alive")))
+        if llm.fails:
+            return error({"error": "fake server error"})
+        if not prompt:
+            # Leeg prompt: alleen het model laden (warm-up)
+            llm.max_tokens = 0
+            await llm.prefill(load_only=True)
+            config.loaded[model] = time.monotonic() + llm.keep_alive
+            return {"model": model, "response": "", "done": True, "done_reason": "load", **llm.stats()}
+        if num_ctx := options.get("num_ctx"):
+            # Net als Ollama: een te lang prompt wordt stil afgekapt
+            llm.prompt = prompt[-num_ctx * 4:]
+
+        if not payload.get("stream", True):
+            text = "".join([token async for token in llm.tokens()])
+            return {"model": model, "response": text, "done": True, "done_reason": "stop", **llm.stats()}
+
+        async def lines():
+            async for token in llm.tokens():
+                yield json.dumps({"model": model, "response": token, "done": False}) + "\n"
+            yield json.dumps({"model": model, "response": "", "done": True, "done_reason": "stop", **llm.stats()}) + "\n"
+
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    @app.get("/api/tags")
+    async def ollama_tags():
+        return {"models": [{"name": name} for name in config.loaded]}
+
+    @app.post("/v1/chat/completions")
+    async def openai_chat(request: Request):
+        app.state.requests += 1
+        payload = await request.json()
+        model = payload.get("model", "fake")
+        prompt = "\n".join(str(message.get("content", "")) for message in payload.get("messages", []))
+        llm = FakeLLM(config, model, prompt, payload.get("max_tokens") or payload.get("max_completion_tokens"))
+        if llm.fails:
+            return error({"error": {"message": "fake server error", "type": "server_error", "code": None}})
+        completion_id = f"chatcmpl-{hashlib.sha1(prompt.encode('utf-8')).hexdigest()[:12]}"
+        created = int(time.time())
+        usage = lambda: {
+            "prompt_tokens": llm.prompt_tokens,
+            "completion_tokens": llm.max_tokens,
+            "total_tokens": llm.prompt_tokens + llm.max_tokens
+        }
+
+        if not payload.get("stream"):
+            text = "".join([token async for token in llm.tokens()])
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                "usage": usage()
+            }
+
+        def chunk(delta: Dict[str, Any], finish_reason: str = None) -> str:
+            data = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+            }
+            return f"data: {json.dumps(data)}\n\n"
+
+        async def events():
+            yield chunk({"role": "assistant", "content": ""})
+            async for token in llm.tokens():
+                yield chunk({"content": token})
+            yield chunk({}, "stop")
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.get("/stats")
+    async def stats():
+        return {"requests": app.state.requests, "loaded_models": list(config.loaded)}
+
+    return app
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--ttft", type=float, default=0.3, help="Seconden tot het eerste token")
+    parser.add_argument("--tps", type=float, default=40.0, help="Tokens per seconde")
+    parser.add_argument("--tokens", type=int, default=60, help="Antwoordlengte zonder max_tokens/num_predict")
+    parser.add_argument("--jitter", type=float, default=0.1, help="Relatieve spreiding op de vertragingen")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Kans op een foutstatus per verzoek")
+    parser.add_argument("--error-status", type=int, default=500)
+    parser.add_argument("--stall-rate", type=float, default=0.0, help="Kans dat een verzoek blijft hangen")
+    parser.add_argument("--load-seconds", type=float, default=0.0, help="Laadtijd van een koud model")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    import uvicorn
+    config = FakeLLMConfig(
+        ttft=args.ttft, tokens_per_second=args.tps, tokens=args.tokens, jitter=args.jitter,
+        error_rate=args.error_rate, error_status=args.error_status, stall_rate=args.stall_rate,
+        load_seconds=args.load_seconds, seed=args.seed
+    )
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
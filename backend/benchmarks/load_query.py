@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Loadtest: open-loop belasting op /api/query boven de capaciteit
+
+Stuurt met een vast tempo vragen naar een draaiende API, ongeacht hoe snel
+die antwoordt, en rapporteert de latency-percentielen van de toegelaten
+queries naast het aantal 429/503 weigeringen. Draai hem eens met
+QUERY_ADMISSION=false en eens met admission control aan: zonder admission
+control groeit de staart van de latency met de wachtrij mee, met admission
+control blijft p99 rond de SLO en wordt het overschot direct geweigerd.
+
+Voorbeeld (API met LLM_PROVIDER=fast_mock, QUERY_MAX_INFLIGHT_PER_USER=0):
+    python benchmarks/load_query.py --token $TOKEN --rate 20 --duration 30
+
+Om ook HTTP-pooling, streaming en timeouts naar de provider mee te nemen:
+draai de API met LLM_PROVIDER=ollama tegen benchmarks/fake_llm_server.py.
+"""
+import argparse
+import asyncio
+import math
+import time
+from collections import Counter
+from typing import List
+
+import httpx
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    index = max(0, math.ceil(pct / 100 * len(ordered)) - 1)
+    return ordered[index]
+
+async def login(client: httpx.AsyncClient, email: str, password: str) -> str:
+    response = await client.post("/api/auth/login", json={"email": email, "password": password})
+    response.raise_for_status()
+    return response.json()["access_token"]
+
+async def run(args):
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as client:
+        token = args.token or await login(client, args.email, args.password)
+        headers = {"Authorization": f"Bearer {token}"}
+        latencies = []
+        rejected_after = []
+        statuses = Counter()
+        retry_after = Counter()
+
+        async def one(i: int):
+            # Elke vraag is anders, zodat single-flight ze niet samenvoegt
+            payload = {"question": f"{args.question} ({i})"}
+            start = time.perf_counter()
+            try:
+                response = await client.post("/api/query", json=payload, headers=headers)
+            except httpx.HTTPError as e:
+                statuses[type(e).__name__] += 1
+                return
+            seconds = time.perf_counter() - start
+            statuses[response.status_code] += 1
+            if response.status_code == 200:
+                latencies.append(seconds)
+            else:
+                rejected_after.append(seconds)
+                if "retry-after" in response.headers:
+                    retry_after[response.headers["retry-after"]] += 1
+
+        tasks = []
+        interval = 1.0 / args.rate
+        started = time.perf_counter()
+        for i in range(int(args.rate * args.duration)):
+            # Vast schema: een trage server remt de aanvoer niet af
+            delay = started + i * interval - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(one(i)))
+        await asyncio.gather(*tasks)
+        wall = time.perf_counter() - started
+
+    print(f"{len(tasks)} requests in {wall:.1f}s ({args.rate}/s aangeboden)")
+    print("Status: " + ", ".join(f"{status}={count}" for status, count in sorted(statuses.items(), key=str)))
+    if latencies:
+        print(f"Toegelaten: {len(latencies)}  goodput {len(latencies) / wall:.1f}/s")
+        print(f"  p50 {percentile(latencies, 50):.2f}s  p95 {percentile(latencies, 95):.2f}s  "
+              f"p99 {percentile(latencies, 99):.2f}s  max {max(latencies):.2f}s")
+    if rejected_after:
+        print(f"Geweigerd: {len(rejected_after)}  p99 tijd tot weigering {percentile(rejected_after, 99) * 1000:.0f}ms")
+        print("  Retry-After: " + ", ".join(f"{value}s={count}" for value, count in sorted(retry_after.items())))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--token", help="Bearer token; anders inloggen met --email en --password")
+    parser.add_argument("--email")
+    parser.add_argument("--password")
+    parser.add_argument("--question", default="Wat staat er in de documenten?")
+    parser.add_argument("--rate", type=float, default=10, help="Aangeboden queries per seconde")
+    parser.add_argument("--duration", type=float, default=30, help="Duur van de belasting in seconden")
+    parser.add_argument("--timeout", type=float, default=300)
+    args = parser.parse_args()
+    if not args.token and not (args.email and args.password):
+        parser.error("geef --token of --email en --password")
+    asyncio.run(run(args))
+
+if __name__ == "__main__":
+    main()
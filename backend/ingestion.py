@@ -0,0 +1,192 @@
+import os
+import json
+import asyncio
+from typing import List, Dict, Any, Iterable
+from sqlalchemy.orm import Session
+from db import SessionLocal
+from models import Document
+from rag.document_processor import DocumentProcessor
+from rag.vectorstore import get_vectorstore
+from rag.governor import run_ingestion_job, IngestionError
+from rag.llm import get_llm
+from rag.summaries import build_document_artifacts
+
+# Optionele ingestion-stap: samenvatting en kerngegevens per document vooraf berekenen
+INGEST_SUMMARIES = os.getenv("INGEST_SUMMARIES", "false").lower() == "true"
+
+def document_metadata(document: Document) -> Dict[str, Any]:
+    """Document-specifieke metadata die op elke chunk wordt opgeslagen"""
+    return {
+        'document_id': document.id,
+        'content_hash': document.content_hash,
+        'file_path': document.file_path,
+        'filename': document.filename,
+        'original_filename': document.original_filename,
+        'user_id': document.user_id,
+        'upload_date': document.uploaded_at.isoformat()
+    }
+
+def chunk_metadatas(document: Document, chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Bouw metadata voor elke chunk, inclusief offsets en paginabereik"""
+    base = document_metadata(document)
+    metadatas = []
+    for i, chunk in enumerate(chunks):
+        metadata = dict(base)
+        metadata.update({
+            'chunk': i + 1,
+            'page_start': chunk['page_start'],
+            'page_end': chunk['page_end'],
+            'char_start': chunk['char_start'],
+            'char_end': chunk['char_end']
+        })
+        metadatas.append(metadata)
+    return metadatas
+
+def find_processed_duplicate(db: Session, document: Document):
+    """Zoek een al verwerkt document met exact dezelfde inhoud"""
+    if not document.content_hash:
+        return None
+    return db.query(Document).filter(
+        Document.content_hash == document.content_hash,
+        Document.id != document.id,
+        Document.is_processed == True,
+        Document.chunk_count > 0
+    ).order_by(Document.id).first()
+
+def index_document(db: Session, document: Document, processor: DocumentProcessor = None, vectorstore=None) -> int:
+    """Verwerk een document en voeg de chunks toe aan de vectorstore
+
+    Zijn de bytes al eerder verwerkt, dan worden chunks en embeddings van dat
+    document hergebruikt en wordt extractie/OCR/embedding overgeslagen.
+    Extractie draait via de governor in een apart process met limieten; bij
+    een fout wordt het document gemarkeerd en de fout opnieuw opgegooid.
+    Geeft het aantal chunks terug.
+    """
+    vectorstore = vectorstore or get_vectorstore()
+
+    duplicate = find_processed_duplicate(db, document)
+    if duplicate:
+        copied = vectorstore.copy_document_chunks(duplicate.id, document_metadata(document))
+        if copied:
+            print(f"Reused {copied} chunks from document {duplicate.id} (same content hash)")
+            document.is_processed = True
+            document.chunk_count = copied
+            document.processor_version = duplicate.processor_version
+            document.processing_error = None
+            if duplicate.summary and duplicate.summary_content_hash == document.content_hash:
+                # Zelfde inhoud, dus ook dezelfde samenvatting en kerngegevens
+                document.summary = duplicate.summary
+                document.key_facts = duplicate.key_facts
+                document.summary_content_hash = duplicate.summary_content_hash
+            db.commit()
+            return copied
+
+    processor = processor or DocumentProcessor()
+    print(f"Starting document processing for {document.file_path}")
+    try:
+        chunks = run_ingestion_job(document.file_path, processor)
+    except IngestionError as e:
+        mark_processing_failed(db, document, e)
+        raise
+    print(f"Document processing completed, got {len(chunks)} chunks")
+
+    if chunks:
+        print(f"Adding {len(chunks)} chunks to vectorstore")
+        added = vectorstore.add_documents(
+            [chunk['content'] for chunk in chunks],
+            chunk_metadatas(document, chunks),
+            [f"{document.id}_{i + 1}" for i in range(len(chunks))]
+        )
+        if not added:
+            raise RuntimeError("Could not add chunks to vectorstore")
+    else:
+        print("No chunks generated from document")
+
+    # Mark as processed even if no chunks (file was uploaded successfully)
+    document.is_processed = True
+    document.chunk_count = len(chunks)
+    document.processor_version = processor.version
+    document.processing_error = None
+    db.commit()
+    return len(chunks)
+
+def mark_processing_failed(db: Session, document: Document, error: Exception):
+    """Leg vast waarom verwerking mislukte; het document blijft onverwerkt"""
+    print(f"Processing failed for document {document.id}: {error}")
+    document.is_processed = False
+    document.chunk_count = 0
+    document.processing_error = str(error) or type(error).__name__
+    db.commit()
+
+async def precompute_document_summary(document_id: int, llm=None, vectorstore=None) -> bool:
+    """Sla samenvatting en kerngegevens van een verwerkt document op
+
+    Draait na het indexeren (als background task of vanuit het reprocess
+    script). Een samenvatting die al bij deze inhoud hoort wordt niet
+    opnieuw gemaakt; een foutantwoord van de LLM wordt niet opgeslagen, de
+    query valt dan terug op een LLM-aanroep.
+    """
+    content_hash = await asyncio.to_thread(_summary_needed, document_id)
+    if content_hash is None:
+        return False
+    vectorstore = vectorstore or await asyncio.to_thread(get_vectorstore)
+    llm = llm or get_llm()
+    try:
+        summary, key_facts = await build_document_artifacts(llm, vectorstore, document_id)
+    except Exception as e:
+        print(f"Summary precompute failed for document {document_id}: {e}")
+        return False
+    if not summary or summary.startswith("Error:"):
+        print(f"Summary precompute failed for document {document_id}: {summary}")
+        return False
+    stored = await asyncio.to_thread(_store_document_summary, document_id, content_hash, summary, key_facts)
+    if stored:
+        print(f"Stored summary and key facts for document {document_id}")
+    return stored
+
+def _summary_needed(document_id: int):
+    """content_hash van het document als er een (nieuwe) samenvatting nodig is, anders None"""
+    db = SessionLocal()
+    try:
+        document = db.query(Document).filter(Document.id == document_id).first()
+        if not document or not document.is_processed or not document.chunk_count:
+            return None
+        if document.summary and document.summary_content_hash == document.content_hash:
+            return None
+        return document.content_hash or ""
+    finally:
+        db.close()
+
+def _store_document_summary(document_id: int, content_hash: str, summary: str, key_facts: Dict[str, List[str]]) -> bool:
+    db = SessionLocal()
+    try:
+        document = db.query(Document).filter(Document.id == document_id).first()
+        # Is het document intussen verwijderd of opnieuw verwerkt, dan niet opslaan
+        if not document or (document.content_hash or "") != content_hash:
+            return False
+        document.summary = summary
+        document.key_facts = json.dumps(key_facts, ensure_ascii=False)
+        document.summary_content_hash = document.content_hash
+        db.commit()
+        return True
+    finally:
+        db.close()
+
+def load_stored_summaries(document_ids: Iterable[int]) -> Dict[int, Dict[str, Any]]:
+    """Opgeslagen samenvattingen en kerngegevens per document id"""
+    document_ids = [document_id for document_id in set(document_ids) if document_id]
+    if not document_ids:
+        return {}
+    db = SessionLocal()
+    try:
+        documents = db.query(Document).filter(Document.id.in_(document_ids), Document.summary.isnot(None)).all()
+        return {
+            document.id: {
+                "summary": document.summary,
+                "content_hash": document.summary_content_hash,
+                "key_facts": json.loads(document.key_facts) if document.key_facts else {}
+            }
+            for document in documents
+        }
+    finally:
+        db.close()
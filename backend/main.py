@@ -1,10 +1,13 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import PlainTextResponse
 import os
 
 from db import create_tables
 from api import auth, documents, query
+from rag.llm import get_llm, close_llms, start_ollama_keepalive
+from rag.metrics import metrics
 
 # Create FastAPI app
 app = FastAPI(
@@ -40,6 +43,18 @@ async def startup_event():
     os.makedirs("./data", exist_ok=True)
     os.makedirs("./data/chroma_db", exist_ok=True)
     os.makedirs("./backend/documents", exist_ok=True)
+    # Maak de LLM provider (met zijn gedeelde HTTP client) één keer aan
+    try:
+        get_llm()
+        # Ollama: model vooraf laden en tijdens kantooruren geladen houden
+        start_ollama_keepalive()
+    except Exception as e:
+        print(f"Warning: Could not initialize LLM provider: {e}")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    # Sluit keep-alive verbindingen en thread pools van de LLM providers
+    await close_llms()
 
 @app.get("/")
 async def root():
@@ -53,6 +68,10 @@ async def root():
 async def health_check():
     return {"status": "healthy"}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    return metrics.render()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8001) 
\ No newline at end of file
@@ -84,9 +84,24 @@ class Document(Base):
     uploaded_at = Column(DateTime, default=datetime.utcnow)
     is_processed = Column(Boolean, default=False)
     chunk_count = Column(Integer, default=0)
+    content_hash = Column(String, index=True)  # SHA-256 van de inhoud, zie StoredFile
+    processor_version = Column(String)  # DocumentProcessor.version waarmee de chunks zijn gemaakt
+    processing_error = Column(String)  # Reden waarom verwerking mislukte, None als het gelukt is
+    summary = Column(Text)  # Samenvatting, gemaakt bij ingestion (INGEST_SUMMARIES)
+    key_facts = Column(Text)  # JSON met bedragen, periodes en partijen
+    summary_content_hash = Column(String)  # content_hash waarvoor summary en key_facts gelden
     
     owner = relationship("User", back_populates="documents")
 
+class StoredFile(Base):
+    __tablename__ = "stored_files"
+    
+    content_hash = Column(String, primary_key=True)
+    file_path = Column(String)
+    file_size = Column(Integer)
+    ref_count = Column(Integer, default=0)  # Aantal Document records dat dit bestand gebruikt
+    created_at = Column(DateTime, default=datetime.utcnow)
+
 class Query(Base):
     __tablename__ = "queries"
     
@@ -97,4 +112,17 @@ class Query(Base):
     sources = Column(Text)  # JSON string van bronnen
     created_at = Column(DateTime, default=datetime.utcnow)
     
-    user = relationship("User", back_populates="queries") 
\ No newline at end of file
+    user = relationship("User", back_populates="queries")
+
+class LLMCacheEntry(Base):
+    __tablename__ = "llm_cache"
+    
+    key = Column(String, primary_key=True)  # sha256 van provider, model, opties en het volledige prompt
+    provider = Column(String)
+    model = Column(String)
+    response = Column(Text)  # JSON van het antwoord
+    size = Column(Integer)  # Lengte van response in tekens
+    hits = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, index=True)
+    last_used_at = Column(DateTime, default=datetime.utcnow, index=True)
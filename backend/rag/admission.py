@@ -0,0 +1,147 @@
+import os
+import math
+import time
+import threading
+from contextvars import ContextVar
+from typing import Any, Dict, Optional
+from rag.metrics import metrics
+
+metrics.describe("admission_decisions_total", "Beslissingen van de admission control op query endpoints")
+metrics.describe("query_inflight", "Toegelaten queries die nu lopen")
+metrics.describe("admission_estimated_latency_seconds", "Geschatte latency voor een nieuwe query bij de laatste beslissing")
+
+class AdmissionRejected(Exception):
+    """Query wordt niet toegelaten; status_code 429 (per gebruiker) of 503 (overbelast)"""
+    def __init__(self, status_code: int, retry_after: int, reason: str):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.reason = reason
+
+class AdmissionTicket:
+    """Plek van één toegelaten query; release() is idempotent
+
+    De latency die de schatting voedt is de bedieningstijd: vanaf het moment
+    dat de query zijn eerste LLM-plek kreeg (mark_service_started, gezet door
+    de scheduler). De wachttijd in de scheduler zit al in de 'rondes' van
+    estimated_latency en mag niet dubbel tellen. Zonder LLM-aanroep (cache,
+    geen bronnen) telt de hele doorlooptijd.
+    """
+    def __init__(self, controller: "AdmissionController", user_id: Any):
+        self.controller = controller
+        self.user_id = user_id
+        self.started = time.monotonic()
+        self.service_started: Optional[float] = None
+        self._released = False
+
+    def mark_service_started(self):
+        if self.service_started is None:
+            self.service_started = time.monotonic()
+
+    def service_time(self) -> float:
+        return time.monotonic() - (self.service_started if self.service_started is not None else self.started)
+
+    def release(self, record_latency: bool = True):
+        if self._released:
+            return
+        self._released = True
+        self.controller._leave(self, self.service_time() if record_latency else None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+        return False
+
+# Ticket van de lopende request; de LLM scheduler markeert daarop het begin van de bediening
+current_ticket: ContextVar[Optional[AdmissionTicket]] = ContextVar("admission_ticket", default=None)
+
+def mark_service_started():
+    """Roep aan zodra de lopende request een LLM-plek heeft gekregen"""
+    ticket = current_ticket.get()
+    if ticket is not None:
+        ticket.mark_service_started()
+
+class AdmissionController:
+    """Laat queries alleen toe als de latency-SLO nog haalbaar is
+
+    De verwachte latency voor een nieuwe query is de gemiddelde doorlooptijd
+    (EWMA over afgeronde queries) maal het aantal 'rondes' dat hij moet wachten
+    op de huidige capaciteit. Boven de SLO of boven het maximum aantal lopende
+    queries volgt 503, boven het maximum per gebruiker 429; beide met een
+    Retry-After.
+    """
+    def __init__(self, capacity: int = None, slo_seconds: float = None, max_inflight: int = None,
+                 max_inflight_per_user: int = None, initial_latency: float = None, enabled: bool = None):
+        if capacity is None:
+            capacity = int(os.getenv("QUERY_CAPACITY", "0")) or _llm_capacity()
+        self.capacity = max(capacity, 1)
+        self.slo_seconds = slo_seconds if slo_seconds is not None else float(os.getenv("QUERY_LATENCY_SLO_SECONDS", "60"))
+        self.max_inflight = max_inflight if max_inflight is not None else int(os.getenv("QUERY_MAX_INFLIGHT", "200"))
+        self.max_inflight_per_user = max_inflight_per_user if max_inflight_per_user is not None else int(os.getenv("QUERY_MAX_INFLIGHT_PER_USER", "4"))
+        self.enabled = enabled if enabled is not None else os.getenv("QUERY_ADMISSION", "true").lower() == "true"
+        self.ewma_alpha = 0.2
+        self.latency_estimate = initial_latency if initial_latency is not None else float(os.getenv("QUERY_INITIAL_LATENCY_ESTIMATE", "5"))
+        self.inflight = 0
+        self._per_user: Dict[Any, int] = {}
+        self._lock = threading.Lock()
+
+    def estimated_latency(self, inflight: int = None) -> float:
+        """Verwachte doorlooptijd voor een query die nu binnenkomt"""
+        inflight = self.inflight if inflight is None else inflight
+        rounds = math.floor(inflight / self.capacity) + 1
+        return self.latency_estimate * rounds
+
+    def admit(self, user_id: Any = None) -> AdmissionTicket:
+        """Geef een ticket of gooi AdmissionRejected"""
+        with self._lock:
+            if self.enabled:
+                user_inflight = self._per_user.get(user_id, 0)
+                if self.max_inflight_per_user and user_id is not None and user_inflight >= self.max_inflight_per_user:
+                    self._reject("user_limit")
+                    raise AdmissionRejected(429, self._retry_after(), "Too many concurrent queries for this user")
+
+                estimate = self.estimated_latency()
+                metrics.set("admission_estimated_latency_seconds", estimate)
+                if self.max_inflight and self.inflight >= self.max_inflight:
+                    self._reject("max_inflight")
+                    raise AdmissionRejected(503, self._retry_after(), "Server is overloaded")
+                if self.slo_seconds and estimate > self.slo_seconds:
+                    self._reject("slo")
+                    raise AdmissionRejected(503, self._retry_after(estimate - self.slo_seconds), "Expected latency exceeds the service level objective")
+
+            self.inflight += 1
+            self._per_user[user_id] = self._per_user.get(user_id, 0) + 1
+            metrics.inc("admission_decisions_total", decision="admitted")
+            metrics.set("query_inflight", self.inflight)
+        ticket = AdmissionTicket(self, user_id)
+        current_ticket.set(ticket)
+        return ticket
+
+    def _reject(self, reason: str):
+        metrics.inc("admission_decisions_total", decision="rejected", reason=reason)
+
+    def _retry_after(self, excess: float = 0.0) -> int:
+        """Na ongeveer één doorlooptijd (plus de overschrijding) komt er weer ruimte"""
+        return max(1, math.ceil(max(excess, self.latency_estimate)))
+
+    def _leave(self, ticket: AdmissionTicket, latency: float = None):
+        with self._lock:
+            self.inflight = max(self.inflight - 1, 0)
+            remaining = self._per_user.get(ticket.user_id, 1) - 1
+            if remaining > 0:
+                self._per_user[ticket.user_id] = remaining
+            else:
+                self._per_user.pop(ticket.user_id, None)
+            if latency is not None:
+                self.latency_estimate += self.ewma_alpha * (latency - self.latency_estimate)
+            metrics.set("query_inflight", self.inflight)
+
+def _llm_capacity() -> int:
+    """Standaardcapaciteit: het aantal gelijktijdige aanroepen dat de scheduler toestaat"""
+    from rag.llm import scheduler, LLM_PROVIDER, LLM_ROUTER_PROVIDERS
+    providers = [name.strip().lower() for name in LLM_ROUTER_PROVIDERS.split(",") if name.strip()] or [LLM_PROVIDER]
+    return sum(scheduler.limits.get(name, scheduler.default_limit) for name in providers)
+
+admission = AdmissionController()
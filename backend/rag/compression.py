@@ -0,0 +1,166 @@
+import os
+import re
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Tuple
+import numpy as np
+from rag.metrics import metrics
+
+# Extractieve compressie van de context: alleen de zinnen die bij de vraag passen
+CONTEXT_COMPRESSION = os.getenv("CONTEXT_COMPRESSION", "false").lower() == "true"
+# Maximale contextlengte (tekens, alle bronnen samen) na compressie
+CONTEXT_COMPRESSION_BUDGET_CHARS = int(os.getenv("CONTEXT_COMPRESSION_BUDGET_CHARS", "4000"))
+# Aantal buurzinnen aan weerszijden van een gekozen zin
+CONTEXT_COMPRESSION_NEIGHBOURS = int(os.getenv("CONTEXT_COMPRESSION_NEIGHBOURS", "1"))
+SENTENCE_CACHE_SIZE = int(os.getenv("CONTEXT_COMPRESSION_CACHE_SIZE", "2048"))
+
+metrics.describe("context_compression_ratio", "Lengte van de context na compressie gedeeld door de lengte ervoor",
+                 buckets=(0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0))
+metrics.describe("context_compression_seconds", "Duur van het comprimeren van de context")
+metrics.describe("context_compression_chars_total", "Tekens context voor (stage=in) en na (stage=out) compressie")
+
+SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+(?=[A-Z0-9€\"'(])|\n\s*\n")
+GAP = "…"
+# Langere 'zinnen' (tabellen, OCR zonder leestekens) worden op woordgrenzen opgeknipt
+MAX_SENTENCE_CHARS = 400
+
+def split_sentences(text: str) -> List[str]:
+    sentences = []
+    for sentence in SENTENCE_SPLIT.split(text):
+        sentence = (sentence or "").strip()
+        while len(sentence) > MAX_SENTENCE_CHARS:
+            cut = sentence.rfind(" ", 0, MAX_SENTENCE_CHARS)
+            cut = cut if cut > 0 else MAX_SENTENCE_CHARS
+            sentences.append(sentence[:cut])
+            sentence = sentence[cut:].strip()
+        if sentence:
+            sentences.append(sentence)
+    return sentences
+
+class ContextCompressor:
+    """Houdt per bron alleen de zinnen over die het meest op de vraag lijken
+
+    Vraag en zinnen worden met het embedding model van de vectorstore
+    vergeleken (geen tweede model in het geheugen). Over alle bronnen samen
+    worden de best scorende zinnen met hun buurzinnen gekozen tot het budget
+    vol is; elke bron houdt minstens zijn beste zin, zodat de bronnummers in
+    het prompt blijven kloppen. Context die al binnen het budget past blijft
+    zoals hij is. Zin-embeddings worden per chunk gecachet.
+    """
+    def __init__(self, encoder, budget_chars: int = None, neighbours: int = None):
+        self.encoder = encoder
+        self.budget_chars = budget_chars if budget_chars is not None else CONTEXT_COMPRESSION_BUDGET_CHARS
+        self.neighbours = neighbours if neighbours is not None else CONTEXT_COMPRESSION_NEIGHBOURS
+        self._cache: "OrderedDict[str, Tuple[List[str], np.ndarray]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _sentences(self, contents: List[str]) -> List[Tuple[List[str], np.ndarray]]:
+        """Zinnen en hun (genormaliseerde) embeddings per chunk; ontbrekende in één encode-aanroep"""
+        keys = [hashlib.sha1(content.encode("utf-8")).hexdigest() for content in contents]
+        with self._lock:
+            found = {key: self._cache[key] for key in keys if key in self._cache}
+            for key in found:
+                self._cache.move_to_end(key)
+        missing = {key: split_sentences(content) for key, content in zip(keys, contents) if key not in found}
+        texts = [sentence for sentences in missing.values() for sentence in sentences]
+        embeddings = _normalize(np.asarray(self.encoder.encode(texts), dtype=np.float32)) if texts else None
+        offset = 0
+        for key, sentences in missing.items():
+            found[key] = (sentences, embeddings[offset:offset + len(sentences)] if sentences else np.zeros((0, 1)))
+            offset += len(sentences)
+        with self._lock:
+            for key in missing:
+                self._cache[key] = found[key]
+            while len(self._cache) > SENTENCE_CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return [found[key] for key in keys]
+
+    def compress(self, question: str, sources: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Kopieën van de bronnen met ingekorte content; de originele bronnen blijven ongewijzigd"""
+        total = sum(len(source['content']) for source in sources)
+        if not sources or total <= self.budget_chars:
+            return sources
+        started = time.perf_counter()
+
+        per_source = self._sentences([source['content'] for source in sources])
+        query = _normalize(np.asarray(self.encoder.encode([question]), dtype=np.float32))[0]
+        scored = []
+        for s, (sentences, embeddings) in enumerate(per_source):
+            if sentences:
+                for i, score in enumerate(embeddings @ query):
+                    scored.append((float(score), s, i))
+        scored.sort(reverse=True)
+
+        selected = [set() for _ in sources]
+        used = 0
+
+        def take(s: int, i: int, force: bool = False) -> bool:
+            nonlocal used
+            sentences = per_source[s][0]
+            window = [j for j in range(max(i - self.neighbours, 0), min(i + self.neighbours + 1, len(sentences)))
+                      if j not in selected[s]]
+            cost = sum(len(sentences[j]) + 1 for j in window)
+            if not force and used + cost > self.budget_chars:
+                return False
+            selected[s].update(window)
+            used += cost
+            return True
+
+        # Eerst de beste zin van elke bron, daarna de rest op score
+        best = {}
+        for score, s, i in scored:
+            best.setdefault(s, i)
+        for s, i in best.items():
+            take(s, i, force=True)
+        for score, s, i in scored:
+            if used >= self.budget_chars:
+                break
+            if i not in selected[s]:
+                take(s, i)
+
+        compressed = []
+        for source, (sentences, _), chosen in zip(sources, per_source, selected):
+            copy = dict(source)
+            if chosen:
+                copy['content'] = _join(sentences, sorted(chosen))
+            compressed.append(copy)
+
+        out = sum(len(source['content']) for source in compressed)
+        metrics.observe("context_compression_ratio", out / total)
+        metrics.observe("context_compression_seconds", time.perf_counter() - started)
+        metrics.inc("context_compression_chars_total", total, stage="in")
+        metrics.inc("context_compression_chars_total", out, stage="out")
+        return compressed
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+def _join(sentences: List[str], indices: List[int]) -> str:
+    """Gekozen zinnen in de oorspronkelijke volgorde; weggelaten stukken als '…'"""
+    parts = []
+    previous = None
+    for i in indices:
+        if previous is not None and i != previous + 1:
+            parts.append(GAP)
+        parts.append(sentences[i])
+        previous = i
+    text = " ".join(parts)
+    if indices[0] > 0:
+        text = f"{GAP} {text}"
+    if indices[-1] < len(sentences) - 1:
+        text = f"{text} {GAP}"
+    return text
+
+_compressor = None
+
+def compress_sources(vectorstore, question: str, sources: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Comprimeer de bronnen voor het prompt als CONTEXT_COMPRESSION aan staat; synchroon (draai in een thread)"""
+    global _compressor
+    if not CONTEXT_COMPRESSION:
+        return sources
+    if _compressor is None or _compressor.encoder is not vectorstore.model:
+        _compressor = ContextCompressor(vectorstore.model)
+    return _compressor.compress(question, sources)
@@ -0,0 +1,91 @@
+import os
+import time
+from typing import Any, Dict, List, Optional
+from rag.metrics import metrics
+from rag.llm import parse_models
+
+metrics.describe("query_degradations_total", "Toegepaste degradaties om binnen de deadline van een query te blijven")
+
+class Deadline:
+    """Tijdsbudget van één request, gedeeld door alle stappen"""
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+class DeadlinePolicy:
+    """Bepaalt per stap hoeveel werk er nog in het resterende budget past
+
+    Hoe minder tijd er over is, hoe meer er wordt ingeleverd: minder chunks
+    in de context, minder tokens, een sneller model en uiteindelijk alleen de
+    bronnen zonder gegenereerd antwoord. Elke stap geeft de namen van de
+    toegepaste degradaties terug, zodat de response ze kan melden.
+    """
+    def __init__(self):
+        self.default_seconds = float(os.getenv("QUERY_DEADLINE_SECONDS", "180"))
+        self.max_seconds = float(os.getenv("QUERY_MAX_DEADLINE_SECONDS", "300"))
+        self.chunks = int(os.getenv("QUERY_CONTEXT_CHUNKS", "10"))
+        self.degraded_chunks = int(os.getenv("QUERY_DEGRADED_CHUNKS", "4"))
+        self.chunks_below = float(os.getenv("QUERY_DEGRADE_CHUNKS_BELOW", "30"))
+        self.degraded_max_tokens = int(os.getenv("QUERY_DEGRADED_MAX_TOKENS", "400"))
+        self.tokens_below = float(os.getenv("QUERY_DEGRADE_TOKENS_BELOW", "60"))
+        self.fast_models = parse_models(os.getenv("QUERY_FAST_MODELS", ""))
+        self.model_below = float(os.getenv("QUERY_DEGRADE_MODEL_BELOW", "30"))
+        self.sources_only_below = float(os.getenv("QUERY_SOURCES_ONLY_BELOW", "5"))
+
+    def deadline(self, requested: Optional[float] = None) -> Deadline:
+        """Deadline voor een nieuwe request; een gevraagde deadline wordt begrensd"""
+        seconds = requested if requested and requested > 0 else self.default_seconds
+        return Deadline(min(seconds, self.max_seconds))
+
+    def budget_class(self, seconds: float) -> int:
+        """Aantal degradatiedrempels waar een resterend budget boven zit; hoger = minder inleveren"""
+        thresholds = (self.sources_only_below, self.chunks_below, self.model_below, self.tokens_below)
+        return sum(1 for threshold in thresholds if seconds >= threshold)
+
+    def can_share(self, leader: Optional[Deadline], follower: Deadline) -> bool:
+        """Mag een request het resultaat van een lopende request met deadline `leader` delen?
+
+        Alleen als de leader nu minstens zo weinig hoeft in te leveren als de
+        follower zelf zou doen; anders kan de follower een gedegradeerd
+        antwoord krijgen terwijl hij er zelf tijd genoeg voor had.
+        """
+        if leader is None:
+            return True
+        return self.budget_class(leader.remaining()) >= self.budget_class(follower.remaining())
+
+    def context_chunks(self, deadline: Deadline, degradations: List[str]) -> int:
+        """Aantal chunks voor de context"""
+        if deadline.remaining() < self.chunks_below:
+            record(degradations, "fewer_chunks")
+            return min(self.degraded_chunks, self.chunks)
+        return self.chunks
+
+    def generation_options(self, deadline: Deadline, provider: str, degradations: List[str]) -> Optional[Dict[str, Any]]:
+        """Opties voor de LLM-aanroep, of None als er alleen bronnen terug kunnen"""
+        remaining = deadline.remaining()
+        if remaining < self.sources_only_below:
+            record(degradations, "sources_only")
+            return None
+        options = {}
+        if remaining < self.tokens_below:
+            options["max_tokens"] = self.degraded_max_tokens
+            record(degradations, "reduced_max_tokens")
+        # Het snelle model is per provider; de router kiest zelf zijn provider
+        fast_model = self.fast_models.get(provider)
+        if fast_model and remaining < self.model_below:
+            options["model"] = fast_model
+            record(degradations, "fast_model")
+        return options
+
+def record(degradations: List[str], name: str):
+    if name not in degradations:
+        degradations.append(name)
+        metrics.inc("query_degradations_total", degradation=name)
+
+deadline_policy = DeadlinePolicy()
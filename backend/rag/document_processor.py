@@ -1,34 +1,175 @@
 import os
 import uuid
-from typing import List, Dict, Any
+import bisect
+import hashlib
+from typing import List, Dict, Any, Tuple
 from PyPDF2 import PdfReader
 from docx import Document
 import markdown
 import re
+import threading
+import mmap
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import traceback
-from pdf2image import convert_from_path, convert_from_bytes
+from pdf2image import convert_from_bytes, convert_from_path
 import pytesseract
 from io import BytesIO
+from rag.ocr_cache import OCRCache
+
+# Scheidingstekens waarop een chunk bij voorkeur eindigt, van sterk naar zwak
+CHUNK_BREAKS = ['\n\n', '. ', '! ', '? ', '; ', ', ', ' ']
+
+class OCREngine:
+    """Basisklasse voor OCR backends"""
+    name = "base"
+    
+    def __init__(self, lang: str):
+        self.lang = lang
+    
+    def image_to_string(self, image) -> str:
+        raise NotImplementedError
+
+class PytesseractEngine(OCREngine):
+    """Start per pagina een tesseract proces (laadt de traineddata telkens opnieuw)"""
+    name = "pytesseract"
+    
+    def image_to_string(self, image) -> str:
+        return pytesseract.image_to_string(image, lang=self.lang)
+
+class TesserocrEngine(OCREngine):
+    """In-process libtesseract; de taalmodellen blijven geladen zolang de engine leeft"""
+    name = "tesserocr"
+    
+    def __init__(self, lang: str):
+        super().__init__(lang)
+        import tesserocr
+        self._api = tesserocr.PyTessBaseAPI(lang=lang)
+    
+    def image_to_string(self, image) -> str:
+        self._api.SetImage(image)
+        return self._api.GetUTF8Text()
+
+OCR_ENGINES = {
+    TesserocrEngine.name: TesserocrEngine,
+    PytesseractEngine.name: PytesseractEngine
+}
+
+# PyTessBaseAPI is niet thread-safe: één engine per (process, thread, taal)
+_ocr_engines = threading.local()
+
+def get_ocr_engine(name: str = None, lang: str = "nld+eng") -> OCREngine:
+    """Geef de OCR engine voor deze worker; hergebruikt een eerder geladen engine
+
+    name is 'auto' (tesserocr indien beschikbaar, anders pytesseract),
+    'tesserocr' of 'pytesseract'.
+    """
+    name = (name or os.getenv("OCR_ENGINE", "auto")).lower()
+    if name != "auto" and name not in OCR_ENGINES:
+        raise ValueError(f"Unsupported OCR engine: {name} (choose auto, {', '.join(OCR_ENGINES)})")
+    cache = getattr(_ocr_engines, "engines", None)
+    if cache is None or getattr(_ocr_engines, "pid", None) != os.getpid():
+        cache = _ocr_engines.engines = {}
+        _ocr_engines.pid = os.getpid()
+    
+    key = (name, lang)
+    if key not in cache:
+        candidates = [TesserocrEngine.name, PytesseractEngine.name] if name == "auto" else [name, PytesseractEngine.name]
+        failures = []
+        for candidate in dict.fromkeys(candidates):
+            try:
+                cache[key] = OCR_ENGINES[candidate](lang)
+                break
+            except Exception as e:
+                print(f"OCR engine {candidate} not available: {e}")
+                failures.append(f"{candidate}: {e}")
+        else:
+            raise RuntimeError(f"No OCR engine available ({'; '.join(failures)})")
+        print(f"Using OCR engine: {cache[key].name}")
+    return cache[key]
+
+# Vanaf dit aantal pagina's wordt de tekstlaag parallel geëxtraheerd
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "100"))
+PDF_MIN_PAGES_PER_RANGE = 10
+
+# Eén PDF pool per (process, aantal workers); wordt hergebruikt tussen documenten
+_pdf_pools = {}
+_pdf_pools_lock = threading.Lock()
+
+def get_pdf_pool(workers: int) -> ProcessPoolExecutor:
+    """Geef de gedeelde process pool voor PDF extractie
+
+    Workers worden met 'spawn' gestart: de API draait met threads en fork
+    zou locks in een willekeurige toestand meenemen.
+    """
+    key = (os.getpid(), workers)
+    with _pdf_pools_lock:
+        pool = _pdf_pools.get(key)
+        if pool is None:
+            pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            _pdf_pools[key] = pool
+        return pool
+
+def _hash_file(file_path: str, block_size: int = 1024 * 1024) -> str:
+    """SHA-256 van een bestand, in blokken gelezen"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _extract_pdf_range(processor: "DocumentProcessor", file_path: str, pdf_hash: str, first: int, last: int) -> Tuple[List[str], Dict[str, int]]:
+    """Draait in een PDF worker: extraheer pagina's [first, last) uit een memory map van het bestand"""
+    processor.last_ocr_stats = {'ocr_pages': 0, 'cache_hits': 0}
+    with open(file_path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        pdf_reader = PdfReader(data)
+        pages = [
+            processor._extract_pdf_page(pdf_reader, page_num, file_path, pdf_hash)
+            for page_num in range(first, last)
+        ]
+    return pages, processor.last_ocr_stats
 
 class DocumentProcessor:
-    def __init__(self):
+    # Verhoog bij elke wijziging in extractie of chunking; reprocess_documents gebruikt dit
+    VERSION = 2
+    
+    def __init__(self, chunk_size: int = None, chunk_overlap: int = None, chunk_unit: str = None):
         self.supported_extensions = ['.pdf', '.docx', '.md', '.txt']
-        self.chunk_size = 2000  # Verhoogd van 1000 naar 2000
-        self.chunk_overlap = 200  # Overlap tussen chunks voor betere context
+        self.chunk_size = chunk_size or int(os.getenv("CHUNK_SIZE", "2000"))
+        self.chunk_overlap = chunk_overlap if chunk_overlap is not None else int(os.getenv("CHUNK_OVERLAP", "200"))
+        self.chunk_unit = (chunk_unit or os.getenv("CHUNK_UNIT", "chars")).lower()  # chars of tokens
+        self.min_chunk_length = 50  # Minimum chunk size in karakters
+        self.ocr_dpi = int(os.getenv("OCR_DPI", "200"))
+        self.ocr_lang = os.getenv("OCR_LANG", "nld+eng")
+        self.ocr_engine = os.getenv("OCR_ENGINE", "auto")
+        self.ocr_cache = OCRCache()
+        # Parallelle PDF extractie; zet pdf_workers op 1 als de aanroeper zelf al parallel werkt
+        self.pdf_workers = int(os.getenv("PDF_WORKERS", str(os.cpu_count() or 1)))
+        self.pdf_parallel_min_pages = PDF_PARALLEL_MIN_PAGES
+        # OCR statistieken van het laatst verwerkte document
+        self.last_ocr_stats = {'ocr_pages': 0, 'cache_hits': 0}
+        if self.ocr_engine.lower() != 'auto' and self.ocr_engine.lower() not in OCR_ENGINES:
+            raise ValueError(f"Unsupported OCR engine: {self.ocr_engine}")
+        if self.chunk_unit not in ('chars', 'tokens'):
+            raise ValueError(f"Unsupported chunk unit: {self.chunk_unit}")
+        if self.chunk_overlap < 0 or self.chunk_overlap >= self.chunk_size:
+            raise ValueError("chunk_overlap must be >= 0 and smaller than chunk_size")
+    
+    @property
+    def version(self) -> str:
+        """Versie-sleutel inclusief chunk-instellingen; verandert deze, dan moet opnieuw verwerkt worden"""
+        return f"{self.VERSION}:{self.chunk_unit}:{self.chunk_size}:{self.chunk_overlap}"
     
     def process_document(self, file_path: str, file_content: bytes = None) -> List[str]:
         """Verwerk een document en splits het in chunks"""
+        return [chunk['content'] for chunk in self.process_document_spans(file_path, file_content)]
+    
+    def process_document_spans(self, file_path: str, file_content: bytes = None) -> List[Dict[str, Any]]:
+        """Verwerk een document en geef chunks terug met offsets en paginabereik"""
         try:
-            # Extract text based on file type
-            text = self._extract_text(file_path, file_content)
-            if not text:
-                return []
-            
-            # Clean and normalize text
-            text = self._clean_text(text)
-            
-            # Split into chunks with better handling for invoices
-            chunks = self._split_into_chunks(text)
+            # Extract text per page based on file type
+            pages = self._extract_pages(file_path, file_content)
+            chunks = self.chunk_pages(pages)
             
             print(f"Processed {file_path}: {len(chunks)} chunks created")
             return chunks
@@ -36,6 +177,14 @@ class DocumentProcessor:
             print(f"Error processing document {file_path}: {e}")
             return []
     
+    def chunk_pages(self, pages: List[str]) -> List[Dict[str, Any]]:
+        """Chunk al geëxtraheerde pagina's"""
+        # Clean per page so page boundaries stay exact after normalisation
+        text, page_starts = self._join_pages([self._clean_text(page) for page in pages])
+        if not text:
+            return []
+        return self._chunk_spans(text, page_starts)
+    
     def _clean_text(self, text: str) -> str:
         """Clean en normaliseer tekst voor betere verwerking"""
         # Remove excessive whitespace
@@ -65,92 +214,143 @@ class DocumentProcessor:
         
         return text.strip()
     
-    def _split_into_chunks(self, text: str) -> List[str]:
-        """Split tekst in chunks met betere logica voor facturen"""
-        if not text:
-            return []
-        
-        # Voor facturen: probeer eerst op natuurlijke grenzen te splitsen
-        chunks = []
+    def _join_pages(self, pages: List[str]) -> Tuple[str, List[Tuple[int, int]]]:
+        """Voeg pagina's samen en onthoud op welke offset elke pagina begint"""
+        parts = []
+        page_starts = []  # (start offset, paginanummer), oplopend gesorteerd
+        offset = 0
+        for page_num, page in enumerate(pages, 1):
+            if not page:
+                continue
+            if parts:
+                offset += 2  # lengte van de '\n\n' scheiding
+            page_starts.append((offset, page_num))
+            parts.append(page)
+            offset += len(page)
+        return '\n\n'.join(parts), page_starts
+    
+    def _chunk_spans(self, text: str, page_starts: List[Tuple[int, int]]) -> List[Dict[str, Any]]:
+        """Split tekst op karakter-offsets in overlappende chunks met paginabereik
         
-        # Split op paragrafen (dubbele newlines)
-        paragraphs = re.split(r'\n\s*\n', text)
+        Er wordt alleen met offsets gerekend; elke chunk wordt precies één keer
+        uit de tekst gesneden.
+        """
+        if self.chunk_unit == 'tokens':
+            spans = self._token_spans(text)
+        else:
+            spans = self._char_spans(text)
         
-        current_chunk = ""
-        for paragraph in paragraphs:
-            paragraph = paragraph.strip()
-            if not paragraph:
+        offsets = [start for start, _ in page_starts]
+        chunks = []
+        for start, end in spans:
+            # Trim witruimte door de offsets te verschuiven in plaats van te kopiëren
+            while start < end and text[start].isspace():
+                start += 1
+            while end > start and text[end - 1].isspace():
+                end -= 1
+            if end - start <= self.min_chunk_length:
                 continue
             
-            # Als deze paragraaf de chunk te groot maakt, start een nieuwe
-            if len(current_chunk) + len(paragraph) > 3000:  # Grotere chunks voor facturen
-                if current_chunk:
-                    chunks.append(current_chunk.strip())
-                current_chunk = paragraph
-            else:
-                if current_chunk:
-                    current_chunk += "\n\n" + paragraph
-                else:
-                    current_chunk = paragraph
-        
-        # Voeg laatste chunk toe
-        if current_chunk:
-            chunks.append(current_chunk.strip())
-        
-        # Als we te weinig chunks hebben, split verder op zinnen
-        if len(chunks) < 2:
-            chunks = []
-            sentences = re.split(r'[.!?]+', text)
+            page_start = page_end = None
+            if page_starts:
+                page_start = page_starts[max(bisect.bisect_right(offsets, start) - 1, 0)][1]
+                page_end = page_starts[max(bisect.bisect_right(offsets, end - 1) - 1, 0)][1]
             
-            current_chunk = ""
-            for sentence in sentences:
-                sentence = sentence.strip()
-                if not sentence:
-                    continue
-                
-                if len(current_chunk) + len(sentence) > 3000:
-                    if current_chunk:
-                        chunks.append(current_chunk.strip())
-                    current_chunk = sentence
-                else:
-                    if current_chunk:
-                        current_chunk += ". " + sentence
-                    else:
-                        current_chunk = sentence
+            chunks.append({
+                'content': text[start:end],
+                'chunk_index': len(chunks),
+                'char_start': start,
+                'char_end': end,
+                'page_start': page_start,
+                'page_end': page_end
+            })
+        return chunks
+    
+    def _char_spans(self, text: str) -> List[Tuple[int, int]]:
+        """Bereken (start, end) offsets met grootte en overlap in karakters"""
+        spans = []
+        length = len(text)
+        start = 0
+        while start < length:
+            end = min(start + self.chunk_size, length)
+            if end < length:
+                end = self._find_break(text, start + self.chunk_size // 2, end)
+            spans.append((start, end))
+            if end >= length:
+                break
             
-            if current_chunk:
-                chunks.append(current_chunk.strip())
-        
-        # Als laatste redmiddel: fixed-size chunks
-        if not chunks:
-            chunks = [text[i:i+3000] for i in range(0, len(text), 2500)]  # 500 overlap
-        
-        # Clean chunks
-        cleaned_chunks = []
-        for chunk in chunks:
-            chunk = chunk.strip()
-            if len(chunk) > 50:  # Minimum chunk size
-                cleaned_chunks.append(chunk)
+            # Volgende chunk begint overlap karakters terug, op een woordgrens
+            next_start = max(end - self.chunk_overlap, start + 1)
+            if next_start < end and not text[next_start - 1].isspace():
+                space = text.find(' ', next_start, end)
+                next_start = space + 1 if space != -1 else next_start
+            start = next_start
+        return spans
+    
+    def _token_spans(self, text: str) -> List[Tuple[int, int]]:
+        """Bereken (start, end) offsets met grootte en overlap in tokens
         
-        return cleaned_chunks 
+        Het tellen van tokens gebeurt in de regex-engine; er wordt geen lijst
+        met alle tokens opgebouwd.
+        """
+        window = re.compile(r'\s*+(?:\S++\s*+){1,%d}' % self.chunk_size)
+        spans = []
+        length = len(text)
+        start = 0
+        while start < length:
+            end = window.match(text, start).end()
+            if end < length:
+                end = self._find_break(text, start + (end - start) // 2, end)
+            spans.append((start, end))
+            if end >= length:
+                break
+            start = max(self._rewind_tokens(text, start, end, self.chunk_overlap), start + 1)
+        return spans
+    
+    def _rewind_tokens(self, text: str, start: int, end: int, count: int) -> int:
+        """Offset van het token dat count tokens voor end begint"""
+        position = end
+        while position > start and text[position - 1].isspace():
+            position -= 1
+        token_start = end
+        has_newline = text.find('\n', start, end) != -1
+        for _ in range(count):
+            boundary = text.rfind(' ', start, position)
+            if has_newline:
+                boundary = max(boundary, text.rfind('\n', start, position))
+            if boundary == -1:
+                break
+            token_start = boundary + 1
+            position = boundary
+            while position > start and text[position - 1].isspace():
+                position -= 1
+        return token_start
+    
+    def _find_break(self, text: str, lower_bound: int, end: int) -> int:
+        """Zoek de sterkste natuurlijke grens tussen lower_bound en end"""
+        for separator in CHUNK_BREAKS:
+            position = text.rfind(separator, lower_bound, end)
+            if position != -1:
+                return position + len(separator)
+        return end
     
-    def _extract_text(self, file_path: str, file_content: bytes = None) -> str:
-        """Extract tekst uit verschillende bestandstypen"""
+    def _extract_pages(self, file_path: str, file_content: bytes = None) -> List[str]:
+        """Extract tekst per pagina uit verschillende bestandstypen"""
         try:
             file_type = self._get_file_type(file_path)
             
             if file_type == 'pdf':
-                return self._extract_pdf_text(file_path, file_content)
+                return self._extract_pdf_pages(file_path, file_content)
             elif file_type == 'docx':
-                return self._extract_docx_text(file_path, file_content)
+                return [self._extract_docx_text(file_path, file_content)]
             elif file_type in ['txt', 'md']:
-                return self._extract_text_file(file_path, file_content)
+                return [self._extract_text_file(file_path, file_content)]
             else:
                 print(f"Unsupported file type: {file_type}")
-                return ""
+                return []
         except Exception as e:
             print(f"Error extracting text from {file_path}: {e}")
-            return ""
+            return []
     
     def _get_file_type(self, file_path: str) -> str:
         """Bepaal bestandstype op basis van extensie"""
@@ -166,51 +366,115 @@ class DocumentProcessor:
         else:
             return 'unknown'
     
-    def _extract_pdf_text(self, file_path: str, file_content: bytes = None) -> str:
-        """Extract tekst uit PDF met OCR fallback"""
+    def _extract_pdf_pages(self, file_path: str, file_content: bytes = None) -> List[str]:
+        """Extract tekst per pagina uit PDF met OCR fallback
+        
+        Een PDF op schijf wordt niet in het geheugen geladen: de hash wordt
+        in blokken berekend en PyPDF2 leest uit een memory map. Alleen als de
+        inhoud als bytes wordt meegegeven, wordt met die bytes gewerkt.
+        """
         try:
-            # Use file_content if provided, otherwise read from file
-            if file_content:
+            self.last_ocr_stats = {'ocr_pages': 0, 'cache_hits': 0}
+            if file_content or not os.path.isfile(file_path):
+                if not file_content:
+                    with open(file_path, 'rb') as file:
+                        file_content = file.read()
                 pdf_reader = PdfReader(BytesIO(file_content))
+                pdf_hash = hashlib.sha256(file_content).hexdigest()
+                pages = [
+                    self._extract_pdf_page(pdf_reader, page_num, file_content, pdf_hash)
+                    for page_num in range(len(pdf_reader.pages))
+                ]
             else:
-                # Read file content first to avoid file handle issues
-                with open(file_path, 'rb') as file:
-                    file_content = file.read()
-                pdf_reader = PdfReader(BytesIO(file_content))
-            
-            text_parts = []
-            for page_num, page in enumerate(pdf_reader.pages):
-                text = page.extract_text()
-                if not text or not text.strip():
-                    # OCR fallback
-                    print(f"Page {page_num+1}: no text found, trying OCR...")
-                    try:
-                        if file_content:
-                            images = convert_from_bytes(file_content)
-                        else:
-                            images = convert_from_path(file_path)
-                        
-                        if page_num < len(images):
-                            ocr_text = pytesseract.image_to_string(images[page_num], lang='nld+eng')
-                            text = ocr_text
-                            print(f"Page {page_num+1} OCR successful: {len(text)} characters")
-                        else:
-                            print(f"Page {page_num+1}: no image available for OCR")
-                    except Exception as ocr_error:
-                        print(f"OCR failed for page {page_num+1}: {ocr_error}")
-                        text = ""
-                
-                if text and text.strip():
-                    text_parts.append(text.strip())
-                    print(f"Page {page_num+1}: extracted {len(text)} characters")
-                else:
-                    print(f"Page {page_num+1}: no text extracted")
+                pdf_hash = _hash_file(file_path)
+                with open(file_path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    pdf_reader = PdfReader(data)
+                    page_count = len(pdf_reader.pages)
+                    # Grote PDF's worden per paginabereik in worker processen verwerkt
+                    parallel = self.pdf_workers > 1 and page_count >= self.pdf_parallel_min_pages
+                    if not parallel:
+                        pages = [
+                            self._extract_pdf_page(pdf_reader, page_num, file_path, pdf_hash)
+                            for page_num in range(page_count)
+                        ]
+                    del pdf_reader  # de reader verwijst naar de map; vrijgeven voor het sluiten
+                if parallel:
+                    pages = self._extract_pdf_pages_parallel(file_path, pdf_hash, page_count)
             
-            result = '\n\n'.join(text_parts)
-            print(f"Total extracted text: {len(result)} characters")
-            return result
+            print(f"Total extracted text: {sum(len(page) for page in pages)} characters")
+            if self.last_ocr_stats['ocr_pages']:
+                print(f"OCR cache: {self.last_ocr_stats['cache_hits']}/{self.last_ocr_stats['ocr_pages']} pages from cache")
+            return pages
         except Exception as e:
             print(f"Error extracting PDF text: {e}")
+            return []
+    
+    def _extract_pdf_pages_parallel(self, file_path: str, pdf_hash: str, page_count: int) -> List[str]:
+        """Verdeel de pagina's in bereiken over de PDF pool en voeg de resultaten op volgorde samen"""
+        # Meer bereiken dan workers, zodat trage (OCR) pagina's de rest niet ophouden
+        range_size = max(-(-page_count // (self.pdf_workers * 4)), PDF_MIN_PAGES_PER_RANGE)
+        ranges = [(first, min(first + range_size, page_count)) for first in range(0, page_count, range_size)]
+        print(f"Extracting {page_count} pages in {len(ranges)} ranges on {self.pdf_workers} workers")
+        
+        pool = get_pdf_pool(self.pdf_workers)
+        futures = [pool.submit(_extract_pdf_range, self, file_path, pdf_hash, first, last) for first, last in ranges]
+        
+        pages = []
+        for future in futures:
+            range_pages, ocr_stats = future.result()
+            pages.extend(range_pages)
+            for key, value in ocr_stats.items():
+                self.last_ocr_stats[key] += value
+        return pages
+    
+    def _extract_pdf_page(self, pdf_reader: PdfReader, page_num: int, pdf_source, pdf_hash: str) -> str:
+        """Extract tekst van één pagina; lege pagina's gaan door OCR"""
+        text = pdf_reader.pages[page_num].extract_text()
+        if not text or not text.strip():
+            # OCR fallback
+            print(f"Page {page_num+1}: no text found, trying OCR...")
+            text = self._ocr_page(pdf_source, pdf_hash, page_num)
+        
+        if text and text.strip():
+            print(f"Page {page_num+1}: extracted {len(text)} characters")
+            return text.strip()
+        # Lege pagina behouden zodat paginanummers kloppen
+        print(f"Page {page_num+1}: no text extracted")
+        return ""
+    
+    def _ocr_page(self, pdf_source, pdf_hash: str, page_num: int) -> str:
+        """OCR één pagina; raadpleegt eerst de OCR cache
+        
+        pdf_source is de PDF als bytes of het pad naar het bestand.
+        """
+        self.last_ocr_stats['ocr_pages'] += 1
+        engine = get_ocr_engine(self.ocr_engine, self.ocr_lang)
+        cache_key = self.ocr_cache.make_key(pdf_hash, page_num, self.ocr_dpi, self.ocr_lang, engine.name)
+        cached = self.ocr_cache.get(cache_key)
+        if cached is not None:
+            self.last_ocr_stats['cache_hits'] += 1
+            print(f"Page {page_num+1} OCR cache hit: {len(cached)} characters")
+            return cached
+        
+        try:
+            # Render alleen deze pagina in plaats van het hele document
+            convert = convert_from_bytes if isinstance(pdf_source, bytes) else convert_from_path
+            images = convert(
+                pdf_source,
+                dpi=self.ocr_dpi,
+                first_page=page_num + 1,
+                last_page=page_num + 1
+            )
+            if not images:
+                print(f"Page {page_num+1}: no image available for OCR")
+                return ""
+            
+            text = engine.image_to_string(images[0])
+            print(f"Page {page_num+1} OCR successful: {len(text)} characters")
+            self.ocr_cache.put(cache_key, text)
+            return text
+        except Exception as ocr_error:
+            print(f"OCR failed for page {page_num+1}: {ocr_error}")
             return ""
     
     def _extract_docx_text(self, file_path: str, file_content: bytes = None) -> str:
@@ -0,0 +1,197 @@
+import os
+import time
+import signal
+import zipfile
+import contextlib
+import threading
+import multiprocessing
+from typing import List, Dict, Any, Optional
+from PyPDF2 import PdfReader
+from rag.document_processor import DocumentProcessor
+
+MB = 1024 * 1024
+
+class IngestionError(Exception):
+    """Verwerking van een document is mislukt; de melding komt in Document.processing_error"""
+
+class IngestionLimitExceeded(IngestionError):
+    """Een ingestion job overschreed een van zijn limieten"""
+    def __init__(self, limit: str, message: str):
+        super().__init__(message)
+        self.limit = limit
+
+class IngestionLimits:
+    """Budget per ingestion job; 0 betekent geen limiet"""
+    def __init__(self, max_seconds: float = None, max_pages: int = None, max_chars: int = None,
+                 max_rss_bytes: int = None, max_docx_bytes: int = None):
+        self.max_seconds = max_seconds if max_seconds is not None else float(os.getenv("INGEST_MAX_SECONDS", "600"))
+        self.max_pages = max_pages if max_pages is not None else int(os.getenv("INGEST_MAX_PAGES", "2000"))
+        self.max_chars = max_chars if max_chars is not None else int(os.getenv("INGEST_MAX_CHARS", "20000000"))
+        if max_rss_bytes is None:
+            max_rss_bytes = int(os.getenv("INGEST_MAX_RSS_MB", "2048")) * MB
+        self.max_rss_bytes = max_rss_bytes
+        if max_docx_bytes is None:
+            max_docx_bytes = int(os.getenv("INGEST_MAX_DOCX_MB", "200")) * MB
+        self.max_docx_bytes = max_docx_bytes
+
+# Met isolatie uit draait de verwerking in het eigen process (handig bij debuggen)
+INGEST_ISOLATION = os.getenv("INGEST_ISOLATION", "true").lower() == "true"
+# Maximaal aantal gelijktijdige ingestion processen per process dat de standaard
+# slots gebruikt (de API); reprocess_documents begrenst zelf met --workers
+INGEST_MAX_JOBS = int(os.getenv("INGEST_MAX_JOBS", "2"))
+# Ingestion processen krijgen lagere CPU-prioriteit dan de API
+INGEST_NICE = int(os.getenv("INGEST_NICE", "10"))
+POLL_INTERVAL = 0.2
+
+_job_slots = threading.BoundedSemaphore(max(INGEST_MAX_JOBS, 1))
+
+def check_file_limits(file_path: str, limits: IngestionLimits):
+    """Goedkope controles vooraf, zonder de inhoud te extraheren"""
+    ext = os.path.splitext(file_path)[1].lower()
+    if ext == '.pdf' and limits.max_pages:
+        pages = len(PdfReader(file_path).pages)
+        if pages > limits.max_pages:
+            raise IngestionLimitExceeded("pages", f"PDF has {pages} pages, limit is {limits.max_pages}")
+    elif ext == '.docx' and limits.max_docx_bytes:
+        # Een DOCX is een zip; controleer de uitgepakte grootte tegen zip-bombs
+        try:
+            with zipfile.ZipFile(file_path) as archive:
+                uncompressed = sum(info.file_size for info in archive.infolist())
+        except zipfile.BadZipFile:
+            raise IngestionError("DOCX file is not a valid zip archive")
+        if uncompressed > limits.max_docx_bytes:
+            raise IngestionLimitExceeded(
+                "docx_size",
+                f"DOCX expands to {uncompressed // MB} MB, limit is {limits.max_docx_bytes // MB} MB"
+            )
+
+def extract_with_limits(processor: DocumentProcessor, file_path: str, limits: IngestionLimits) -> List[Dict[str, Any]]:
+    """Extractie en chunking met de limieten die binnen het process te controleren zijn"""
+    check_file_limits(file_path, limits)
+    pages = processor._extract_pages(file_path)
+    chars = sum(len(page) for page in pages)
+    if limits.max_chars and chars > limits.max_chars:
+        raise IngestionLimitExceeded("chars", f"Extracted {chars} characters, limit is {limits.max_chars}")
+    chunks = processor.chunk_pages(pages)
+    print(f"Processed {file_path}: {len(chunks)} chunks created")
+    return chunks
+
+def _job_main(conn, processor: DocumentProcessor, file_path: str, limits: IngestionLimits):
+    """Entrypoint van het ingestion process; stuurt het resultaat terug over de pipe"""
+    try:
+        os.nice(INGEST_NICE)
+    except (AttributeError, OSError):
+        pass
+    try:
+        conn.send(("ok", extract_with_limits(processor, file_path, limits)))
+    except IngestionLimitExceeded as e:
+        conn.send(("limit", (e.limit, str(e))))
+    except IngestionError as e:
+        conn.send(("error", str(e)))
+    except Exception as e:
+        conn.send(("error", f"{type(e).__name__}: {e}"))
+    finally:
+        conn.close()
+
+def _children(pid: int) -> List[int]:
+    """Directe child processen volgens /proc (leeg als /proc ontbreekt)"""
+    children = []
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            children = [int(child) for child in f.read().split()]
+    except (OSError, ValueError):
+        pass
+    return children
+
+def _process_tree(pid: int) -> List[int]:
+    """pid plus alle nakomelingen, zoals de PDF pool van de job"""
+    tree = [pid]
+    for current in tree:
+        tree.extend(_children(current))
+    return tree
+
+def _tree_rss(pid: int) -> Optional[int]:
+    """Opgeteld RSS geheugen van de procesboom in bytes, of None als niet meetbaar"""
+    total = None
+    for member in _process_tree(pid):
+        try:
+            with open(f"/proc/{member}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total = (total or 0) + int(line.split()[1]) * 1024
+                        break
+        except (OSError, ValueError):
+            continue
+    return total
+
+def _kill_tree(pid: int):
+    """Stop de job inclusief eventuele eigen worker processen"""
+    for member in reversed(_process_tree(pid)):
+        try:
+            os.kill(member, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+def run_ingestion_job(file_path: str, processor: DocumentProcessor = None, limits: IngestionLimits = None,
+                      slots: Optional[threading.Semaphore] = _job_slots) -> List[Dict[str, Any]]:
+    """Extraheer en chunk een document in een geïsoleerd process met tijd-, pagina-, tekst- en geheugenbudget
+
+    Overschrijdt de job een limiet, dan wordt het process (met zijn kinderen)
+    gestopt en volgt IngestionLimitExceeded. Andere fouten geven IngestionError.
+    `slots` begrenst het aantal gelijktijdige jobs (standaard INGEST_MAX_JOBS);
+    geef None mee als de aanroeper zelf al begrenst. De tijdslimiet loopt pas
+    vanaf het moment dat de job een slot heeft.
+    """
+    processor = processor or DocumentProcessor()
+    limits = limits or IngestionLimits()
+    if not INGEST_ISOLATION:
+        try:
+            return extract_with_limits(processor, file_path, limits)
+        except IngestionError:
+            raise
+        except Exception as e:
+            raise IngestionError(f"{type(e).__name__}: {e}")
+
+    with slots if slots is not None else contextlib.nullcontext():
+        context = multiprocessing.get_context("spawn")
+        receiver, sender = context.Pipe(duplex=False)
+        process = context.Process(target=_job_main, args=(sender, processor, file_path, limits), daemon=False)
+        started = time.monotonic()
+        process.start()
+        sender.close()
+        try:
+            while True:
+                if receiver.poll(POLL_INTERVAL):
+                    try:
+                        status, payload = receiver.recv()
+                    except EOFError:
+                        process.join()
+                        raise IngestionError(f"Ingestion worker exited with code {process.exitcode}")
+                    break
+                if not process.is_alive():
+                    raise IngestionError(f"Ingestion worker exited with code {process.exitcode}")
+
+                elapsed = time.monotonic() - started
+                if limits.max_seconds and elapsed > limits.max_seconds:
+                    _kill_tree(process.pid)
+                    raise IngestionLimitExceeded("time", f"Processing took longer than {limits.max_seconds:.0f}s")
+                if limits.max_rss_bytes:
+                    rss = _tree_rss(process.pid)
+                    if rss and rss > limits.max_rss_bytes:
+                        _kill_tree(process.pid)
+                        raise IngestionLimitExceeded(
+                            "memory",
+                            f"Processing used {rss // MB} MB, limit is {limits.max_rss_bytes // MB} MB"
+                        )
+        finally:
+            receiver.close()
+            process.join(timeout=5)
+            if process.is_alive():
+                _kill_tree(process.pid)
+                process.join()
+
+    if status == "limit":
+        raise IngestionLimitExceeded(*payload)
+    if status == "error":
+        raise IngestionError(payload)
+    return payload
@@ -0,0 +1,67 @@
+import os
+import importlib.util
+from typing import Dict
+import httpx
+from rag.metrics import metrics
+
+# Pool-instellingen voor de gedeelde HTTP clients van de LLM providers
+HTTP_MAX_CONNECTIONS = int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", "50"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("LLM_HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("LLM_HTTP_KEEPALIVE_EXPIRY", "60"))
+# HTTP/2 alleen als het h2 pakket aanwezig is (httpx[http2])
+HTTP2 = os.getenv("LLM_HTTP2", "true").lower() == "true" and importlib.util.find_spec("h2") is not None
+
+metrics.describe("llm_http_requests_total", "HTTP requests naar LLM providers")
+metrics.describe("llm_http_connections_opened_total", "Nieuw geopende TCP verbindingen naar LLM providers")
+metrics.describe("llm_http_connections_reused_total", "Requests die een bestaande keep-alive verbinding hergebruikten")
+
+_async_clients: Dict[str, httpx.AsyncClient] = {}
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+    )
+
+class _ConnectionTrace:
+    """Telt per request of er een nieuwe verbinding nodig was (httpcore trace extension)"""
+    def __init__(self, provider: str):
+        self.provider = provider
+        self.connected = False
+
+    def record(self, event_name: str):
+        if event_name == "connection.connect_tcp.complete":
+            self.connected = True
+            metrics.inc("llm_http_connections_opened_total", provider=self.provider)
+        elif event_name.endswith(".send_request_headers.started"):
+            metrics.inc("llm_http_requests_total", provider=self.provider)
+            if not self.connected:
+                metrics.inc("llm_http_connections_reused_total", provider=self.provider)
+
+def _trace_hook(provider: str):
+    async def on_request(request: httpx.Request):
+        trace = _ConnectionTrace(provider)
+        async def callback(event_name, info):
+            trace.record(event_name)
+        request.extensions["trace"] = callback
+    return on_request
+
+def get_async_client(provider: str, timeout: httpx.Timeout = None) -> httpx.AsyncClient:
+    """Gedeelde AsyncClient per provider; verbindingen blijven open tussen requests"""
+    client = _async_clients.get(provider)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            timeout=timeout or httpx.Timeout(300.0, connect=30.0),
+            limits=_limits(),
+            http2=HTTP2,
+            event_hooks={"request": [_trace_hook(provider)]}
+        )
+        _async_clients[provider] = client
+    return client
+
+async def close_http_clients():
+    """Sluit alle gedeelde clients en hun verbindingen (bij afsluiten van de app)"""
+    for client in list(_async_clients.values()):
+        await client.aclose()
+    _async_clients.clear()
@@ -1,18 +1,131 @@
 import json
+import logging
 from typing import Dict, Any, List, AsyncGenerator
 import os
 import httpx
 import asyncio
 import traceback
 import time
+import random
+import hashlib
+import threading
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from datetime import datetime, timedelta
 import openai
+from db import SessionLocal
+from models import LLMCacheEntry
+from rag.http_clients import get_async_client, close_http_clients
+from rag.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+metrics.describe("llm_retries_total", "Herhaalde LLM requests na een tijdelijke fout")
+metrics.describe("llm_inflight_requests", "LLM requests die nu lopen, per provider en tier")
+metrics.describe("llm_queue_depth", "LLM requests die wachten op een plek, per provider en tier")
+metrics.describe("llm_queue_wait_seconds", "Wachttijd in de LLM scheduler, per provider en tier")
+metrics.describe("llm_cascade_requests_total", "Aanroepen via de model cascade per route (small, large, escalated) en model")
+metrics.describe("llm_cascade_escalations_total", "Antwoorden van het kleine model die de validatie niet haalden")
+metrics.describe("llm_cascade_latency_seconds", "Duur van een aanroep per cascade route")
+metrics.describe("llm_cascade_cost_total", "Geschatte kosten per cascade route (LLM_MODEL_PRICES per 1000 tokens)")
+metrics.describe("ollama_load_seconds", "Tijd die Ollama besteedde aan het laden van het model, per aanroep")
+metrics.describe("ollama_prompt_eval_seconds", "Prefill: verwerken van het prompt door Ollama")
+metrics.describe("ollama_eval_seconds", "Genereren van het antwoord door Ollama")
+metrics.describe("ollama_tokens_total", "Tokens per model; kind=prompt of generated")
+metrics.describe("ollama_model_loads_total", "Aanroepen waarbij Ollama het model (opnieuw) moest laden")
+metrics.describe("ollama_context_truncations_total", "Prompts die (bijna) het hele contextvenster vulden en afgekapt kunnen zijn")
+metrics.describe("ollama_warmups_total", "Warm-up en keep-alive pings naar Ollama per uitkomst")
+metrics.describe("llm_cache_requests_total", "Opzoekingen in de LLM response cache per uitkomst (hit, miss, too_large)")
+metrics.describe("llm_cache_hit_ratio", "Aandeel hits in de LLM response cache sinds de start van dit process")
+metrics.describe("llm_cache_entries", "Aantal entries in de LLM response cache bij de laatste opruimronde")
+
+# Ollama rapporteert duur in nanoseconden
+_NS = 1e9
+# Vanaf deze laadtijd telt een aanroep als koude start
+OLLAMA_COLD_LOAD_SECONDS = 0.5
+# Contextvenster van Ollama als OLLAMA_NUM_CTX niet is gezet
+OLLAMA_DEFAULT_NUM_CTX = 2048
 
 class OllamaLLM:
-    def __init__(self, model_name: str = "mistral", base_url: str = None):
-        self.model_name = model_name
+    def __init__(self, model_name: str = None, base_url: str = None):
+        self.model_name = model_name or os.getenv("OLLAMA_MODEL", "mistral")
         self.base_url = base_url or os.getenv("OLLAMA_BASE_URL", "http://ollama:11434")
+        # Hoe lang Ollama het model na een aanroep geladen houdt (bijv. "30m", "-1" = altijd)
+        self.keep_alive = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+        # Contextvenster en maximum aantal tokens; 0 = standaard van het model
+        self.num_ctx = int(os.getenv("OLLAMA_NUM_CTX", "0"))
+        self.num_predict = int(os.getenv("OLLAMA_NUM_PREDICT", "0"))
+        # Leeg = standaard van het model (en dan geen response cache)
+        temperature = os.getenv("OLLAMA_TEMPERATURE", "")
+        self.temperature = float(temperature) if temperature else None
+        self.last_used = 0.0
+    
+    def _payload(self, full_prompt: str, stream: bool, max_tokens: int = None, model: str = None) -> Dict[str, Any]:
+        payload = {
+            "model": model or self.model_name,
+            "prompt": full_prompt,
+            "stream": stream
+        }
+        if self.keep_alive:
+            payload["keep_alive"] = self.keep_alive
+        options = {}
+        if self.num_ctx:
+            options["num_ctx"] = self.num_ctx
+        if self.temperature is not None:
+            options["temperature"] = self.temperature
+        if max_tokens or self.num_predict:
+            options["num_predict"] = max_tokens or self.num_predict
+        if options:
+            payload["options"] = options
+        return payload
+    
+    def _record_stats(self, data: Dict[str, Any], model: str = None):
+        """Zet de statistieken uit het laatste Ollama-antwoord om in metrics
+
+        Laadtijd, prefill en generatie apart, zodat te zien is of latency uit
+        koude starts, lange prompts of het genereren zelf komt.
+        """
+        model = model or self.model_name
+        self.last_used = time.monotonic()
+        load = data.get("load_duration", 0) / _NS
+        metrics.observe("ollama_load_seconds", load, model=model)
+        if load >= OLLAMA_COLD_LOAD_SECONDS:
+            metrics.inc("ollama_model_loads_total", model=model)
+            logger.info("Ollama laadde model %s (%.1fs)", model, load)
+        if "prompt_eval_duration" in data:
+            metrics.observe("ollama_prompt_eval_seconds", data["prompt_eval_duration"] / _NS, model=model)
+        if "eval_duration" in data:
+            metrics.observe("ollama_eval_seconds", data["eval_duration"] / _NS, model=model)
+        prompt_tokens = data.get("prompt_eval_count", 0)
+        metrics.inc("ollama_tokens_total", prompt_tokens, model=model, kind="prompt")
+        metrics.inc("ollama_tokens_total", data.get("eval_count", 0), model=model, kind="generated")
+        # Ollama kapt een te lang prompt stil af op num_ctx tokens
+        num_ctx = self.num_ctx or OLLAMA_DEFAULT_NUM_CTX
+        if prompt_tokens >= num_ctx * 0.95:
+            metrics.inc("ollama_context_truncations_total", model=model)
+            logger.warning("Prompt van %d tokens vult het contextvenster (%d); context is mogelijk afgekapt", prompt_tokens, num_ctx)
+    
+    async def warm_up(self, model: str = None) -> bool:
+        """Laad het model vooraf (leeg prompt) en houd het keep_alive lang geladen"""
+        model = model or self.model_name
+        payload = self._payload("", False, model=model)
+        # Zelfde num_ctx als echte aanroepen, anders laadt Ollama het model opnieuw
+        payload.get("options", {}).pop("num_predict", None)
+        try:
+            response = await get_async_client("ollama").post(
+                f"{self.base_url}/api/generate", json=payload, timeout=httpx.Timeout(300.0, connect=30.0)
+            )
+            response.raise_for_status()
+            self._record_stats(response.json(), model)
+        except Exception as e:
+            logger.warning("Ollama warm-up van %s mislukt: %s", model, e)
+            metrics.inc("ollama_warmups_total", model=model, outcome="error")
+            return False
+        metrics.inc("ollama_warmups_total", model=model, outcome="ok")
+        return True
     
-    async def generate_streaming(self, prompt: str, context: str = "") -> AsyncGenerator[str, None]:
+    async def generate_streaming(self, prompt: str, context: str = "", max_tokens: int = None, model: str = None) -> AsyncGenerator[str, None]:
         """Genereer een antwoord met streaming voor betere UX"""
         print(f"[LLM DEBUG] START generate_streaming()")
         try:
@@ -26,30 +139,28 @@ class OllamaLLM:
             
             # Kortere timeout voor streaming (2 minuten)
             timeout_config = httpx.Timeout(120.0, connect=30.0)
-            async with httpx.AsyncClient(timeout=timeout_config) as client:
-                async with client.stream(
-                    "POST",
-                    f"{self.base_url}/api/generate",
-                    json={
-                        "model": self.model_name,
-                        "prompt": full_prompt,
-                        "stream": True
-                    }
-                ) as response:
-                    if response.status_code == 200:
-                        async for line in response.aiter_lines():
-                            if line.strip():
-                                try:
-                                    data = json.loads(line)
-                                    if "response" in data:
-                                        yield data["response"]
-                                    if data.get("done", False):
-                                        break
-                                except json.JSONDecodeError:
-                                    continue
-                    else:
-                        error_msg = f"Error: Kon geen verbinding maken met Ollama (status {response.status_code})"
-                        yield error_msg
+            client = get_async_client("ollama")
+            async with client.stream(
+                "POST",
+                f"{self.base_url}/api/generate",
+                json=self._payload(full_prompt, True, max_tokens, model),
+                timeout=timeout_config
+            ) as response:
+                if response.status_code == 200:
+                    async for line in response.aiter_lines():
+                        if line.strip():
+                            try:
+                                data = json.loads(line)
+                                if "response" in data:
+                                    yield data["response"]
+                                if data.get("done", False):
+                                    self._record_stats(data, model)
+                                    break
+                            except json.JSONDecodeError:
+                                continue
+                else:
+                    error_msg = f"Error: Kon geen verbinding maken met Ollama (status {response.status_code})"
+                    yield error_msg
         except httpx.TimeoutException as e:
             print(f"[LLM DEBUG] Timeout Exception: {e}")
             yield "Error: Ollama duurde te lang om te antwoorden (meer dan 2 minuten). Probeer een kortere vraag."
@@ -61,7 +172,7 @@ class OllamaLLM:
             traceback.print_exc()
             yield f"Error: Kon geen verbinding maken met Ollama: {str(e)}"
     
-    async def generate(self, prompt: str, context: str = "") -> str:
+    async def generate(self, prompt: str, context: str = "", max_tokens: int = None, model: str = None) -> str:
         """Genereer een antwoord met context via Ollama (non-streaming fallback)"""
         print(f"[LLM DEBUG] START generate()")
         try:
@@ -87,29 +198,26 @@ class OllamaLLM:
                     f"Vraag: {prompt}\n\nAntwoord:"
                 )
             print(f"[LLM DEBUG] Request aan Ollama: {self.base_url}/api/generate")
-            print(f"[LLM DEBUG] Payload: {{'model': '{self.model_name}', 'prompt': '{full_prompt[:200]}...', 'stream': False}}")
+            print(f"[LLM DEBUG] Payload: {{'model': '{model or self.model_name}', 'prompt': '{full_prompt[:200]}...', 'stream': False}}")
             
             # Verhoog timeout naar 300 seconden (5 minuten) voor complexe vragen
             timeout_config = httpx.Timeout(300.0, connect=30.0)
-            async with httpx.AsyncClient(timeout=timeout_config) as client:
-                response = await client.post(
-                    f"{self.base_url}/api/generate",
-                    json={
-                        "model": self.model_name,
-                        "prompt": full_prompt,
-                        "stream": False
-                    }
-                )
-                print(f"[LLM DEBUG] Status code: {response.status_code}")
-                print(f"[LLM DEBUG] Response text: {response.text[:500]}")
-                if response.status_code == 200:
-                    result = response.json()
-                    print(f"[LLM DEBUG] END generate() OK")
-                    return result.get("response", "Geen antwoord ontvangen van de LLM.")
-                else:
-                    print(f"Ollama API error: {response.status_code} - {response.text}")
-                    print(f"[LLM DEBUG] END generate() ERROR")
-                    return f"Error: Kon geen verbinding maken met Ollama (status {response.status_code})"
+            response = await get_async_client("ollama").post(
+                f"{self.base_url}/api/generate",
+                json=self._payload(full_prompt, False, max_tokens, model),
+                timeout=timeout_config
+            )
+            print(f"[LLM DEBUG] Status code: {response.status_code}")
+            print(f"[LLM DEBUG] Response text: {response.text[:500]}")
+            if response.status_code == 200:
+                result = response.json()
+                self._record_stats(result, model)
+                print(f"[LLM DEBUG] END generate() OK")
+                return result.get("response", "Geen antwoord ontvangen van de LLM.")
+            else:
+                print(f"Ollama API error: {response.status_code} - {response.text}")
+                print(f"[LLM DEBUG] END generate() ERROR")
+                return f"Error: Kon geen verbinding maken met Ollama (status {response.status_code})"
         except httpx.TimeoutException as e:
             print(f"[LLM DEBUG] Timeout Exception: {e}")
             print(f"[LLM DEBUG] END generate() TIMEOUT")
@@ -124,7 +232,7 @@ class OllamaLLM:
             print(f"[LLM DEBUG] END generate() EXCEPTION")
             return f"Error: Kon geen verbinding maken met Ollama: {str(e)}"
     
-    async def generate_with_sources(self, question: str, sources: List[Dict[str, Any]]) -> Dict[str, Any]:
+    async def generate_with_sources(self, question: str, sources: List[Dict[str, Any]], max_tokens: int = None, model: str = None) -> Dict[str, Any]:
         print(f"[LLM DEBUG] START generate_with_sources()")
         try:
             # Combineer alle bronnen
@@ -137,22 +245,19 @@ class OllamaLLM:
             
             # Probeer eerst streaming, val terug op normale request
             try:
-                # Start streaming response
+                # Lees de volledige stream; afbreken zou een half antwoord opleveren
                 full_response = ""
-                async for chunk in self.generate_streaming(question, context):
+                async for chunk in self.generate_streaming(question, context, max_tokens=max_tokens, model=model):
                     full_response += chunk
-                    # Stop na 30 seconden als er nog geen antwoord is
-                    if len(full_response) > 50 and not full_response.startswith("Error:"):
-                        break
                 
                 if full_response and not full_response.startswith("Error:"):
                     answer = full_response
                 else:
                     # Fallback naar normale request
-                    answer = await self.generate(question, context)
+                    answer = await self.generate(question, context, max_tokens=max_tokens, model=model)
             except Exception as e:
                 print(f"[LLM DEBUG] Streaming failed, falling back: {e}")
-                answer = await self.generate(question, context)
+                answer = await self.generate(question, context, max_tokens=max_tokens, model=model)
             
             # Format bronnen voor weergave
             formatted_sources = []
@@ -180,16 +285,17 @@ class OllamaLLM:
             }
     
     async def close(self):
-        """Sluit de HTTP client (niet meer nodig)"""
+        """De gedeelde HTTP client wordt gesloten door close_llms()"""
         pass
 
 class FastMockLLM:
     """Snelle mock LLM voor ontwikkeling en testing"""
+    temperature = 0.0
     def __init__(self, model_name: str = "mistral", base_url: str = None):
         self.model_name = model_name
         self.base_url = base_url or os.getenv("OLLAMA_BASE_URL", "http://ollama:11434")
     
-    async def generate(self, prompt: str, context: str = "") -> str:
+    async def generate(self, prompt: str, context: str = "", max_tokens: int = None, model: str = None) -> str:
         """Genereer een snel mock antwoord"""
         await asyncio.sleep(0.5)  # Simuleer korte verwerkingstijd
         if context:
@@ -197,7 +303,14 @@ class FastMockLLM:
         else:
             return f"Snel mock antwoord: {prompt}"
     
-    async def generate_with_sources(self, question: str, sources: List[Dict[str, Any]]) -> Dict[str, Any]:
+    async def generate_streaming(self, prompt: str, context: str = "", max_tokens: int = None, model: str = None) -> AsyncGenerator[str, None]:
+        """Stream het mock antwoord woord voor woord"""
+        answer = await self.generate(prompt, context, max_tokens=max_tokens, model=model)
+        for word in answer.split(" "):
+            yield word + " "
+            await asyncio.sleep(0.02)
+    
+    async def generate_with_sources(self, question: str, sources: List[Dict[str, Any]], max_tokens: int = None, model: str = None) -> Dict[str, Any]:
         """Genereer snel antwoord met bronnen (mock)"""
         await asyncio.sleep(0.5)  # Simuleer korte verwerkingstijd
         
@@ -209,7 +322,7 @@ class FastMockLLM:
         context = "\n\n".join(context_parts)
         
         # Genereer antwoord
-        answer = await self.generate(question, context)
+        answer = await self.generate(question, context, max_tokens=max_tokens, model=model)
         
         # Format bronnen voor weergave
         formatted_sources = []
@@ -232,18 +345,25 @@ class FastMockLLM:
         pass
 
 class MockLLM:
+    temperature = 0.0
     def __init__(self, model_name: str = "mistral", base_url: str = None):
         self.model_name = model_name
         self.base_url = base_url or os.getenv("OLLAMA_BASE_URL", "http://ollama:11434")
     
-    async def generate(self, prompt: str, context: str = "") -> str:
+    async def generate(self, prompt: str, context: str = "", max_tokens: int = None, model: str = None) -> str:
         """Genereer een antwoord met context (mock)"""
         if context:
             return f"Gebaseerd op de context: {context[:100]}...\n\nAntwoord: Dit is een mock antwoord op je vraag: {prompt}"
         else:
             return f"Mock antwoord: {prompt}"
     
-    async def generate_with_sources(self, question: str, sources: List[Dict[str, Any]]) -> Dict[str, Any]:
+    async def generate_streaming(self, prompt: str, context: str = "", max_tokens: int = None, model: str = None) -> AsyncGenerator[str, None]:
+        """Stream het mock antwoord woord voor woord"""
+        answer = await self.generate(prompt, context, max_tokens=max_tokens, model=model)
+        for word in answer.split(" "):
+            yield word + " "
+    
+    async def generate_with_sources(self, question: str, sources: List[Dict[str, Any]], max_tokens: int = None, model: str = None) -> Dict[str, Any]:
         """Genereer antwoord met bronnen (mock)"""
         # Combineer alle bronnen
         context_parts = []
@@ -253,7 +373,7 @@ class MockLLM:
         context = "\n\n".join(context_parts)
         
         # Genereer antwoord
-        answer = await self.generate(question, context)
+        answer = await self.generate(question, context, max_tokens=max_tokens, model=model)
         
         # Format bronnen voor weergave
         formatted_sources = []
@@ -278,103 +398,117 @@ class MockLLM:
 class OpenAILLM:
     def __init__(self, model_name: str = "gpt-3.5-turbo", api_key: str = None):
         self.model_name = model_name
+        self.temperature = 0.2
         self.api_key = api_key or os.getenv("OPENAI_API_KEY")
         if not self.api_key:
             raise ValueError("OpenAI API key is required. Set OPENAI_API_KEY environment variable.")
+        self.timeout = httpx.Timeout(
+            float(os.getenv("OPENAI_TIMEOUT", "120")),
+            connect=float(os.getenv("OPENAI_CONNECT_TIMEOUT", "10"))
+        )
+        self.max_retries = int(os.getenv("OPENAI_MAX_RETRIES", "3"))
+        self.retry_base_delay = float(os.getenv("OPENAI_RETRY_BASE_DELAY", "0.5"))
+        self.retry_max_delay = float(os.getenv("OPENAI_RETRY_MAX_DELAY", "20"))
+        # Eén gedeelde async client; retries doen we zelf, met jitter
+        self.client = openai.AsyncOpenAI(
+            api_key=self.api_key,
+            http_client=get_async_client("openai", self.timeout),
+            timeout=self.timeout,
+            max_retries=0
+        )
 
-    async def generate_streaming(self, prompt: str, context: str = "") -> AsyncGenerator[str, None]:
-        """Genereer een antwoord met streaming voor betere UX"""
+    def _retry_delay(self, attempt: int, error: Exception) -> float:
+        """Exponentiële backoff met full jitter; een Retry-After header gaat voor"""
+        response = getattr(error, "response", None)
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        if retry_after:
+            try:
+                return min(float(retry_after), self.retry_max_delay)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.retry_max_delay, self.retry_base_delay * (2 ** attempt)))
+
+    @staticmethod
+    def _is_retryable(error: Exception) -> bool:
+        if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError, openai.RateLimitError)):
+            return True
+        return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+    async def _create(self, model: str = None, **kwargs):
+        """chat.completions.create met retries op 429/5xx en netwerkfouten
+
+        Annuleren (bijv. een client die afhaakt) breekt het lopende request
+        direct af; er blijft geen thread doorlopen.
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await self.client.chat.completions.create(model=model or self.model_name, **kwargs)
+            except Exception as e:
+                if attempt >= self.max_retries or not self._is_retryable(e):
+                    raise
+                delay = self._retry_delay(attempt, e)
+                reason = getattr(e, "status_code", None) or type(e).__name__
+                metrics.inc("llm_retries_total", provider="openai", reason=reason)
+                logger.info("OpenAI %s, retry %d/%d in %.2fs", reason, attempt + 1, self.max_retries, delay)
+                await asyncio.sleep(delay)
+
+    def _build_prompt(self, prompt: str, context: str = "") -> str:
+        """Bouw de prompt op; gedeeld door generate en generate_streaming"""
+        if context:
+            return (
+                "Je bent een ervaren AI-assistent die vragen beantwoordt op basis van geüploade documenten. Beantwoord de onderstaande vraag zo volledig, duidelijk en professioneel mogelijk, uitsluitend op basis van de context uit de geüploade documenten.\n"
+                "Gebruik alleen informatie die daadwerkelijk in de context staat.\n"
+                "- Geef een helder, zelfstandig antwoord in normaal Nederlands.\n"
+                "- Schrijf als een mens, niet als een robot.\n"
+                "- Gebruik geen opsommingen, geen markdown, geen kopjes, geen verwijzingen naar 'bron 1' of 'bron 2'.\n"
+                "- Vat relevante informatie samen tot een lopend verhaal.\n"
+                "- Voor factuurvragen: zoek specifiek naar bedragen, periodes en kortingen in de context.\n"
+                "- Als je een factuur ziet met bedragen, geef dan het totaalbedrag en de periode.\n"
+                "- Als de vraag om een samenvatting per document vraagt, geef dan per document een korte, duidelijke samenvatting.\n"
+                "- Probeer altijd een nuttig antwoord te geven op basis van de beschikbare informatie.\n\n"
+                f"Context:\n{context}\n\nVraag: {prompt}\n\nAntwoord:"
+            )
+        return (
+            "Je bent een ervaren AI-assistent die vragen beantwoordt op basis van geüploade documenten. Beantwoord de onderstaande vraag zo volledig, duidelijk en professioneel mogelijk.\n"
+            "Geef een helder, zelfstandig antwoord in normaal Nederlands.\n"
+            "Schrijf als een mens, niet als een robot.\n"
+            "Gebruik geen opsommingen, geen markdown, geen kopjes.\n"
+            "Als je het antwoord niet weet, zeg dat dan eerlijk.\n\n"
+            f"Vraag: {prompt}\n\nAntwoord:"
+        )
+
+    async def generate_streaming(self, prompt: str, context: str = "", max_tokens: int = None, model: str = None) -> AsyncGenerator[str, None]:
+        """Genereer een antwoord met echte token streaming van de OpenAI API"""
         print(f"[LLM DEBUG] START generate_streaming() - OpenAI")
         try:
-            # Bouw de prompt op
-            if context:
-                full_prompt = (
-                    "Je bent een ervaren AI-assistent die vragen beantwoordt op basis van geüploade documenten. Beantwoord de onderstaande vraag zo volledig, duidelijk en professioneel mogelijk, uitsluitend op basis van de context uit de geüploade documenten.\n"
-                    "Gebruik alleen informatie die daadwerkelijk in de context staat.\n"
-                    "- Geef een helder, zelfstandig antwoord in normaal Nederlands.\n"
-                    "- Schrijf als een mens, niet als een robot.\n"
-                    "- Gebruik geen opsommingen, geen markdown, geen kopjes, geen verwijzingen naar 'bron 1' of 'bron 2'.\n"
-                    "- Vat relevante informatie samen tot een lopend verhaal.\n"
-                    "- Als de vraag om een samenvatting per document vraagt, geef dan per document een korte, duidelijke samenvatting.\n"
-                    "- Als de vraag echt niet beantwoord kan worden met de beschikbare informatie, zeg dat dan eerlijk.\n\n"
-                    f"Context:\n{context}\n\nVraag: {prompt}\n\nAntwoord:"
-                )
-            else:
-                full_prompt = (
-                    "Je bent een ervaren AI-assistent die vragen beantwoordt op basis van geüploade documenten. Beantwoord de onderstaande vraag zo volledig, duidelijk en professioneel mogelijk.\n"
-                    "Gebruik alleen informatie die daadwerkelijk in de context staat.\n"
-                    "- Geef een helder, zelfstandig antwoord in normaal Nederlands.\n"
-                    "- Schrijf als een mens, niet als een robot.\n"
-                    "- Gebruik geen opsommingen, geen markdown, geen kopjes.\n"
-                    "- Als je het antwoord niet weet, zeg dat dan eerlijk.\n\n"
-                    f"Vraag: {prompt}\n\nAntwoord:"
-                )
-            
-            print(f"[LLM DEBUG] OpenAI streaming request")
-            
-            # Voor OpenAI kunnen we geen echte streaming doen, dus we doen een normale request
-            # en simuleren streaming door het antwoord in chunks te sturen
-            answer = await self.generate(prompt, context)
-            
-            # Simuleer streaming door het antwoord in chunks te sturen
-            chunk_size = 50
-            for i in range(0, len(answer), chunk_size):
-                chunk = answer[i:i + chunk_size]
-                yield chunk
-                await asyncio.sleep(0.1)  # Kleine pauze voor streaming effect
-                
+            stream = await self._create(
+                messages=[{"role": "user", "content": self._build_prompt(prompt, context)}],
+                temperature=self.temperature,
+                max_tokens=max_tokens or 1000,
+                model=model,
+                stream=True
+            )
+            # async with sluit de verbinding ook als de client halverwege afhaakt
+            async with stream:
+                async for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+            print(f"[LLM DEBUG] END generate_streaming() OK - OpenAI")
         except Exception as e:
             print(f"[LLM DEBUG] Exception in generate_streaming: {e}")
             traceback.print_exc()
             yield f"Error: Kon geen antwoord genereren: {str(e)}"
 
-    async def generate(self, prompt: str, context: str = "") -> str:
-        import asyncio
-        import concurrent.futures
+    async def generate(self, prompt: str, context: str = "", max_tokens: int = None, model: str = None) -> str:
         print(f"[LLM DEBUG] START generate() - OpenAI")
         try:
-            # Bouw de prompt op
-            if context:
-                full_prompt = (
-                    "Je bent een ervaren AI-assistent die vragen beantwoordt op basis van geüploade documenten. Beantwoord de onderstaande vraag zo volledig, duidelijk en professioneel mogelijk, uitsluitend op basis van de context uit de geüploade documenten.\n"
-                    "Gebruik alleen informatie die daadwerkelijk in de context staat.\n"
-                    "- Geef een helder, zelfstandig antwoord in normaal Nederlands.\n"
-                    "- Schrijf als een mens, niet als een robot.\n"
-                    "- Gebruik geen opsommingen, geen markdown, geen kopjes, geen verwijzingen naar 'bron 1' of 'bron 2'.\n"
-                    "- Vat relevante informatie samen tot een lopend verhaal.\n"
-                    "- Voor factuurvragen: zoek specifiek naar bedragen, periodes en kortingen in de context.\n"
-                    "- Als je een factuur ziet met bedragen, geef dan het totaalbedrag en de periode.\n"
-                    "- Als de vraag om een samenvatting per document vraagt, geef dan per document een korte, duidelijke samenvatting.\n"
-                    "- Probeer altijd een nuttig antwoord te geven op basis van de beschikbare informatie.\n\n"
-                    f"Context:\n{context}\n\nVraag: {prompt}\n\nAntwoord:"
-                )
-            else:
-                full_prompt = (
-                    "Je bent een ervaren AI-assistent die vragen beantwoordt op basis van geüploade documenten. Beantwoord de onderstaande vraag zo volledig, duidelijk en professioneel mogelijk.\n"
-                    "Geef een helder, zelfstandig antwoord in normaal Nederlands.\n"
-                    "Schrijf als een mens, niet als een robot.\n"
-                    "Gebruik geen opsommingen, geen markdown, geen kopjes.\n"
-                    "Als je het antwoord niet weet, zeg dat dan eerlijk.\n\n"
-                    f"Vraag: {prompt}\n\nAntwoord:"
-                )
-            
-            loop = asyncio.get_event_loop()
-            def sync_openai():
-                try:
-                    from openai import OpenAI
-                    client = OpenAI(api_key=self.api_key)
-                    response = client.chat.completions.create(
-                        model=self.model_name,
-                        messages=[{"role": "user", "content": full_prompt}],
-                        temperature=0.2,
-                        max_tokens=1000,
-                    )
-                    return response.choices[0].message.content.strip()
-                except Exception as e:
-                    print(f"[LLM DEBUG] OpenAI API error: {e}")
-                    raise e
-            
-            result = await loop.run_in_executor(concurrent.futures.ThreadPoolExecutor(), sync_openai)
+            response = await self._create(
+                messages=[{"role": "user", "content": self._build_prompt(prompt, context)}],
+                temperature=self.temperature,
+                max_tokens=max_tokens or 1000,
+                model=model,
+            )
+            result = (response.choices[0].message.content or "").strip()
             print(f"[LLM DEBUG] END generate() OK - OpenAI")
             return result
         except Exception as e:
@@ -383,11 +517,11 @@ class OpenAILLM:
             print(f"[LLM DEBUG] END generate() EXCEPTION - OpenAI")
             return f"Error: Kon geen antwoord genereren via OpenAI: {str(e)}"
 
-    async def generate_with_sources(self, question, sources):
+    async def generate_with_sources(self, question, sources, max_tokens: int = None, model: str = None):
         print(f"[LLM DEBUG] START generate_with_sources() - OpenAI")
         try:
             context = "\n\n".join([s["content"] for s in sources])
-            answer = await self.generate(question, context)
+            answer = await self.generate(question, context, max_tokens=max_tokens, model=model)
             formatted_sources = []
             for i, source in enumerate(sources, 1):
                 formatted_sources.append({
@@ -413,56 +547,33 @@ class OpenAILLM:
             }
 
     async def close(self):
+        """De gedeelde HTTP client wordt gesloten door close_llms()"""
         pass
 
 class HuggingFaceLLM:
     def __init__(self, model_name: str = "bigscience/bloomz-560m", api_key: str = None):
         self.model_name = model_name
+        self.temperature = 0.2
         self.api_key = api_key or os.getenv("HUGGINGFACE_API_KEY")
         self.base_url = "https://api-inference.huggingface.co/models"
         if not self.api_key:
             raise ValueError("Hugging Face API key is required. Set HUGGINGFACE_API_KEY environment variable.")
     
-    async def generate_streaming(self, prompt: str, context: str = "") -> AsyncGenerator[str, None]:
+    async def generate_streaming(self, prompt: str, context: str = "", max_tokens: int = None, model: str = None) -> AsyncGenerator[str, None]:
         """Genereer een antwoord met streaming voor betere UX"""
         print(f"[LLM DEBUG] START generate_streaming() - HuggingFace")
         try:
-            # Bouw de prompt op
-            if context:
-                full_prompt = f"""<s>[INST] Gebruik de volgende context om de vraag te beantwoorden:
-
-Context:
-{context}
-
-Vraag: {prompt}
-
-Geef een helder, zelfstandig antwoord in normaal Nederlands. Schrijf als een mens, niet als een robot. Gebruik geen opsommingen, geen markdown, geen kopjes. [/INST]"""
-            else:
-                full_prompt = f"""<s>[INST] Je bent een ervaren woon- en verhuurconsulent. Beantwoord de onderstaande vraag zo volledig, duidelijk en professioneel mogelijk.
-
-Geef een helder, zelfstandig antwoord in normaal Nederlands. Schrijf als een mens, niet als een robot. Gebruik geen opsommingen, geen markdown, geen kopjes.
-
-Vraag: {prompt} [/INST]"""
-            
             print(f"[LLM DEBUG] HuggingFace streaming request")
             
-            # Voor HuggingFace kunnen we geen echte streaming doen, dus we doen een normale request
-            # en simuleren streaming door het antwoord in chunks te sturen
-            answer = await self.generate(prompt, context)
-            
-            # Simuleer streaming door het antwoord in chunks te sturen
-            chunk_size = 50
-            for i in range(0, len(answer), chunk_size):
-                chunk = answer[i:i + chunk_size]
-                yield chunk
-                await asyncio.sleep(0.1)  # Kleine pauze voor streaming effect
-                
+            # De Inference API streamt hier niet; geef het antwoord in één keer door
+            # in plaats van streaming te simuleren met kunstmatige pauzes
+            yield await self.generate(prompt, context, max_tokens=max_tokens, model=model)
         except Exception as e:
             print(f"[LLM DEBUG] Exception in generate_streaming: {e}")
             traceback.print_exc()
             yield f"Error: Kon geen antwoord genereren: {str(e)}"
 
-    async def generate(self, prompt: str, context: str = "") -> str:
+    async def generate(self, prompt: str, context: str = "", max_tokens: int = None, model: str = None) -> str:
         print(f"[LLM DEBUG] START generate() - HuggingFace")
         try:
             # Bouw de prompt op
@@ -482,48 +593,48 @@ Geef een helder, zelfstandig antwoord in normaal Nederlands. Schrijf als een men
 
 Vraag: {prompt} [/INST]"""
             
-            print(f"[LLM DEBUG] HuggingFace request to {self.base_url}/{self.model_name}")
+            print(f"[LLM DEBUG] HuggingFace request to {self.base_url}/{model or self.model_name}")
             
             # Verhoog timeout naar 300 seconden (5 minuten) voor complexe vragen
             timeout_config = httpx.Timeout(300.0, connect=30.0)
-            async with httpx.AsyncClient(timeout=timeout_config) as client:
-                response = await client.post(
-                    f"{self.base_url}/{self.model_name}",
-                    headers={
-                        "Authorization": f"Bearer {self.api_key}",
-                        "Content-Type": "application/json"
-                    },
-                    json={
-                        "inputs": full_prompt,
-                        "parameters": {
-                            "max_new_tokens": 1000,
-                            "temperature": 0.2,
-                            "do_sample": True,
-                            "return_full_text": False
-                        }
+            response = await get_async_client("huggingface").post(
+                f"{self.base_url}/{model or self.model_name}",
+                headers={
+                    "Authorization": f"Bearer {self.api_key}",
+                    "Content-Type": "application/json"
+                },
+                json={
+                    "inputs": full_prompt,
+                    "parameters": {
+                        "max_new_tokens": max_tokens or 1000,
+                        "temperature": self.temperature,
+                        "do_sample": True,
+                        "return_full_text": False
                     }
-                )
-                
-                print(f"[LLM DEBUG] Status code: {response.status_code}")
-                print(f"[LLM DEBUG] Response text: {response.text[:500]}")
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    if isinstance(result, list) and len(result) > 0:
-                        generated_text = result[0].get("generated_text", "")
-                        # Remove the input prompt from the response
-                        if full_prompt in generated_text:
-                            generated_text = generated_text.replace(full_prompt, "").strip()
-                        print(f"[LLM DEBUG] END generate() OK - HuggingFace")
-                        return generated_text
-                    else:
-                        print(f"[LLM DEBUG] Unexpected response format: {result}")
-                        return "Geen antwoord ontvangen van de LLM."
+                },
+                timeout=timeout_config
+            )
+            
+            print(f"[LLM DEBUG] Status code: {response.status_code}")
+            print(f"[LLM DEBUG] Response text: {response.text[:500]}")
+            
+            if response.status_code == 200:
+                result = response.json()
+                if isinstance(result, list) and len(result) > 0:
+                    generated_text = result[0].get("generated_text", "")
+                    # Remove the input prompt from the response
+                    if full_prompt in generated_text:
+                        generated_text = generated_text.replace(full_prompt, "").strip()
+                    print(f"[LLM DEBUG] END generate() OK - HuggingFace")
+                    return generated_text
                 else:
-                    print(f"HuggingFace API error: {response.status_code} - {response.text}")
-                    print(f"[LLM DEBUG] END generate() ERROR - HuggingFace")
-                    return f"Error: Kon geen verbinding maken met HuggingFace (status {response.status_code})"
-                    
+                    print(f"[LLM DEBUG] Unexpected response format: {result}")
+                    return "Geen antwoord ontvangen van de LLM."
+            else:
+                print(f"HuggingFace API error: {response.status_code} - {response.text}")
+                print(f"[LLM DEBUG] END generate() ERROR - HuggingFace")
+                return f"Error: Kon geen verbinding maken met HuggingFace (status {response.status_code})"
+                
         except httpx.TimeoutException as e:
             print(f"[LLM DEBUG] Timeout Exception: {e}")
             print(f"[LLM DEBUG] END generate() TIMEOUT - HuggingFace")
@@ -538,11 +649,11 @@ Vraag: {prompt} [/INST]"""
             print(f"[LLM DEBUG] END generate() EXCEPTION - HuggingFace")
             return f"Error: Kon geen verbinding maken met HuggingFace: {str(e)}"
 
-    async def generate_with_sources(self, question, sources):
+    async def generate_with_sources(self, question, sources, max_tokens: int = None, model: str = None):
         print(f"[LLM DEBUG] START generate_with_sources() - HuggingFace")
         try:
             context = "\n\n".join([s["content"] for s in sources])
-            answer = await self.generate(question, context)
+            answer = await self.generate(question, context, max_tokens=max_tokens, model=model)
             formatted_sources = []
             for i, source in enumerate(sources, 1):
                 formatted_sources.append({
@@ -570,8 +681,589 @@ Vraag: {prompt} [/INST]"""
     async def close(self):
         pass
 
-# Gebruik OpenAI LLM in plaats van Ollama of HuggingFace
-OllamaLLM = OpenAILLM
-# OllamaLLM = OpenAILLM  # OpenAI uitzetten
-# OllamaLLM = FastMockLLM  # Mock uitzetten
-# OllamaLLM = MockLLM 
\ No newline at end of file
+# Lagere waarde = hogere prioriteit; onbekende tiers sluiten achteraan aan
+TIER_PRIORITIES = {"white_label": 0, "premium": 1, "basic": 2}
+DEFAULT_PRIORITY = 3
+
+# Tier en gebruiker van de lopende request; gezet door de API, gelezen door de scheduler
+current_tier: ContextVar[str] = ContextVar("llm_tier", default="basic")
+current_user_id: ContextVar[Any] = ContextVar("llm_user_id", default=None)
+
+def set_llm_caller(user) -> None:
+    """Leg vast namens wie de volgende LLM-aanroepen in deze request gebeuren"""
+    current_tier.set(user.get_effective_tier() or "basic")
+    current_user_id.set(user.id)
+
+def _parse_limits(value: str) -> Dict[str, int]:
+    """'openai=16,ollama=2' -> {'openai': 16, 'ollama': 2}"""
+    limits = {}
+    for part in value.split(","):
+        if "=" in part:
+            name, limit = part.split("=", 1)
+            limits[name.strip().lower()] = int(limit)
+    return limits
+
+class _Waiter:
+    __slots__ = ("future", "tier", "user_id", "enqueued_at")
+
+    def __init__(self, future: asyncio.Future, tier: str, user_id: Any):
+        self.future = future
+        self.tier = tier
+        self.user_id = user_id
+        self.enqueued_at = time.monotonic()
+
+class _ProviderQueue:
+    """Wachtrijen van één provider: per prioriteit een rij per gebruiker (round-robin)"""
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        self.queues: Dict[int, "OrderedDict[Any, deque]"] = {}
+
+    def waiting(self) -> bool:
+        return any(self.queues.values())
+
+    def push(self, priority: int, waiter: _Waiter):
+        users = self.queues.setdefault(priority, OrderedDict())
+        users.setdefault(waiter.user_id, deque()).append(waiter)
+
+    def remove(self, priority: int, waiter: _Waiter):
+        users = self.queues.get(priority, {})
+        waiters = users.get(waiter.user_id)
+        if waiters and waiter in waiters:
+            waiters.remove(waiter)
+            if not waiters:
+                del users[waiter.user_id]
+
+    def pop(self, aging: float) -> "_Waiter":
+        """Volgende waiter: hoogste (verouderde) prioriteit, daarbinnen de volgende gebruiker"""
+        now = time.monotonic()
+        best = None
+        for priority, users in self.queues.items():
+            if not users:
+                continue
+            oldest = min(waiters[0].enqueued_at for waiters in users.values())
+            # Wie lang wacht schuift per `aging` seconden één prioriteitsklasse op
+            effective = priority - (int((now - oldest) / aging) if aging > 0 else 0)
+            if best is None or effective < best[0]:
+                best = (effective, priority)
+        if best is None:
+            return None
+        users = self.queues[best[1]]
+        user_id, waiters = next(iter(users.items()))
+        waiter = waiters.popleft()
+        if waiters:
+            users.move_to_end(user_id)  # volgende keer is een andere gebruiker aan de beurt
+        else:
+            del users[user_id]
+        return waiter
+
+class LLMScheduler:
+    """Async scheduler voor LLM-aanroepen
+
+    Per provider mogen maximaal `limit` aanroepen tegelijk lopen. Wie moet
+    wachten komt in een rij per prioriteitsklasse (afgeleid van de effectieve
+    tier); binnen een klasse gaan gebruikers om de beurt, zodat één gebruiker
+    met veel vragen de rest niet verdringt.
+    """
+    def __init__(self, limits: Dict[str, int] = None, default_limit: int = None, aging: float = None):
+        self.limits = limits if limits is not None else _parse_limits(
+            os.getenv("LLM_MAX_CONCURRENCY", "openai=16,ollama=2,huggingface=4")
+        )
+        self.default_limit = default_limit or int(os.getenv("LLM_DEFAULT_CONCURRENCY", "8"))
+        self.aging = aging if aging is not None else float(os.getenv("LLM_PRIORITY_AGING_SECONDS", "30"))
+        self._providers: Dict[str, _ProviderQueue] = {}
+
+    def _queue(self, provider: str) -> _ProviderQueue:
+        queue = self._providers.get(provider)
+        if queue is None:
+            queue = self._providers[provider] = _ProviderQueue(self.limits.get(provider, self.default_limit))
+        return queue
+
+    @asynccontextmanager
+    async def slot(self, provider: str):
+        """Wacht op een plek voor deze provider en houd die vast tot het blok eindigt"""
+        tier = current_tier.get()
+        user_id = current_user_id.get()
+        priority = TIER_PRIORITIES.get(tier, DEFAULT_PRIORITY)
+        queue = self._queue(provider)
+        started = time.monotonic()
+
+        if queue.active < queue.limit and not queue.waiting():
+            queue.active += 1
+        else:
+            waiter = _Waiter(asyncio.get_running_loop().create_future(), tier, user_id)
+            queue.push(priority, waiter)
+            metrics.add("llm_queue_depth", 1, provider=provider, tier=tier)
+            try:
+                await waiter.future
+            except asyncio.CancelledError:
+                if waiter.future.done() and not waiter.future.cancelled():
+                    # De plek was al toegewezen; geef hem door aan de volgende
+                    self._release(provider, queue)
+                else:
+                    queue.remove(priority, waiter)
+                    metrics.add("llm_queue_depth", -1, provider=provider, tier=tier)
+                raise
+
+        metrics.observe("llm_queue_wait_seconds", time.monotonic() - started, provider=provider, tier=tier)
+        # Lazy import: rag.admission leest bij het laden de capaciteit van deze scheduler
+        from rag.admission import mark_service_started
+        mark_service_started()
+        metrics.add("llm_inflight_requests", 1, provider=provider, tier=tier)
+        try:
+            yield
+        finally:
+            metrics.add("llm_inflight_requests", -1, provider=provider, tier=tier)
+            self._release(provider, queue)
+
+    def _release(self, provider: str, queue: _ProviderQueue):
+        queue.active -= 1
+        while queue.active < queue.limit:
+            waiter = queue.pop(self.aging)
+            if waiter is None:
+                break
+            if waiter.future.done():
+                continue  # geannuleerd; de wachtende werkt zelf de metrics bij
+            metrics.add("llm_queue_depth", -1, provider=provider, tier=waiter.tier)
+            queue.active += 1
+            waiter.future.set_result(None)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {
+            provider: {
+                "limit": queue.limit,
+                "active": queue.active,
+                "waiting": sum(len(waiters) for users in queue.queues.values() for waiters in users.values())
+            }
+            for provider, queue in self._providers.items()
+        }
+
+scheduler = LLMScheduler()
+
+# Gedrag van de response cache voor de lopende request; gezet door de API op basis van headers
+current_cache_mode: ContextVar[str] = ContextVar("llm_cache_mode", default="use")
+
+def set_llm_cache_mode(headers) -> str:
+    """Bypass via de expliciete header: 'X-LLM-Cache: refresh' slaat het lezen over, 'X-LLM-Cache: bypass' ook het opslaan
+
+    Cache-Control wordt genegeerd; browsers en proxies sturen no-cache routinematig mee.
+    """
+    explicit = (headers.get("x-llm-cache") or "").strip().lower()
+    if explicit == "bypass":
+        mode = "off"
+    elif explicit == "refresh":
+        mode = "refresh"
+    else:
+        mode = "use"
+    current_cache_mode.set(mode)
+    return mode
+
+class LLMResponseCache:
+    """Persistente exact-match cache van LLM-antwoorden (tabel llm_cache)
+
+    De sleutel is een hash van provider, model, temperatuur, max_tokens, het
+    soort aanroep en de volledige invoer (vraag en context, of vraag en
+    bronnen inclusief metadata). Alleen antwoorden met een temperatuur tot
+    en met LLM_CACHE_MAX_TEMPERATURE worden bewaard, foutantwoorden nooit.
+    Verlopen en minst recent gebruikte entries worden periodiek opgeruimd.
+    """
+    def __init__(self, enabled: bool = None, ttl_seconds: float = None, max_entries: int = None,
+                 max_entry_chars: int = None, max_temperature: float = None):
+        self.enabled = enabled if enabled is not None else os.getenv("LLM_CACHE", "false").lower() == "true"
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else float(os.getenv("LLM_CACHE_TTL_SECONDS", "86400"))
+        self.max_entries = max_entries if max_entries is not None else int(os.getenv("LLM_CACHE_MAX_ENTRIES", "10000"))
+        self.max_entry_chars = max_entry_chars if max_entry_chars is not None else int(os.getenv("LLM_CACHE_MAX_ENTRY_CHARS", "100000"))
+        self.max_temperature = max_temperature if max_temperature is not None else float(os.getenv("LLM_CACHE_MAX_TEMPERATURE", "0.2"))
+        # Verhoog om na een wijziging in de prompts alle oude antwoorden te negeren
+        self.version = os.getenv("LLM_CACHE_VERSION", "1")
+        self.prune_every = 100
+        self._writes = 0
+        self._lookups = 0
+        self._hits = 0
+        self._lock = threading.Lock()
+
+    def cacheable(self, temperature: float) -> bool:
+        return self.enabled and temperature is not None and temperature <= self.max_temperature
+
+    def key(self, provider: str, model: str, temperature: float, max_tokens: int, kind: str, payload: Any) -> str:
+        material = json.dumps([self.version, provider, model, temperature, max_tokens, kind, payload],
+                              sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def get(self, key: str, provider: str) -> Any:
+        """Opgeslagen antwoord of None; synchroon (draai in een thread)"""
+        db = SessionLocal()
+        try:
+            entry = db.query(LLMCacheEntry).filter(LLMCacheEntry.key == key).first()
+            now = datetime.utcnow()
+            if entry is not None and entry.expires_at > now:
+                entry.hits = (entry.hits or 0) + 1
+                entry.last_used_at = now
+                db.commit()
+                self._record(provider, "hit")
+                return json.loads(entry.response)
+        except Exception as e:
+            logger.warning("LLM cache lookup failed: %s", e)
+        finally:
+            db.close()
+        self._record(provider, "miss")
+        return None
+
+    def put(self, key: str, provider: str, model: str, value: Any):
+        """Sla een antwoord op; synchroon (draai in een thread)"""
+        response = json.dumps(value, ensure_ascii=False, default=str)
+        if len(response) > self.max_entry_chars:
+            metrics.inc("llm_cache_requests_total", provider=provider, result="too_large")
+            return
+        now = datetime.utcnow()
+        db = SessionLocal()
+        try:
+            db.merge(LLMCacheEntry(
+                key=key, provider=provider, model=model, response=response, size=len(response), hits=0,
+                created_at=now, last_used_at=now, expires_at=now + timedelta(seconds=self.ttl_seconds)
+            ))
+            db.commit()
+            with self._lock:
+                self._writes += 1
+                # De eerste write na de start ruimt ook op
+                prune = (self._writes - 1) % self.prune_every == 0
+            if prune:
+                self.prune(db)
+        except Exception as e:
+            db.rollback()
+            logger.warning("LLM cache store failed: %s", e)
+        finally:
+            db.close()
+
+    def prune(self, db):
+        """Verwijder verlopen entries en, boven max_entries, de minst recent gebruikte"""
+        db.query(LLMCacheEntry).filter(LLMCacheEntry.expires_at <= datetime.utcnow()).delete(synchronize_session=False)
+        count = db.query(LLMCacheEntry).count()
+        if count > self.max_entries:
+            oldest = db.query(LLMCacheEntry.key).order_by(LLMCacheEntry.last_used_at).limit(count - self.max_entries)
+            db.query(LLMCacheEntry).filter(LLMCacheEntry.key.in_([row.key for row in oldest])).delete(synchronize_session=False)
+            count = self.max_entries
+        db.commit()
+        metrics.set("llm_cache_entries", count)
+
+    def _record(self, provider: str, result: str):
+        metrics.inc("llm_cache_requests_total", provider=provider, result=result)
+        with self._lock:
+            self._lookups += 1
+            self._hits += result == "hit"
+            metrics.set("llm_cache_hit_ratio", self._hits / self._lookups)
+
+response_cache = LLMResponseCache()
+
+def is_error_answer(value: Any) -> bool:
+    """Mislukt antwoord: de providers geven fouten terug als tekst die met 'Error:' begint, of niets"""
+    answer = value.get("answer") if isinstance(value, dict) else value
+    return not isinstance(answer, str) or not answer.strip() or answer.startswith("Error:")
+
+class ScheduledLLM:
+    """Laat elke aanroep naar een provider via de scheduler lopen
+
+    Alleen de buitenste aanroep neemt een plek in; interne aanroepen van de
+    provider (bijv. generate_with_sources -> generate) gaan direct. Antwoorden
+    uit de response cache komen terug zonder op een plek te wachten.
+    """
+    def __init__(self, llm, provider: str, llm_scheduler: LLMScheduler = None, cache: LLMResponseCache = None):
+        self.llm = llm
+        self.provider = provider
+        self.scheduler = llm_scheduler or scheduler
+        self.cache = cache or response_cache
+
+    def _cache_key(self, kind: str, payload: Any, options: Dict[str, Any]) -> str:
+        """Sleutel voor de response cache, of None als deze aanroep niet gecachet wordt"""
+        temperature = getattr(self.llm, "temperature", None)
+        if current_cache_mode.get() == "off" or not self.cache.cacheable(temperature):
+            return None
+        model = options.get("model") or getattr(self.llm, "model_name", None)
+        return self.cache.key(self.provider, model, temperature, options.get("max_tokens"), kind, payload)
+
+    async def _cached(self, key: str, options: Dict[str, Any], call) -> Any:
+        if key is None:
+            return await call()
+        if current_cache_mode.get() != "refresh":
+            cached = await asyncio.to_thread(self.cache.get, key, self.provider)
+            if cached is not None:
+                return cached
+        result = await call()
+        if not is_error_answer(result):
+            model = options.get("model") or getattr(self.llm, "model_name", None)
+            await asyncio.to_thread(self.cache.put, key, self.provider, model, result)
+        return result
+
+    async def _generate(self, prompt: str, context: str, options: Dict[str, Any]) -> str:
+        async with self.scheduler.slot(self.provider):
+            return await self.llm.generate(prompt, context, **options)
+
+    async def _generate_with_sources(self, question: str, sources: List[Dict[str, Any]], options: Dict[str, Any]) -> Dict[str, Any]:
+        async with self.scheduler.slot(self.provider):
+            return await self.llm.generate_with_sources(question, sources, **options)
+
+    async def generate(self, prompt: str, context: str = "", **options) -> str:
+        key = self._cache_key("generate", [prompt, context], options)
+        return await self._cached(key, options, lambda: self._generate(prompt, context, options))
+
+    async def generate_with_sources(self, question: str, sources: List[Dict[str, Any]], **options) -> Dict[str, Any]:
+        key = self._cache_key("generate_with_sources", [question, sources], options)
+        return await self._cached(key, options, lambda: self._generate_with_sources(question, sources, options))
+
+    async def generate_streaming(self, prompt: str, context: str = "", **options) -> AsyncGenerator[str, None]:
+        # Zelfde sleutel als generate: een gecachet antwoord komt als één stuk
+        key = self._cache_key("generate", [prompt, context], options)
+        if key is not None and current_cache_mode.get() != "refresh":
+            cached = await asyncio.to_thread(self.cache.get, key, self.provider)
+            if cached is not None:
+                yield cached
+                return
+        chunks = []
+        # De plek blijft bezet tot de stream klaar is
+        async with self.scheduler.slot(self.provider):
+            async for chunk in self.llm.generate_streaming(prompt, context, **options):
+                chunks.append(chunk)
+                yield chunk
+        answer = "".join(chunks)
+        if key is not None and not is_error_answer(answer):
+            model = options.get("model") or getattr(self.llm, "model_name", None)
+            await asyncio.to_thread(self.cache.put, key, self.provider, model, answer)
+
+    async def close(self):
+        await self.llm.close()
+
+    def __getattr__(self, name):
+        return getattr(self.llm, name)
+
+def parse_models(value: str) -> Dict[str, str]:
+    """'openai=gpt-4o-mini,ollama=phi3' -> {'openai': 'gpt-4o-mini', 'ollama': 'phi3'}"""
+    models = {}
+    for part in value.split(","):
+        if "=" in part:
+            name, model = part.split("=", 1)
+            models[name.strip().lower()] = model.strip()
+    return models
+
+# Woorden die op een vergelijking of analyse over meerdere bronnen wijzen
+COMPLEX_QUESTION_MARKERS = ("vergelijk", "verschil", "overeenkomst", "analyse", "waarom", "compare", "difference")
+# Een antwoord met een van deze zinnen geeft aan dat het kleine model het niet wist
+NO_ANSWER_MARKERS = ("ik weet het niet", "geen informatie", "niet genoeg informatie", "kan ik niet", "niet vinden")
+
+class ModelCascade:
+    """Stuur eenvoudige vragen naar een klein model en moeilijke naar een groot model
+
+    De indeling is goedkoop: lengte van de vraag, woorden die op vergelijken
+    wijzen, de spreiding van de relevantiescores (één duidelijk beste chunk
+    is een opzoekvraag) en het aantal verschillende documenten in de top.
+    Haalt het antwoord van het kleine model de validatie niet, dan volgt een
+    tweede aanroep met het grote model. De cascade staat alleen aan voor
+    providers met zowel een klein als een groot model ingesteld.
+    """
+    def __init__(self):
+        self.small_models = parse_models(os.getenv("LLM_CASCADE_SMALL_MODELS", ""))
+        self.large_models = parse_models(os.getenv("LLM_CASCADE_LARGE_MODELS", ""))
+        self.long_question_words = int(os.getenv("LLM_CASCADE_LONG_QUESTION_WORDS", "25"))
+        self.min_top_score = float(os.getenv("LLM_CASCADE_MIN_TOP_SCORE", "0.5"))
+        self.min_spread = float(os.getenv("LLM_CASCADE_MIN_SPREAD", "0.1"))
+        self.max_documents = int(os.getenv("LLM_CASCADE_MAX_DOCUMENTS", "2"))
+        self.min_answer_chars = int(os.getenv("LLM_CASCADE_MIN_ANSWER_CHARS", "40"))
+        # Prijs per 1000 tokens per model, bijv. gpt-4o-mini=0.00015,gpt-4o=0.0025
+        self.prices = {model: float(price) for model, price in parse_models(os.getenv("LLM_MODEL_PRICES", "")).items()}
+
+    def enabled(self, provider: str) -> bool:
+        return provider in self.small_models and provider in self.large_models
+
+    def model_for(self, provider: str, route: str) -> str:
+        return (self.small_models if route == "small" else self.large_models).get(provider)
+
+    def classify(self, question: str, sources: List[Dict[str, Any]], summary: bool = False) -> str:
+        """'small' of 'large' voor deze vraag en deze bronnen"""
+        lowered = question.lower()
+        if summary or len(question.split()) > self.long_question_words:
+            return "large"
+        if any(marker in lowered for marker in COMPLEX_QUESTION_MARKERS):
+            return "large"
+        scores = sorted((source.get("relevance", 0.0) for source in sources), reverse=True)
+        if not scores or scores[0] < self.min_top_score:
+            return "large"
+        median = scores[len(scores) // 2]
+        if scores[0] - median < self.min_spread:
+            return "large"  # veel even relevante chunks: het antwoord moet gecombineerd worden
+        top_documents = {
+            source.get("metadata", {}).get("document_id") or source.get("metadata", {}).get("filename")
+            for source in sources[:5]
+        }
+        if len(top_documents) > self.max_documents:
+            return "large"
+        return "small"
+
+    def validate(self, answer: str) -> bool:
+        """Is dit antwoord van het kleine model goed genoeg om terug te geven?"""
+        if is_error_answer(answer) or len(answer.strip()) < self.min_answer_chars:
+            return False
+        lowered = answer.lower()
+        return not any(marker in lowered for marker in NO_ANSWER_MARKERS)
+
+    def _record(self, provider: str, route: str, model: str, seconds: float, prompt_chars: int, answer: str):
+        metrics.inc("llm_cascade_requests_total", provider=provider, route=route, model=model)
+        metrics.observe("llm_cascade_latency_seconds", seconds, provider=provider, route=route)
+        price = self.prices.get(model)
+        if price:
+            # Grove schatting: ongeveer 4 tekens per token
+            tokens = (prompt_chars + len(answer or "")) / 4
+            metrics.inc("llm_cascade_cost_total", tokens / 1000 * price, provider=provider, route=route)
+
+    async def _run(self, llm, route: str, question: str, sources: List[Dict[str, Any]], options: Dict[str, Any]) -> Dict[str, Any]:
+        model = self.model_for(llm.provider, "small" if route == "small" else "large")
+        started = time.monotonic()
+        result = await llm.generate_with_sources(question, sources, model=model, **options)
+        prompt_chars = len(question) + sum(len(source["content"]) for source in sources)
+        self._record(llm.provider, route, model, time.monotonic() - started, prompt_chars, result.get("answer"))
+        return result
+
+    async def generate_with_sources(self, llm, question: str, sources: List[Dict[str, Any]], **options) -> Dict[str, Any]:
+        """generate_with_sources met het model dat bij de vraag past"""
+        # Een al gekozen model (bijv. het snelle model bij een krappe deadline) gaat voor
+        if "model" in options or not self.enabled(llm.provider):
+            return await llm.generate_with_sources(question, sources, **options)
+        if self.classify(question, sources) == "small":
+            result = await self._run(llm, "small", question, sources, options)
+            if self.validate(result.get("answer", "")):
+                return result
+            logger.debug("Antwoord van klein model afgekeurd, escaleren naar groot model")
+            metrics.inc("llm_cascade_escalations_total", provider=llm.provider)
+            return await self._run(llm, "escalated", question, sources, options)
+        return await self._run(llm, "large", question, sources, options)
+
+cascade = ModelCascade()
+
+LLM_PROVIDERS = {
+    "openai": OpenAILLM,
+    "ollama": OllamaLLM,
+    "huggingface": HuggingFaceLLM,
+    "fast_mock": FastMockLLM,
+    "mock": MockLLM
+}
+
+# Gebruik standaard OpenAI LLM in plaats van Ollama of HuggingFace
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "openai").lower()
+# Meerdere providers (in volgorde van voorkeur) zet de router met circuit breakers aan
+LLM_ROUTER_PROVIDERS = os.getenv("LLM_ROUTER_PROVIDERS", "")
+
+_llm_instances: Dict[str, Any] = {}
+
+def get_llm(provider: str = None) -> ScheduledLLM:
+    """Gedeelde LLM instantie per provider (via de scheduler); standaard de provider uit LLM_PROVIDER
+
+    Zonder provider en met LLM_ROUTER_PROVIDERS ingesteld komt de router terug,
+    met dezelfde generate-methodes.
+    """
+    if provider is None and LLM_ROUTER_PROVIDERS.strip():
+        from rag.router import get_router
+        return get_router()
+    provider = (provider or LLM_PROVIDER).lower()
+    if provider not in _llm_instances:
+        if provider not in LLM_PROVIDERS:
+            raise ValueError(f"Unknown LLM provider: {provider}")
+        _llm_instances[provider] = ScheduledLLM(LLM_PROVIDERS[provider](), provider)
+    return _llm_instances[provider]
+
+class OllamaKeepAlive:
+    """Warm-up bij de start en keep-alive pings tijdens kantooruren
+
+    Bij het starten worden de modellen vooraf geladen, zodat de eerste vraag
+    niet op het laden wacht. Daarna krijgt Ollama binnen de ingestelde uren
+    elke `interval` seconden een leeg prompt, tenzij er net een echte
+    aanroep was; buiten kantooruren mag het model na keep_alive uitladen.
+    """
+    def __init__(self, llm: OllamaLLM, models: List[str] = None, interval: float = None,
+                 hours: str = None, weekdays: str = None):
+        self.llm = llm
+        self.models = models or [llm.model_name]
+        self.interval = interval if interval is not None else float(os.getenv("OLLAMA_KEEPALIVE_INTERVAL_SECONDS", "600"))
+        self.start_minute, self.end_minute = _parse_hours(hours or os.getenv("OLLAMA_KEEPALIVE_HOURS", "08:00-18:00"))
+        self.weekdays = _parse_weekdays(weekdays or os.getenv("OLLAMA_KEEPALIVE_WEEKDAYS", "1-5"))
+        self._task = None
+
+    def in_business_hours(self, now: datetime = None) -> bool:
+        now = now or datetime.now()
+        minute = now.hour * 60 + now.minute
+        return now.isoweekday() in self.weekdays and self.start_minute <= minute < self.end_minute
+
+    async def warm_up(self):
+        for model in self.models:
+            await self.llm.warm_up(model)
+
+    async def run(self):
+        await self.warm_up()
+        if self.interval <= 0:
+            return
+        while True:
+            await asyncio.sleep(self.interval)
+            if self.in_business_hours() and time.monotonic() - self.llm.last_used >= self.interval:
+                await self.warm_up()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+def _parse_hours(value: str):
+    """'08:00-18:00' -> (480, 1080) in minuten na middernacht"""
+    start, end = value.split("-", 1)
+    to_minutes = lambda text: int(text.split(":")[0]) * 60 + (int(text.split(":")[1]) if ":" in text else 0)
+    return to_minutes(start.strip()), to_minutes(end.strip())
+
+def _parse_weekdays(value: str) -> set:
+    """'1-5' of '1,2,3' -> ISO weekdagen (1 = maandag)"""
+    days = set()
+    for part in value.split(","):
+        if "-" in part:
+            first, last = part.split("-", 1)
+            days.update(range(int(first), int(last) + 1))
+        elif part.strip():
+            days.add(int(part))
+    return days
+
+_ollama_keepalive = None
+
+def _uses_ollama() -> bool:
+    providers = [name.strip().lower() for name in LLM_ROUTER_PROVIDERS.split(",") if name.strip()] or [LLM_PROVIDER]
+    return "ollama" in providers
+
+def start_ollama_keepalive():
+    """Start warm-up en keep-alive als Ollama gebruikt wordt (bij het starten van de app)"""
+    global _ollama_keepalive
+    if not _uses_ollama() or os.getenv("OLLAMA_WARMUP", "true").lower() != "true" or _ollama_keepalive is not None:
+        return
+    ollama = get_llm("ollama").llm
+    models = [model.strip() for model in os.getenv("OLLAMA_WARMUP_MODELS", "").split(",") if model.strip()]
+    if not models:
+        # Het standaardmodel en de modellen die de cascade voor Ollama gebruikt
+        models = [ollama.model_name]
+        for model in (cascade.small_models.get("ollama"), cascade.large_models.get("ollama")):
+            if model and model not in models:
+                models.append(model)
+    _ollama_keepalive = OllamaKeepAlive(ollama, models)
+    _ollama_keepalive.start()
+
+async def close_llms():
+    """Sluit alle LLM instanties en de gedeelde HTTP clients (bij afsluiten van de app)"""
+    global _ollama_keepalive
+    from rag.router import reset_router
+    if _ollama_keepalive is not None:
+        await _ollama_keepalive.stop()
+        _ollama_keepalive = None
+    reset_router()
+    for llm in list(_llm_instances.values()):
+        await llm.close()
+    _llm_instances.clear()
+    await close_http_clients()
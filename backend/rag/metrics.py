@@ -0,0 +1,116 @@
+import threading
+from typing import Dict, Tuple
+
+# Standaard buckets (seconden) voor latency histogrammen
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class Metrics:
+    """Eenvoudige in-process counters, gauges en histogrammen
+
+    Wordt via /metrics in Prometheus-tekstformaat aangeboden. Waarden gelden
+    per API process.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        self._gauges: Dict[str, Dict[LabelKey, float]] = {}
+        self._histograms: Dict[str, Dict[LabelKey, list]] = {}
+        self._buckets: Dict[str, tuple] = {}
+        self._help: Dict[str, str] = {}
+
+    @staticmethod
+    def _key(labels: Dict[str, str]) -> LabelKey:
+        return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+    def describe(self, name: str, help_text: str, buckets: tuple = None):
+        """Leg een beschrijving (en eventueel histogram-buckets) vast voor een metric"""
+        with self._lock:
+            self._help[name] = help_text
+            if buckets:
+                self._buckets[name] = tuple(sorted(buckets))
+
+    def inc(self, name: str, value: float = 1, /, **labels):
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            key = self._key(labels)
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name: str, value: float, /, **labels):
+        with self._lock:
+            self._gauges.setdefault(name, {})[self._key(labels)] = value
+
+    def add(self, name: str, value: float, /, **labels):
+        """Verhoog of verlaag een gauge"""
+        with self._lock:
+            series = self._gauges.setdefault(name, {})
+            key = self._key(labels)
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, /, **labels):
+        with self._lock:
+            buckets = self._buckets.get(name, DEFAULT_BUCKETS)
+            series = self._histograms.setdefault(name, {})
+            key = self._key(labels)
+            state = series.get(key)
+            if state is None:
+                # [aantal per bucket..., +Inf aantal, som]
+                state = series[key] = [0] * (len(buckets) + 1) + [0.0]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[len(buckets)] += 1
+            state[-1] += value
+
+    def value(self, name: str, /, **labels) -> float:
+        """Huidige waarde van een counter of gauge (0 als onbekend)"""
+        key = self._key(labels)
+        with self._lock:
+            for kind in (self._counters, self._gauges):
+                if name in kind and key in kind[name]:
+                    return kind[name][key]
+        return 0
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+
+    @staticmethod
+    def _format_labels(key: LabelKey, extra: Dict[str, str] = None) -> str:
+        pairs = list(key) + sorted((extra or {}).items())
+        if not pairs:
+            return ""
+        escaped = [f'{name}="{_escape(value)}"' for name, value in pairs]
+        return "{" + ",".join(escaped) + "}"
+
+    def render(self) -> str:
+        """Alle metrics in Prometheus-tekstformaat"""
+        lines = []
+        with self._lock:
+            for kind, series_by_name in (("counter", self._counters), ("gauge", self._gauges)):
+                for name in sorted(series_by_name):
+                    if name in self._help:
+                        lines.append(f"# HELP {name} {self._help[name]}")
+                    lines.append(f"# TYPE {name} {kind}")
+                    for key, value in sorted(series_by_name[name].items()):
+                        lines.append(f"{name}{self._format_labels(key)} {value}")
+            for name in sorted(self._histograms):
+                buckets = self._buckets.get(name, DEFAULT_BUCKETS)
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} histogram")
+                for key, state in sorted(self._histograms[name].items()):
+                    for i, bound in enumerate(buckets):
+                        lines.append(f"{name}_bucket{self._format_labels(key, {'le': str(bound)})} {state[i]}")
+                    lines.append(f"{name}_bucket{self._format_labels(key, {'le': '+Inf'})} {state[len(buckets)]}")
+                    lines.append(f"{name}_sum{self._format_labels(key)} {state[-1]}")
+                    lines.append(f"{name}_count{self._format_labels(key)} {state[len(buckets)]}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
@@ -0,0 +1,129 @@
+import os
+import fcntl
+import hashlib
+from contextlib import contextmanager
+from typing import Optional
+
+# Bijgehouden totale grootte in de cachemap, zodat niet elk process de hele map hoeft te tellen
+SIZE_FILE = "size"
+
+class OCRCache:
+    """Schijfcache voor OCR-resultaten met LRU-achtige verwijdering op basis van mtime
+
+    De sleutel bevat de hash van de PDF-bytes, het paginanummer, de DPI en de
+    OCR-instellingen; een andere taal of engine geeft dus nooit een oude hit.
+    De totale grootte staat in een klein bestand in de cachemap dat alle
+    processen onder een file lock bijwerken; alleen als dat ontbreekt wordt
+    de map geteld.
+    """
+    def __init__(self, cache_dir: str = None, max_bytes: int = None):
+        self.cache_dir = cache_dir or os.getenv("OCR_CACHE_DIR", "/app/data/ocr_cache")
+        if max_bytes is None:
+            max_bytes = int(os.getenv("OCR_CACHE_MAX_MB", "512")) * 1024 * 1024
+        self.max_bytes = max_bytes
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.cache_dir) and self.max_bytes > 0
+
+    def make_key(self, pdf_hash: str, page_num: int, dpi: int, lang: str, engine: str) -> str:
+        raw = f"{pdf_hash}:{page_num}:{dpi}:{lang}:{engine}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.txt")
+
+    def get(self, key: str) -> Optional[str]:
+        """Geef de gecachte tekst terug, of None bij een miss"""
+        if not self.enabled:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                text = f.read()
+            # Markeer als recent gebruikt voor de verwijdervolgorde
+            os.utime(path, None)
+            return text
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"OCR cache read error: {e}")
+            return None
+
+    def put(self, key: str, text: str):
+        """Sla een OCR-resultaat op en ruim op als de cache te groot wordt"""
+        if not self.enabled:
+            return
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            previous = os.path.getsize(path) if os.path.exists(path) else 0
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(tmp_path, path)
+
+            with self._locked():
+                size = self._read_size()
+                size = self._scan_size() if size is None else size + os.path.getsize(path) - previous
+                if size > self.max_bytes:
+                    size = self._evict()
+                self._write_size(size)
+        except Exception as e:
+            print(f"OCR cache write error: {e}")
+
+    @contextmanager
+    def _locked(self):
+        """Exclusief file lock over de grootte-administratie, ook tussen processen"""
+        with open(os.path.join(self.cache_dir, f"{SIZE_FILE}.lock"), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _read_size(self) -> Optional[int]:
+        try:
+            with open(os.path.join(self.cache_dir, SIZE_FILE), "r") as f:
+                return int(f.read())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write_size(self, size: int):
+        path = os.path.join(self.cache_dir, SIZE_FILE)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(str(max(size, 0)))
+        os.replace(tmp_path, path)
+
+    def _entries(self):
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith(".txt"):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    yield stat.st_mtime, stat.st_size, path
+
+    def _scan_size(self) -> int:
+        return sum(size for _, size, _ in self._entries())
+
+    def _evict(self) -> int:
+        """Verwijder de minst recent gebruikte entries tot 90% van het maximum; geeft de nieuwe grootte terug"""
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        target = int(self.max_bytes * 0.9)
+        removed = 0
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                removed += 1
+            except FileNotFoundError:
+                continue
+        print(f"OCR cache evicted {removed} entries, {total} bytes in use")
+        return total
@@ -0,0 +1,280 @@
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Any, AsyncGenerator, Awaitable, Callable, Dict, List
+from rag.llm import get_llm, is_error_answer
+from rag.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+metrics.describe("llm_provider_requests_total", "Aanroepen via de provider router per uitkomst (ok, error, cancelled)")
+metrics.describe("llm_provider_latency_seconds", "Duur van geslaagde aanroepen per provider")
+metrics.describe("llm_circuit_state", "Circuit breaker per provider: 0 dicht, 1 half-open, 2 open")
+metrics.describe("llm_hedges_total", "Extra (hedged) aanroepen; outcome=won als de hedge het antwoord leverde")
+metrics.describe("llm_failovers_total", "Overstappen naar een volgende provider na een fout")
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+def percentile(values, pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))]
+
+class ProviderHealth:
+    """Latency, foutpercentage en circuit breaker van één provider
+
+    De breaker gaat open na `max_failures` fouten op rij of bij een
+    foutpercentage boven `error_rate` (vanaf `min_requests` metingen). Na
+    `cooldown` seconden mag er één proefaanroep door (half-open); slaagt die,
+    dan gaat de breaker weer dicht.
+    """
+    def __init__(self, provider: str, max_failures: int, error_rate: float, min_requests: int, cooldown: float):
+        self.provider = provider
+        self.max_failures = max_failures
+        self.error_rate = error_rate
+        self.min_requests = min_requests
+        self.cooldown = cooldown
+        self.latencies = deque(maxlen=100)
+        self.outcomes = deque(maxlen=50)
+        self.consecutive_failures = 0
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probing = False
+        metrics.set("llm_circuit_state", 0, provider=provider)
+
+    def _set_state(self, state: str):
+        if state != self.state:
+            logger.warning("Circuit %s: %s -> %s", self.provider, self.state, state)
+            self.state = state
+            metrics.set("llm_circuit_state", _STATE_VALUES[state], provider=self.provider)
+
+    def available(self) -> bool:
+        """Mag er nu een aanroep naar deze provider?"""
+        if self.state == OPEN and time.monotonic() - self.opened_at >= self.cooldown:
+            self._set_state(HALF_OPEN)
+        if self.state == HALF_OPEN:
+            return not self.probing
+        return self.state == CLOSED
+
+    def begin(self):
+        if self.state == HALF_OPEN:
+            self.probing = True
+
+    def record_success(self, seconds: float):
+        self.latencies.append(seconds)
+        self.outcomes.append(True)
+        self.consecutive_failures = 0
+        self.probing = False
+        metrics.observe("llm_provider_latency_seconds", seconds, provider=self.provider)
+        metrics.inc("llm_provider_requests_total", provider=self.provider, outcome="ok")
+        self._set_state(CLOSED)
+
+    def record_failure(self):
+        self.outcomes.append(False)
+        self.consecutive_failures += 1
+        self.probing = False
+        metrics.inc("llm_provider_requests_total", provider=self.provider, outcome="error")
+        failures = self.outcomes.count(False)
+        too_many = len(self.outcomes) >= self.min_requests and failures / len(self.outcomes) >= self.error_rate
+        if self.state == HALF_OPEN or self.consecutive_failures >= self.max_failures or too_many:
+            self.opened_at = time.monotonic()
+            self.outcomes.clear()
+            self._set_state(OPEN)
+
+    def record_cancelled(self):
+        # Een afgebroken aanroep (verloren hedge) zegt niets over de provider
+        self.probing = False
+        metrics.inc("llm_provider_requests_total", provider=self.provider, outcome="cancelled")
+
+    def p95(self, default: float) -> float:
+        if len(self.latencies) < 10:
+            return default
+        return percentile(self.latencies, 95)
+
+class LLMRouter:
+    """Verdeel LLM-aanroepen over meerdere providers
+
+    Providers worden in volgorde van voorkeur geprobeerd, met overslaan van
+    providers met een open circuit breaker. Geeft een provider een fout, dan
+    gaat de aanroep door naar de volgende. Met hedging aan start de router
+    een tweede aanroep bij de volgende provider als de eerste langer duurt
+    dan zijn p95; het eerste goede antwoord wint en de andere aanroep wordt
+    geannuleerd. Elke aanroep loopt via de scheduler van zijn provider.
+    """
+    provider = "router"
+
+    def __init__(self, providers: List[str], hedge: bool = None, hedge_min_delay: float = None,
+                 hedge_initial_delay: float = None):
+        self.hedge = hedge if hedge is not None else os.getenv("LLM_HEDGE", "false").lower() == "true"
+        self.hedge_min_delay = hedge_min_delay if hedge_min_delay is not None else float(os.getenv("LLM_HEDGE_MIN_DELAY", "1"))
+        # Zolang er te weinig metingen zijn voor een p95
+        self.hedge_initial_delay = hedge_initial_delay if hedge_initial_delay is not None else float(os.getenv("LLM_HEDGE_INITIAL_DELAY", "10"))
+        self.llms = {}
+        self.health: Dict[str, ProviderHealth] = {}
+        for name in providers:
+            try:
+                self.llms[name] = get_llm(name)
+            except Exception as e:
+                logger.warning("Provider %s niet beschikbaar: %s", name, e)
+                continue
+            self.health[name] = ProviderHealth(
+                name,
+                max_failures=int(os.getenv("LLM_BREAKER_FAILURES", "5")),
+                error_rate=float(os.getenv("LLM_BREAKER_ERROR_RATE", "0.5")),
+                min_requests=int(os.getenv("LLM_BREAKER_MIN_REQUESTS", "10")),
+                cooldown=float(os.getenv("LLM_BREAKER_COOLDOWN_SECONDS", "30"))
+            )
+        if not self.llms:
+            raise ValueError(f"No usable LLM providers in {providers}")
+        self.providers = list(self.llms)
+
+    def candidates(self) -> List[str]:
+        """Providers die nu aangeroepen mogen worden; zijn alle breakers open, dan toch allemaal"""
+        available = [name for name in self.providers if self.health[name].available()]
+        return available or list(self.providers)
+
+    def hedge_delay(self, provider: str) -> float:
+        return max(self.hedge_min_delay, self.health[provider].p95(self.hedge_initial_delay))
+
+    async def _call(self, provider: str, call: Callable[[Any], Awaitable[Any]]) -> Any:
+        health = self.health[provider]
+        health.begin()
+        started = time.monotonic()
+        try:
+            result = await call(self.llms[provider])
+        except asyncio.CancelledError:
+            health.record_cancelled()
+            raise
+        except Exception:
+            health.record_failure()
+            raise
+        if is_error_answer(result):
+            health.record_failure()
+        else:
+            health.record_success(time.monotonic() - started)
+        return result
+
+    async def _route(self, call: Callable[[Any], Awaitable[Any]]) -> Any:
+        remaining = self.candidates()
+        pending: Dict[asyncio.Task, str] = {}
+        hedged = None
+        last_result = None
+        last_error = None
+
+        def launch() -> str:
+            provider = remaining.pop(0)
+            pending[asyncio.ensure_future(self._call(provider, call))] = provider
+            return provider
+
+        launch()
+        try:
+            while pending:
+                timeout = None
+                if self.hedge and not hedged and remaining and len(pending) == 1:
+                    timeout = self.hedge_delay(next(iter(pending.values())))
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged = launch()
+                    continue
+                for task in done:
+                    provider = pending.pop(task)
+                    if task.exception() is not None:
+                        last_error = task.exception()
+                        continue
+                    result = task.result()
+                    if not is_error_answer(result):
+                        if hedged:
+                            metrics.inc("llm_hedges_total", provider=hedged, outcome="won" if provider == hedged else "lost")
+                        return result
+                    last_result = result
+                if not pending and remaining:
+                    metrics.inc("llm_failovers_total", provider=remaining[0])
+                    launch()
+        finally:
+            for task in pending:
+                task.cancel()
+
+        if last_result is not None:
+            return last_result
+        raise last_error
+
+    async def generate(self, prompt: str, context: str = "", **options) -> str:
+        return await self._route(lambda llm: llm.generate(prompt, context, **options))
+
+    async def generate_with_sources(self, question: str, sources: List[Dict[str, Any]], **options) -> Dict[str, Any]:
+        return await self._route(lambda llm: llm.generate_with_sources(question, sources, **options))
+
+    async def generate_streaming(self, prompt: str, context: str = "", **options) -> AsyncGenerator[str, None]:
+        """Stream van de eerste gezonde provider; zonder hedging (dat zou tokens dubbel leveren)
+
+        Is het eerste stuk een fout, dan gaat de stream over op de volgende
+        provider; na het eerste token is overstappen niet meer mogelijk.
+        """
+        candidates = self.candidates()
+        for index, provider in enumerate(candidates):
+            health = self.health[provider]
+            health.begin()
+            started = time.monotonic()
+            failed = False
+            yielded = False
+            try:
+                async for chunk in self.llms[provider].generate_streaming(prompt, context, **options):
+                    if not yielded:
+                        if not chunk or not chunk.strip():
+                            continue  # lege stukken voor het eerste token zijn nog geen antwoord
+                        if is_error_answer(chunk):
+                            failed = True
+                            if index + 1 < len(candidates):
+                                break  # val over op de volgende provider
+                    yielded = True
+                    yield chunk
+                if not yielded:
+                    failed = True  # lege stream telt als fout, net als een leeg antwoord
+            except (asyncio.CancelledError, GeneratorExit):
+                health.record_cancelled()
+                raise
+            except Exception:
+                health.record_failure()
+                if yielded or index + 1 == len(candidates):
+                    raise
+                metrics.inc("llm_failovers_total", provider=candidates[index + 1])
+                continue
+            if failed:
+                health.record_failure()
+                if not yielded and index + 1 < len(candidates):
+                    metrics.inc("llm_failovers_total", provider=candidates[index + 1])
+                    continue
+            else:
+                health.record_success(time.monotonic() - started)
+            return
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            name: {
+                "state": health.state,
+                "p95": health.p95(None) if len(health.latencies) >= 10 else None,
+                "consecutive_failures": health.consecutive_failures
+            }
+            for name, health in self.health.items()
+        }
+
+    async def close(self):
+        """De providers worden gesloten door close_llms()"""
+        pass
+
+_router = None
+
+def get_router(providers: List[str] = None) -> LLMRouter:
+    """Gedeelde router over de providers uit LLM_ROUTER_PROVIDERS"""
+    global _router
+    if _router is None:
+        if providers is None:
+            providers = [name.strip().lower() for name in os.getenv("LLM_ROUTER_PROVIDERS", "").split(",") if name.strip()]
+        _router = LLMRouter(providers)
+    return _router
+
+def reset_router():
+    global _router
+    _router = None
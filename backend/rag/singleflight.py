@@ -0,0 +1,73 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+from rag.metrics import metrics
+
+metrics.describe("singleflight_calls_total", "Aanroepen via single-flight; role=leader voerde het werk uit, role=follower wachtte mee, role=separate mocht niet aanhaken")
+metrics.describe("singleflight_inflight", "Lopende gedeelde berekeningen")
+metrics.describe("singleflight_cancelled_total", "Gedeelde berekeningen afgebroken omdat niemand meer wachtte")
+
+class SingleFlight:
+    """Voeg gelijktijdige identieke aanroepen samen tot één berekening
+
+    De eerste aanroep met een sleutel (de leader) start het werk als aparte
+    task; aanroepen met dezelfde sleutel die binnenkomen voordat die klaar
+    is (followers) wachten op hetzelfde resultaat of dezelfde exception.
+    Annuleert een wachtende aanroep, dan loopt het werk voor de anderen door;
+    annuleert de laatste wachtende, dan wordt het werk zelf ook afgebroken.
+
+    Met `context` en `joinable` haakt een aanroep alleen aan als
+    joinable(context van de leader) waar is (bijv. als de leader minstens
+    zoveel tijd over heeft); anders doet hij het werk zelf, los van de flight.
+    `on_join` wordt in de context van een follower aangeroepen zodra hij
+    aanhaakt (bijv. om zijn eigen admission ticket als bediend te markeren).
+    """
+    def __init__(self, name: str):
+        self.name = name
+        self._flights: Dict[Hashable, asyncio.Task] = {}
+        self._contexts: Dict[Hashable, Any] = {}
+        self._waiters: Dict[Hashable, int] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]], context: Any = None,
+                 joinable: Optional[Callable[[Any], bool]] = None, on_join: Optional[Callable[[], None]] = None) -> Any:
+        # Tasks horen bij één event loop; neem de loop op in de sleutel
+        flight_key = (id(asyncio.get_running_loop()), key)
+        task = self._flights.get(flight_key)
+        if task is not None and joinable is not None and not joinable(self._contexts.get(flight_key)):
+            metrics.inc("singleflight_calls_total", name=self.name, role="separate")
+            return await fn()
+        if task is not None:
+            metrics.inc("singleflight_calls_total", name=self.name, role="follower")
+            if on_join is not None:
+                on_join()
+        else:
+            metrics.inc("singleflight_calls_total", name=self.name, role="leader")
+            task = asyncio.ensure_future(fn())
+            self._flights[flight_key] = task
+            self._contexts[flight_key] = context
+            metrics.add("singleflight_inflight", 1, name=self.name)
+            task.add_done_callback(lambda done: self._finish(flight_key, done))
+        self._waiters[flight_key] = self._waiters.get(flight_key, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self._waiters.get(flight_key) == 1 and not task.done():
+                task.cancel()
+                metrics.inc("singleflight_cancelled_total", name=self.name)
+            raise
+        finally:
+            remaining = self._waiters.get(flight_key, 1) - 1
+            if remaining > 0:
+                self._waiters[flight_key] = remaining
+            else:
+                self._waiters.pop(flight_key, None)
+
+    def _finish(self, flight_key: Hashable, task: asyncio.Task):
+        self._flights.pop(flight_key, None)
+        self._contexts.pop(flight_key, None)
+        metrics.add("singleflight_inflight", -1, name=self.name)
+        # Markeer de exception als opgehaald, ook als alle wachtenden al weg zijn
+        if not task.cancelled():
+            task.exception()
+
+    def inflight(self) -> int:
+        return len(self._flights)
@@ -0,0 +1,204 @@
+import os
+import re
+import asyncio
+import hashlib
+from collections import OrderedDict
+from typing import Any, AsyncGenerator, Dict, List, Tuple
+from rag.singleflight import SingleFlight
+from rag.metrics import metrics
+from rag.llm import is_error_answer
+
+# Maximaal aantal documenten dat tegelijk wordt samengevat (map-stap)
+SUMMARY_MAX_PARALLEL = int(os.getenv("SUMMARY_MAX_PARALLEL", "4"))
+# Tekst per document die in één samenvattingsprompt mag
+SUMMARY_MAX_DOCUMENT_CHARS = int(os.getenv("SUMMARY_MAX_DOCUMENT_CHARS", "12000"))
+SUMMARY_CACHE_SIZE = int(os.getenv("SUMMARY_CACHE_SIZE", "256"))
+# Tekst van alle samenvattingen samen in de reduce-prompt
+SUMMARY_MAX_REDUCE_CHARS = int(os.getenv("SUMMARY_MAX_REDUCE_CHARS", "12000"))
+
+SUMMARY_PROMPT = "Geef een korte, duidelijke samenvatting van dit document."
+REDUCE_PROMPT = (
+    "Hieronder staan samenvattingen van meerdere documenten. Voeg ze samen tot één overzicht: "
+    "geef per document een korte alinea met de naam van het document en noem daarna de "
+    "belangrijkste overeenkomsten en verschillen tussen de documenten."
+)
+
+metrics.describe("document_summary_requests_total", "Samenvattingen per document; result=stored kwam uit de database, hit uit de cache")
+
+MONTHS = "januari|februari|maart|april|mei|juni|juli|augustus|september|oktober|november|december"
+# Ook na normalisatie door de DocumentProcessor ("1,250,00", "euro")
+AMOUNT_PATTERN = re.compile(
+    r"(?:€|\bEUR|\beuro)\s?-?\d{1,3}(?:[.,\s]\d{3})*(?:,\d{2}|,-)?|\b\d{1,3}(?:[.,]\d{3})*(?:,\d{2})?\s?(?:euro|EUR)\b",
+    re.IGNORECASE
+)
+PERIOD_PATTERN = re.compile(
+    rf"\b(?:\d{{1,2}}[-/]\d{{1,2}}[-/]\d{{2,4}}|\d{{1,2}}\s+(?:{MONTHS})\s+\d{{4}}|(?:{MONTHS})\s+\d{{4}}|(?:Q[1-4]|kwartaal\s+[1-4])\s+\d{{4}})\b",
+    re.IGNORECASE
+)
+# Organisaties op rechtsvorm en partijen met hun rol ("Verhuurder: ...")
+PARTY_PATTERN = re.compile(
+    r"\b(?:[A-Z][\w&'-]*\s){0,4}(?:B\.V\.|N\.V\.|V\.O\.F\.)|\b(?:Stichting|Gemeente|Vereniging|VvE)(?:\s[A-Z][\w&'-]*){1,4}"
+)
+ROLES = "verhuurder|huurder|opdrachtgever|opdrachtnemer|leverancier|klant"
+# Naam na de rol: woorden met een hoofdletter, initialen en tussenvoegsels
+NAME_WORD = r"(?:[A-Z][\w.&'-]*|van|de|der|den|het|ten|ter)"
+ROLE_PATTERN = re.compile(rf"\b(?i:{ROLES})\s*:\s*({NAME_WORD}(?:(?<!\.V\.)\s+(?!(?i:{ROLES})\b){NAME_WORD}){{0,5}})")
+KEY_FACTS_LIMIT = 10
+
+# Gelijktijdige verzoeken om dezelfde samenvatting delen één LLM-aanroep
+summary_flights = SingleFlight("document_summary")
+
+class SummaryCache:
+    """LRU cache van samenvattingen per documentversie (content_hash) en model"""
+    def __init__(self, max_entries: int = SUMMARY_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple, str]" = OrderedDict()
+
+    def get(self, key: Tuple) -> str:
+        summary = self._entries.get(key)
+        if summary is not None:
+            self._entries.move_to_end(key)
+        return summary
+
+    def put(self, key: Tuple, summary: str):
+        self._entries[key] = summary
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+summary_cache = SummaryCache()
+
+def group_by_document(sources: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Groepeer gevonden chunks per document, in volgorde van eerste vondst"""
+    groups: "OrderedDict[Any, Dict[str, Any]]" = OrderedDict()
+    for source in sources:
+        metadata = source.get('metadata', {})
+        key = metadata.get('document_id') or metadata.get('file_path') or metadata.get('filename')
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = {
+                "document_id": metadata.get('document_id'),
+                "content_hash": metadata.get('content_hash'),
+                "name": metadata.get('original_filename') or metadata.get('filename'),
+                "chunks": []
+            }
+        group["chunks"].append(source['content'])
+    return list(groups.values())
+
+def document_text(vectorstore, group: Dict[str, Any]) -> str:
+    """Tekst om samen te vatten: het hele document, of de gevonden chunks bij oude chunks zonder document_id"""
+    chunks = vectorstore.document_chunks(group["document_id"]) if group["document_id"] else []
+    text = "\n\n".join(chunks or group["chunks"])
+    return text[:SUMMARY_MAX_DOCUMENT_CHARS]
+
+async def summarize_document(llm, vectorstore, group: Dict[str, Any], options: Dict[str, Any], stored: Dict[int, Dict[str, Any]] = None) -> str:
+    """Samenvatting van één document (map-stap)
+
+    Eerst de bij ingestion opgeslagen samenvatting (als die bij deze versie
+    van het document hoort), dan de cache; alleen anders een LLM-aanroep.
+    """
+    artifact = (stored or {}).get(group["document_id"])
+    if artifact and artifact.get("summary") and artifact.get("content_hash") == group["content_hash"]:
+        metrics.inc("document_summary_requests_total", result="stored")
+        return artifact["summary"]
+    text = await asyncio.to_thread(document_text, vectorstore, group)
+    version = group["content_hash"] or hashlib.sha256(text.encode("utf-8")).hexdigest()
+    key = (version, llm.provider, options.get("model"), options.get("max_tokens"))
+    summary = summary_cache.get(key)
+    if summary is not None:
+        metrics.inc("document_summary_requests_total", result="hit")
+        return summary
+    metrics.inc("document_summary_requests_total", result="miss")
+
+    async def generate():
+        summary = await llm.generate(SUMMARY_PROMPT, text, **options)
+        # Foutmeldingen niet cachen; de volgende keer opnieuw proberen
+        if summary and not summary.startswith("Error:"):
+            summary_cache.put(key, summary)
+        return summary
+
+    return await summary_flights.do(key, generate)
+
+async def iter_document_summaries(llm, vectorstore, sources: List[Dict[str, Any]], stored: Dict[int, Dict[str, Any]] = None, **options) -> AsyncGenerator[Tuple[int, str, str, Dict[str, List[str]]], None]:
+    """Vat de gevonden documenten gelijktijdig samen (begrensd) en geef ze in documentvolgorde terug"""
+    groups = group_by_document(sources)
+    semaphore = asyncio.Semaphore(max(SUMMARY_MAX_PARALLEL, 1))
+
+    async def bounded(group):
+        async with semaphore:
+            return await summarize_document(llm, vectorstore, group, options, stored)
+
+    tasks = [asyncio.ensure_future(bounded(group)) for group in groups]
+    try:
+        for i, (group, task) in enumerate(zip(groups, tasks), 1):
+            artifact = (stored or {}).get(group["document_id"]) or {}
+            key_facts = artifact.get("key_facts") if artifact.get("content_hash") == group["content_hash"] else None
+            yield i, group["name"] or f"Document {i}", await task, key_facts
+    finally:
+        for task in tasks:
+            task.cancel()
+
+def _unique(values: List[str]) -> List[str]:
+    seen = []
+    for value in values:
+        value = " ".join(value.split()).strip(" ,;:")
+        if value and value not in seen:
+            seen.append(value)
+    return seen[:KEY_FACTS_LIMIT]
+
+def extract_key_facts(text: str) -> Dict[str, List[str]]:
+    """Bedragen, periodes en partijen uit de tekst (regels, geen LLM)"""
+    parties = [match.group(1) for match in ROLE_PATTERN.finditer(text)] + PARTY_PATTERN.findall(text)
+    return {
+        "amounts": _unique(AMOUNT_PATTERN.findall(text)),
+        "periods": _unique(PERIOD_PATTERN.findall(text)),
+        "parties": _unique(parties)
+    }
+
+async def build_document_artifacts(llm, vectorstore, document_id: int) -> Tuple[str, Dict[str, List[str]]]:
+    """Samenvatting (LLM) en kerngegevens (regels) voor een verwerkt document"""
+    chunks = await asyncio.to_thread(vectorstore.document_chunks, document_id)
+    text = "\n\n".join(chunks)
+    summary = await llm.generate(SUMMARY_PROMPT, text[:SUMMARY_MAX_DOCUMENT_CHARS])
+    return summary, extract_key_facts(text)
+
+def format_key_facts(key_facts: Dict[str, List[str]]) -> str:
+    labels = (("amounts", "Bedragen"), ("periods", "Periodes"), ("parties", "Partijen"))
+    return "\n".join(f"{label}: {', '.join(key_facts[name])}" for name, label in labels if key_facts.get(name))
+
+def format_document_summary(index: int, name: str, summary: str, key_facts: Dict[str, List[str]] = None) -> str:
+    text = f"Document {index} ({name}):\n{summary.strip()}"
+    facts = format_key_facts(key_facts or {})
+    return f"{text}\n{facts}" if facts else text
+
+async def stream_per_document(llm, vectorstore, sources: List[Dict[str, Any]], stored: Dict[int, Dict[str, Any]] = None, **options) -> AsyncGenerator[str, None]:
+    """Samenvatting per document als tekststukken, één per document zodra het aan de beurt is"""
+    async for index, name, summary, key_facts in iter_document_summaries(llm, vectorstore, sources, stored, **options):
+        yield ("\n\n" if index > 1 else "") + format_document_summary(index, name, summary, key_facts)
+
+def reduce_context(parts: List[str], max_chars: int = None) -> str:
+    """Samenvattingen voor de reduce-prompt; elk document krijgt een gelijk deel van het budget"""
+    max_chars = max_chars or SUMMARY_MAX_REDUCE_CHARS
+    separators = 2 * (len(parts) - 1)
+    share = max((max_chars - separators) // max(len(parts), 1), 4)
+    return "\n\n".join(part if len(part) <= share else part[:share - 3] + "..." for part in parts)
+
+async def summarize_per_document(llm, vectorstore, sources: List[Dict[str, Any]], stored: Dict[int, Dict[str, Any]] = None, **options) -> str:
+    """Samenvatting per document: map over de documenten, reduce tot één antwoord
+
+    De reduce-stap is één LLM-aanroep over de (begrensde) samenvattingen.
+    Bij één document of een mislukte reduce volgen de samenvattingen zelf.
+    De streaming endpoint gebruikt alleen de map-stap (stream_per_document),
+    zodat elk document direct zichtbaar is.
+    """
+    parts = [
+        format_document_summary(index, name, summary, key_facts)
+        async for index, name, summary, key_facts in iter_document_summaries(llm, vectorstore, sources, stored, **options)
+    ]
+    merged = "\n\n".join(parts)
+    if len(parts) < 2:
+        return merged
+    answer = await llm.generate(REDUCE_PROMPT, reduce_context(parts), **options)
+    if is_error_answer(answer):
+        return merged
+    return answer
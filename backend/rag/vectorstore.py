@@ -1,16 +1,24 @@
 import json
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Tuple
 import os
+import threading
 import numpy as np
 from sentence_transformers import SentenceTransformer
 
+DEFAULT_STORAGE_PATH = "/app/data/vectorstore.json"
+
 class EmbeddingVectorStore:
-    def __init__(self, storage_path: str = "/app/data/vectorstore.json"):
+    def __init__(self, storage_path: str = DEFAULT_STORAGE_PATH):
         self.storage_path = storage_path
         self.documents = []
         self.metadatas = []
         self.ids = []
         self.embeddings = []
+        # Verhoogd bij elke save; wordt mee opgeslagen zodat caches weten wanneer de index wijzigde
+        self.generation = 0
+        self._loaded_mtime = None
+        # Beschermt de lijsten en het wegschrijven bij gelijktijdige uploads
+        self._lock = threading.RLock()
         # Gebruik het originele embedding model voor compatibiliteit
         self.model = SentenceTransformer('all-MiniLM-L6-v2')
         self._load_data()
@@ -26,6 +34,8 @@ class EmbeddingVectorStore:
                     self.metadatas = data.get('metadatas', [])
                     self.ids = data.get('ids', [])
                     self.embeddings = [np.array(e) for e in data.get('embeddings', [])]
+                    self.generation = data.get('generation', 0)
+                self._loaded_mtime = self._file_mtime()
                 print(f"Loaded {len(self.documents)} documents")
             else:
                 print(f"Storage file {self.storage_path} does not exist, starting fresh")
@@ -41,27 +51,49 @@ class EmbeddingVectorStore:
         try:
             print(f"Saving {len(self.documents)} documents to {self.storage_path}")
             os.makedirs(os.path.dirname(self.storage_path), exist_ok=True)
-            with open(self.storage_path, 'w', encoding='utf-8') as f:
+            # Schrijf naar een tijdelijk bestand en vervang atomair, zodat een
+            # onderbroken schrijfactie de bestaande index niet beschadigt
+            tmp_path = f"{self.storage_path}.{os.getpid()}.tmp"
+            self.generation += 1
+            with open(tmp_path, 'w', encoding='utf-8') as f:
                 json.dump({
+                    'generation': self.generation,
                     'documents': self.documents,
                     'metadatas': self.metadatas,
                     'ids': self.ids,
                     'embeddings': [e.tolist() for e in self.embeddings]
                 }, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.storage_path)
+            self._loaded_mtime = self._file_mtime()
             print(f"Successfully saved data to {self.storage_path}")
         except Exception as e:
             print(f"Error saving vectorstore data: {e}")
     
+    def _file_mtime(self):
+        try:
+            return os.stat(self.storage_path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+    
+    def reload_if_changed(self) -> bool:
+        """Herlaad als een ander process het bestand heeft gewijzigd"""
+        with self._lock:
+            if self._file_mtime() == self._loaded_mtime:
+                return False
+            self._load_data()
+            return True
+    
     def add_documents(self, documents: List[str], metadatas: List[Dict[str, Any]], ids: List[str]):
         """Voeg documenten toe aan de vectorstore"""
         try:
             print(f"Adding {len(documents)} documents to vectorstore")
             new_embeddings = self.model.encode(documents)
-            self.documents.extend(documents)
-            self.metadatas.extend(metadatas)
-            self.ids.extend(ids)
-            self.embeddings.extend([np.array(e) for e in new_embeddings])
-            self._save_data()
+            with self._lock:
+                self.documents.extend(documents)
+                self.metadatas.extend(metadatas)
+                self.ids.extend(ids)
+                self.embeddings.extend([np.array(e) for e in new_embeddings])
+                self._save_data()
             return True
         except Exception as e:
             print(f"Error adding documents: {e}")
@@ -77,14 +109,15 @@ class EmbeddingVectorStore:
             # Generate embedding
             embedding = self.model.encode([content])[0]
             
-            # Add to lists
-            self.documents.append(content)
-            self.embeddings.append(embedding)
-            self.metadatas.append(metadata or {})
-            self.ids.append(str(len(self.documents)))
-            
-            # Save to disk
-            self._save_data()
+            with self._lock:
+                # Add to lists
+                self.documents.append(content)
+                self.embeddings.append(embedding)
+                self.metadatas.append(metadata or {})
+                self.ids.append(str(len(self.documents)))
+                
+                # Save to disk
+                self._save_data()
             
             print(f"Added document chunk: {len(content)} characters")
             return True
@@ -93,8 +126,12 @@ class EmbeddingVectorStore:
             print(f"Error adding document: {e}")
             return False
     
-    def search(self, query: str, n_results: int = 10, document_filter: str = None) -> List[Dict[str, Any]]:
-        """Zoek in de vectorstore met optionele document filtering en hybrid search"""
+    def search(self, query: str, n_results: int = 10, document_filter: str = None, cancelled: threading.Event = None) -> List[Dict[str, Any]]:
+        """Zoek in de vectorstore met optionele document filtering en hybrid search
+
+        Met `cancelled` gezet (de aanvrager is afgehaakt) stopt de zoekactie
+        na de lopende stap en komt er een lege lijst terug.
+        """
         try:
             print(f"Searching for: '{query}' in {len(self.documents)} documents")
             if document_filter:
@@ -102,10 +139,18 @@ class EmbeddingVectorStore:
             
             if not self.documents or not self.embeddings:
                 return []
+            if cancelled is not None and cancelled.is_set():
+                return []
+            
+            # Eén consistente momentopname; een gelijktijdige reload of verwijdering vervangt de lijsten
+            snapshot = self._snapshot()
             
             # Hybrid search: combine semantic and keyword search
-            semantic_results = self._semantic_search(query, n_results, document_filter)
-            keyword_results = self._keyword_search(query, n_results, document_filter)
+            semantic_results = self._semantic_search(query, n_results, document_filter, snapshot)
+            if cancelled is not None and cancelled.is_set():
+                print("Search cancelled")
+                return []
+            keyword_results = self._keyword_search(query, n_results, document_filter, snapshot)
             
             # Combine and deduplicate results
             combined_results = self._combine_results(semantic_results, keyword_results, n_results)
@@ -116,11 +161,77 @@ class EmbeddingVectorStore:
             print(f"Error searching: {e}")
             return []
     
-    def _semantic_search(self, query: str, n_results: int, document_filter: str = None) -> List[Dict[str, Any]]:
+    def search_batch(self, queries: List[str], n_results: int = 10, document_filter: str = None, cancelled: threading.Event = None) -> List[List[Dict[str, Any]]]:
+        """Zoek voor meerdere vragen tegelijk; per vraag hetzelfde resultaat als search()
+
+        Alle vragen worden in één encode-aanroep ge-embed en de semantische
+        scores komen uit één matrixvermenigvuldiging over de hele index.
+        """
+        try:
+            print(f"Batch search for {len(queries)} queries in {len(self.documents)} documents")
+            if not queries:
+                return []
+            snapshot = self._snapshot()
+            documents, metadatas, embeddings = snapshot
+            if not documents or not embeddings or (cancelled is not None and cancelled.is_set()):
+                return [[] for _ in queries]
+
+            matrix = np.vstack(embeddings)
+            matrix_norms = np.linalg.norm(matrix, axis=1)
+            query_embs = np.asarray(self.model.encode(queries))
+            query_norms = np.linalg.norm(query_embs, axis=1)
+            # Cosine similarity van elke vraag met elke chunk: (vragen x chunks)
+            scores = (query_embs @ matrix.T) / np.outer(query_norms, matrix_norms)
+
+            # Het documentfilter is voor alle vragen gelijk
+            candidates = np.arange(len(embeddings))
+            if document_filter:
+                candidates = np.array([
+                    idx for idx in candidates
+                    if self._matches_filter(metadatas[idx] if idx < len(metadatas) else {}, document_filter)
+                ], dtype=int)
+
+            results = []
+            for query, query_scores in zip(queries, scores):
+                if cancelled is not None and cancelled.is_set():
+                    print("Batch search cancelled")
+                    return [[] for _ in queries]
+                # Stabiel sorteren, zodat gelijke scores dezelfde volgorde krijgen als in search()
+                order = candidates[np.argsort(-query_scores[candidates], kind="stable")][:n_results]
+                semantic_results = [
+                    {
+                        'content': documents[idx],
+                        'metadata': metadatas[idx] if idx < len(metadatas) else {},
+                        'relevance': float(query_scores[idx]),
+                        'search_type': 'semantic'
+                    }
+                    for idx in order
+                    if query_scores[idx] > 0.1  # Minimum similarity threshold
+                ]
+                keyword_results = self._keyword_search(query, n_results, document_filter, snapshot)
+                results.append(self._combine_results(semantic_results, keyword_results, n_results))
+            return results
+        except Exception as e:
+            print(f"Error in batch search: {e}")
+            return [[] for _ in queries]
+
+    def _matches_filter(self, metadata: Dict[str, Any], document_filter: str) -> bool:
+        file_path = metadata.get('file_path', '')
+        filename = metadata.get('filename', '')
+        return (document_filter.lower() in file_path.lower() or
+                document_filter.lower() in filename.lower())
+
+    def _snapshot(self) -> Tuple[List[str], List[Dict[str, Any]], List[np.ndarray]]:
+        """Kopie van de lijsten, onder de lock genomen zodat ze bij elkaar horen"""
+        with self._lock:
+            return list(self.documents), list(self.metadatas), list(self.embeddings)
+    
+    def _semantic_search(self, query: str, n_results: int, document_filter: str = None, snapshot: Tuple = None) -> List[Dict[str, Any]]:
         """Semantic search met embeddings"""
         try:
+            documents, metadatas, embeddings = snapshot or self._snapshot()
             query_emb = self.model.encode([query])[0]
-            scores = [self._cosine_similarity(query_emb, emb) for emb in self.embeddings]
+            scores = [self._cosine_similarity(query_emb, emb) for emb in embeddings]
             
             # Create list of (index, score) tuples
             indexed_scores = list(enumerate(scores))
@@ -129,7 +240,7 @@ class EmbeddingVectorStore:
             if document_filter:
                 filtered_indices = []
                 for idx, score in indexed_scores:
-                    metadata = self.metadatas[idx] if idx < len(self.metadatas) else {}
+                    metadata = metadatas[idx] if idx < len(metadatas) else {}
                     file_path = metadata.get('file_path', '')
                     filename = metadata.get('filename', '')
                     # Check both file_path and filename
@@ -146,8 +257,8 @@ class EmbeddingVectorStore:
             for idx in top_indices:
                 if scores[idx] > 0.1:  # Minimum similarity threshold
                     results.append({
-                        'content': self.documents[idx],
-                        'metadata': self.metadatas[idx] if idx < len(self.metadatas) else {},
+                        'content': documents[idx],
+                        'metadata': metadatas[idx] if idx < len(metadatas) else {},
                         'relevance': float(scores[idx]),
                         'search_type': 'semantic'
                     })
@@ -157,17 +268,18 @@ class EmbeddingVectorStore:
             print(f"Error in semantic search: {e}")
             return []
     
-    def _keyword_search(self, query: str, n_results: int, document_filter: str = None) -> List[Dict[str, Any]]:
+    def _keyword_search(self, query: str, n_results: int, document_filter: str = None, snapshot: Tuple = None) -> List[Dict[str, Any]]:
         """Keyword search voor exacte termen"""
         try:
+            documents, metadatas, _ = snapshot or self._snapshot()
             # Normalize query
             query_terms = query.lower().split()
             
             results = []
-            for idx, doc in enumerate(self.documents):
+            for idx, doc in enumerate(documents):
                 # Check document filter
                 if document_filter:
-                    metadata = self.metadatas[idx] if idx < len(self.metadatas) else {}
+                    metadata = metadatas[idx] if idx < len(metadatas) else {}
                     file_path = metadata.get('file_path', '')
                     filename = metadata.get('filename', '')
                     if not (document_filter.lower() in file_path.lower() or 
@@ -187,7 +299,7 @@ class EmbeddingVectorStore:
                 if score > 0:
                     results.append({
                         'content': doc,
-                        'metadata': self.metadatas[idx] if idx < len(self.metadatas) else {},
+                        'metadata': metadatas[idx] if idx < len(metadatas) else {},
                         'relevance': min(score / 10, 1.0),  # Normalize score
                         'search_type': 'keyword'
                     })
@@ -294,5 +406,116 @@ class EmbeddingVectorStore:
             print(f"Error removing document chunks: {e}")
             return False
 
+    def document_chunks(self, document_id: int) -> List[str]:
+        """Alle chunks van een document, in de volgorde van het document"""
+        with self._lock:
+            chunks = [
+                (metadata.get('chunk', 0), self.documents[idx])
+                for idx, metadata in enumerate(self.metadatas)
+                if metadata.get('document_id') == document_id
+            ]
+        return [content for _, content in sorted(chunks, key=lambda chunk: chunk[0])]
+
+    def copy_document_chunks(self, source_document_id: int, metadata: Dict[str, Any]) -> int:
+        """Kopieer de chunks en embeddings van een ander document zonder opnieuw te embedden
+        
+        Per chunk worden alleen de document-specifieke velden uit metadata
+        overschreven; offsets en paginabereik blijven behouden.
+        """
+        try:
+            with self._lock:
+                indices = [
+                    idx for idx, chunk_metadata in enumerate(self.metadatas)
+                    if chunk_metadata.get('document_id') == source_document_id
+                ]
+                if not indices:
+                    return 0
+                
+                for idx in indices:
+                    chunk_metadata = dict(self.metadatas[idx])
+                    chunk_metadata.update(metadata)
+                    self.documents.append(self.documents[idx])
+                    self.embeddings.append(self.embeddings[idx])
+                    self.metadatas.append(chunk_metadata)
+                    self.ids.append(f"{metadata.get('document_id')}_{chunk_metadata.get('chunk')}")
+                
+                self._save_data()
+            print(f"Copied {len(indices)} chunks from document {source_document_id}")
+            return len(indices)
+        except Exception as e:
+            print(f"Error copying document chunks: {e}")
+            return 0
+    
+    def replace_document_chunks(self, document_id: int, documents: List[str], metadatas: List[Dict[str, Any]], ids: List[str], legacy_file_path: str = None) -> bool:
+        """Vervang alle chunks van een document in één keer
+        
+        De nieuwe embeddings worden eerst berekend; pas daarna worden de oude
+        chunks verwijderd en de nieuwe toegevoegd, met één enkele save.
+        """
+        try:
+            new_embeddings = self.model.encode(documents) if documents else []
+            with self._lock:
+                removed = self._drop_document_chunks(document_id, legacy_file_path)
+                self.documents.extend(documents)
+                self.metadatas.extend(metadatas)
+                self.ids.extend(ids)
+                self.embeddings.extend([np.array(e) for e in new_embeddings])
+                self._save_data()
+            print(f"Replaced {removed} chunks with {len(documents)} chunks for document id: {document_id}")
+            return True
+        except Exception as e:
+            print(f"Error replacing document chunks: {e}")
+            return False
+    
+    def remove_document_chunks_by_id(self, document_id: int, legacy_file_path: str = None) -> int:
+        """Verwijder alle chunks van een document op basis van document_id
+        
+        Chunks van vóór de document_id metadata worden herkend aan hun exacte
+        file_path; een gedeeld (content-addressed) pad telt daarbij niet mee.
+        """
+        with self._lock:
+            removed = self._drop_document_chunks(document_id, legacy_file_path)
+            if removed:
+                self._save_data()
+        print(f"Removed {removed} chunks for document id: {document_id}")
+        return removed
+    
+    def _drop_document_chunks(self, document_id: int, legacy_file_path: str = None) -> int:
+        """Verwijder chunks van een document uit het geheugen (zonder save)"""
+        keep = []
+        for idx, metadata in enumerate(self.metadatas):
+            if 'document_id' in metadata:
+                matches = metadata['document_id'] == document_id
+            else:
+                matches = legacy_file_path is not None and metadata.get('file_path') == legacy_file_path
+            if not matches:
+                keep.append(idx)
+        
+        removed = len(self.metadatas) - len(keep)
+        if removed:
+            self.documents = [self.documents[idx] for idx in keep]
+            self.metadatas = [self.metadatas[idx] for idx in keep]
+            self.ids = [self.ids[idx] for idx in keep]
+            self.embeddings = [self.embeddings[idx] for idx in keep]
+        return removed
+
 # Use persistent vectorstore
-VectorStore = EmbeddingVectorStore 
\ No newline at end of file
+VectorStore = EmbeddingVectorStore
+
+_shared_store = None
+_shared_store_lock = threading.Lock()
+
+def get_vectorstore() -> EmbeddingVectorStore:
+    """Gedeelde vectorstore voor dit process
+
+    Het embedding model en de index worden één keer geladen; als een ander
+    process (bijv. reprocess_documents) het bestand heeft gewijzigd, wordt
+    de index opnieuw ingelezen.
+    """
+    global _shared_store
+    with _shared_store_lock:
+        if _shared_store is None:
+            _shared_store = VectorStore()
+        else:
+            _shared_store.reload_if_changed()
+        return _shared_store 
\ No newline at end of file
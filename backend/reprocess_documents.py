@@ -1,84 +1,230 @@
 #!/usr/bin/env python3
 """
-Script om alle bestaande documenten opnieuw te verwerken
+Script om bestaande documenten opnieuw te verwerken
+
+Alleen documenten waarvan de bestandshash of de processorversie is veranderd
+worden opnieuw verwerkt. Extractie loopt parallel, elk document in een eigen
+process met de limieten van de ingestion governor; de chunks van een document
+worden in één keer vervangen. Voortgang wordt na elk
+document in een checkpoint bewaard, zodat een onderbroken run verder kan.
 """
 import os
 import sys
-from pathlib import Path
+import json
+import time
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 
 # Voeg de app directory toe aan het Python pad
 sys.path.append('/app')
 
 from rag.document_processor import DocumentProcessor
 from rag.vectorstore import VectorStore
+from rag.governor import run_ingestion_job, IngestionError
 from db import SessionLocal
 from models import Document
+from storage import hash_file
+from ingestion import chunk_metadatas, mark_processing_failed, precompute_document_summary, INGEST_SUMMARIES
+from rag.llm import close_llms
+
+DEFAULT_CHECKPOINT = "./data/reprocess_checkpoint.json"
+
+def extract_chunks(processor: DocumentProcessor, file_path: str):
+    """Draait in een worker thread: extractie en chunking van één bestand in een geïsoleerd process
+
+    --workers begrenst het aantal gelijktijdige jobs al; de slots van de API
+    (INGEST_MAX_JOBS) gelden hier niet, zodat de gemeten tijd alleen de job zelf is.
+    """
+    start = time.time()
+    chunks = run_ingestion_job(file_path, processor, slots=None)
+    return chunks, time.time() - start
 
-def reprocess_all_documents():
-    """Verwerk alle documenten opnieuw"""
+def load_checkpoint(path: str, processor_version: str) -> set:
+    """Laad de ids die in een eerdere, onderbroken run al klaar waren"""
+    if not os.path.exists(path):
+        return set()
+    with open(path, 'r', encoding='utf-8') as f:
+        checkpoint = json.load(f)
+    if checkpoint.get('processor_version') != processor_version:
+        print("Checkpoint hoort bij een andere processorversie, wordt genegeerd")
+        return set()
+    return set(checkpoint.get('completed', []))
+
+def save_checkpoint(path: str, processor_version: str, completed: set):
+    """Schrijf het checkpoint atomair weg"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'processor_version': processor_version, 'completed': sorted(completed)}, f)
+    os.replace(tmp_path, path)
+
+def needs_reprocessing(doc: Document, content_hash: str, processor_version: str) -> bool:
+    """Alleen opnieuw verwerken als inhoud of processorversie anders is"""
+    return not (
+        doc.is_processed
+        and doc.content_hash == content_hash
+        and doc.processor_version == processor_version
+    )
+
+def reprocess_all_documents(workers: int = None, force: bool = False, checkpoint_path: str = DEFAULT_CHECKPOINT, restart: bool = False):
+    """Verwerk gewijzigde documenten opnieuw"""
     db = SessionLocal()
     processor = DocumentProcessor()
+    # Documenten worden al parallel verwerkt; geen geneste PDF pools per worker
+    processor.pdf_workers = 1
     vectorstore = VectorStore()
-    
+    version = processor.version
+
+    if restart and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    completed = load_checkpoint(checkpoint_path, version)
+    if completed:
+        print(f"Hervatten: {len(completed)} documenten waren al klaar")
+
+    stats = {'processed': 0, 'skipped': 0, 'failed': 0, 'chunks': 0, 'bytes': 0, 'extract_seconds': 0.0}
+    started = time.time()
+
     try:
         # Haal alle documenten op uit de database
-        documents = db.query(Document).all()
-        
-        print(f"Gevonden {len(documents)} documenten om opnieuw te verwerken...")
-        
+        documents = db.query(Document).order_by(Document.id).all()
+        print(f"Gevonden {len(documents)} documenten (processor {version})...")
+
+        # Bepaal welke documenten echt opnieuw verwerkt moeten worden
+        todo = []
         for doc in documents:
-            if os.path.exists(doc.file_path):
-                print(f"Verwerken van: {doc.original_filename}")
-                
-                try:
-                    # Verwerk document
-                    chunks = processor.process_document(doc.file_path)
-                    
-                    if chunks:
-                        # Maak metadata voor elke chunk
-                        metadatas = []
-                        for i, chunk in enumerate(chunks):
-                            metadata = {
-                                'file_path': doc.file_path,
-                                'filename': doc.filename,
-                                'original_filename': doc.original_filename,
-                                'chunk': i + 1,
-                                'user_id': doc.user_id,
-                                'upload_date': doc.uploaded_at.isoformat()
-                            }
-                            metadatas.append(metadata)
-                        
-                        # Voeg toe aan vectorstore
-                        for i, chunk in enumerate(chunks):
-                            vectorstore.add_document(chunk, metadatas[i])
-                        
+            if doc.id in completed:
+                stats['skipped'] += 1
+                continue
+            if not os.path.exists(doc.file_path):
+                print(f"  ✗ Bestand niet gevonden: {doc.file_path}")
+                mark_processing_failed(db, doc, FileNotFoundError(f"File not found: {doc.file_path}"))
+                stats['failed'] += 1
+                continue
+
+            content_hash = hash_file(doc.file_path)
+            if not force and not needs_reprocessing(doc, content_hash, version):
+                stats['skipped'] += 1
+                continue
+            doc.content_hash = content_hash
+            todo.append(doc)
+
+        print(f"{len(todo)} documenten opnieuw verwerken, {stats['skipped']} ongewijzigd")
+
+        workers = workers or os.cpu_count() or 1
+        pool = ThreadPoolExecutor(max_workers=workers)
+        try:
+            queue = list(reversed(todo))
+            running = {}
+            # Houd het aantal openstaande jobs beperkt zodat chunks niet ophopen in het geheugen
+            max_pending = workers * 2
+            while queue or running:
+                while queue and len(running) < max_pending:
+                    doc = queue.pop()
+                    running[pool.submit(extract_chunks, processor, doc.file_path)] = doc
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    doc = running.pop(future)
+                    print(f"Verwerken van: {doc.original_filename}")
+                    try:
+                        chunks, extract_seconds = future.result()
+                        replaced = vectorstore.replace_document_chunks(
+                            doc.id,
+                            [chunk['content'] for chunk in chunks],
+                            chunk_metadatas(doc, chunks),
+                            [f"{doc.id}_{i + 1}" for i in range(len(chunks))],
+                            legacy_file_path=doc.file_path
+                        )
+                        if not replaced:
+                            raise RuntimeError("Could not replace chunks in vectorstore")
+
                         # Update document record
                         doc.is_processed = True
                         doc.chunk_count = len(chunks)
-                        print(f"  ✓ {len(chunks)} chunks toegevoegd")
-                    else:
-                        print(f"  ⚠ Geen chunks gegenereerd")
-                        doc.is_processed = True
-                        doc.chunk_count = 0
-                        
-                except Exception as e:
-                    print(f"  ✗ Fout bij verwerken: {e}")
-                    doc.is_processed = True
-                    doc.chunk_count = 0
-            else:
-                print(f"  ✗ Bestand niet gevonden: {doc.file_path}")
-                doc.is_processed = True
-                doc.chunk_count = 0
-        
-        # Commit alle wijzigingen
-        db.commit()
+                        doc.processor_version = version
+                        doc.processing_error = None
+                        db.commit()
+
+                        stats['processed'] += 1
+                        stats['chunks'] += len(chunks)
+                        stats['bytes'] += doc.file_size or 0
+                        stats['extract_seconds'] += extract_seconds
+                        if chunks:
+                            print(f"  ✓ {len(chunks)} chunks ({extract_seconds:.1f}s extractie)")
+                        else:
+                            print(f"  ⚠ Geen chunks gegenereerd")
+                    except IngestionError as e:
+                        print(f"  ✗ Verwerking afgebroken: {e}")
+                        mark_processing_failed(db, doc, e)
+                        stats['failed'] += 1
+                    except Exception as e:
+                        print(f"  ✗ Fout bij verwerken: {e}")
+                        db.rollback()
+                        stats['failed'] += 1
+
+                    completed.add(doc.id)
+                    save_checkpoint(checkpoint_path, version, completed)
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+        # Run is volledig; checkpoint is niet meer nodig
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
         print("✓ Alle documenten opnieuw verwerkt!")
-        
+
+    except KeyboardInterrupt:
+        print(f"Onderbroken; checkpoint bewaard in {checkpoint_path}")
     except Exception as e:
         print(f"Fout: {e}")
         db.rollback()
     finally:
         db.close()
+        print_summary(stats, time.time() - started)
+
+def precompute_summaries(vectorstore: VectorStore):
+    """Maak ontbrekende of verouderde samenvattingen en kerngegevens aan"""
+    db = SessionLocal()
+    try:
+        document_ids = [doc.id for doc in db.query(Document.id).filter(Document.is_processed == True).order_by(Document.id)]
+    finally:
+        db.close()
+
+    async def run():
+        stored = 0
+        try:
+            for document_id in document_ids:
+                if await precompute_document_summary(document_id, vectorstore=vectorstore):
+                    stored += 1
+        finally:
+            await close_llms()
+        return stored
+
+    print(f"Samenvattingen bijwerken voor {len(document_ids)} documenten...")
+    print(f"✓ {asyncio.run(run())} samenvattingen opgeslagen")
+
+def print_summary(stats: dict, elapsed: float):
+    """Print een throughput-samenvatting"""
+    elapsed = max(elapsed, 1e-6)
+    megabytes = stats['bytes'] / (1024 * 1024)
+    print("")
+    print("Samenvatting")
+    print(f"  Verwerkt:     {stats['processed']}")
+    print(f"  Overgeslagen: {stats['skipped']}")
+    print(f"  Mislukt:      {stats['failed']}")
+    print(f"  Chunks:       {stats['chunks']}")
+    print(f"  Duur:         {elapsed:.1f}s (extractie opgeteld {stats['extract_seconds']:.1f}s)")
+    print(f"  Throughput:   {stats['processed'] / elapsed:.2f} docs/s, {megabytes / elapsed:.2f} MB/s, {stats['chunks'] / elapsed:.1f} chunks/s")
 
 if __name__ == "__main__":
-    reprocess_all_documents() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Verwerk gewijzigde documenten opnieuw")
+    parser.add_argument("--workers", type=int, default=None, help="Aantal gelijktijdige documenten (standaard: aantal cores)")
+    parser.add_argument("--force", action="store_true", help="Verwerk alle documenten, ook ongewijzigde")
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT, help="Pad van het checkpoint bestand")
+    parser.add_argument("--restart", action="store_true", help="Negeer een bestaand checkpoint")
+    parser.add_argument("--summaries", action="store_true", default=INGEST_SUMMARIES,
+                        help="Maak daarna samenvattingen en kerngegevens aan (standaard: INGEST_SUMMARIES)")
+    args = parser.parse_args()
+    reprocess_all_documents(args.workers, args.force, args.checkpoint, args.restart)
+    if args.summaries:
+        precompute_summaries(VectorStore())
@@ -0,0 +1,175 @@
+import os
+import hashlib
+import tempfile
+import threading
+from typing import BinaryIO, Optional, Tuple
+from fastapi import UploadFile
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+from models import StoredFile
+
+DOCUMENTS_DIR = os.getenv("DOCUMENTS_DIR", "/app/documents")
+COPY_BUFFER_SIZE = 1024 * 1024  # 1 MB per leesactie
+MAX_UPLOAD_SIZE = int(os.getenv("MAX_UPLOAD_SIZE_MB", "500")) * 1024 * 1024
+
+# Serialiseert plaatsen, tellen en verwijderen van objecten binnen dit process;
+# with_for_update() doet niets op SQLite
+_stored_files_lock = threading.RLock()
+
+class FileTooLargeError(Exception):
+    """Upload is groter dan de toegestane maximale bestandsgrootte"""
+    def __init__(self, max_size: int):
+        super().__init__(f"File exceeds maximum upload size of {max_size // (1024 * 1024)} MB")
+        self.max_size = max_size
+
+class FileStore:
+    """Content-addressed opslag: elk bestand staat één keer op schijf, op basis van zijn SHA-256"""
+    def __init__(self, root: str = None):
+        self.root = root or DOCUMENTS_DIR
+        self.objects_dir = os.path.join(self.root, "objects")
+        self.tmp_dir = os.path.join(self.root, "tmp")
+
+    def path_for(self, content_hash: str, extension: str) -> str:
+        """Pad van een object; de extensie blijft behouden voor type-detectie"""
+        return os.path.join(self.objects_dir, content_hash[:2], f"{content_hash}{extension}")
+
+    async def save_upload(self, upload: UploadFile, extension: str, max_size: int = MAX_UPLOAD_SIZE) -> Tuple[str, int, str]:
+        """Sla een upload op buiten de event loop; geheugengebruik blijft één buffer per upload"""
+        if upload.size is not None and max_size and upload.size > max_size:
+            raise FileTooLargeError(max_size)
+        return await run_in_threadpool(self.save_stream, upload.file, extension, max_size)
+
+    def save_stream(self, source: BinaryIO, extension: str, max_size: int = None) -> Tuple[str, int, str]:
+        """Schrijf een stream in blokken naar een tijdelijk bestand en bereken tegelijk de hash
+
+        Geeft (content_hash, file_size, tmp_path) terug; acquire_stored_file
+        zet het bestand op zijn definitieve plek. Wordt max_size
+        overschreden, dan volgt FileTooLargeError.
+        """
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        try:
+            with os.fdopen(fd, "wb") as buffer:
+                while True:
+                    block = source.read(COPY_BUFFER_SIZE)
+                    if not block:
+                        break
+                    size += len(block)
+                    if max_size and size > max_size:
+                        raise FileTooLargeError(max_size)
+                    digest.update(block)
+                    buffer.write(block)
+            return digest.hexdigest(), size, tmp_path
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def commit(self, tmp_path: str, content_hash: str, size: int, extension: str) -> Tuple[str, int, str]:
+        """Verplaats een volledig geschreven tijdelijk bestand naar zijn definitieve plek
+
+        Bestaat het object al, dan wordt het tijdelijke bestand weggegooid.
+        """
+        file_path = self.path_for(content_hash, extension)
+        if os.path.exists(file_path):
+            os.remove(tmp_path)
+        else:
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            os.replace(tmp_path, file_path)
+        return content_hash, size, file_path
+
+    def remove(self, file_path: str):
+        """Verwijder een object van schijf"""
+        if os.path.exists(file_path):
+            os.remove(file_path)
+            print(f"Deleted file: {file_path}")
+
+def hash_file(file_path: str) -> str:
+    """Bereken de SHA-256 van een bestaand bestand"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        while True:
+            block = file.read(COPY_BUFFER_SIZE)
+            if not block:
+                break
+            digest.update(block)
+    return digest.hexdigest()
+
+def acquire_stored_file(db: Session, content_hash: str, tmp_path: str, file_size: int, extension: str, store: Optional[FileStore] = None) -> str:
+    """Zet een opgeslagen upload in de store en verhoog zijn referentieteller (met eigen commit)
+
+    Plaatsen en tellen gebeuren onder het proceslock, zodat een gelijktijdige
+    release van dezelfde hash het object er niet tussendoor kan verwijderen.
+    Geeft het pad van het object terug.
+    """
+    store = store or FileStore()
+    with _stored_files_lock:
+        try:
+            _, _, file_path = store.commit(tmp_path, content_hash, file_size, extension)
+            stored_file = db.query(StoredFile).filter(StoredFile.content_hash == content_hash).with_for_update().first()
+            if stored_file is None:
+                stored_file = StoredFile(content_hash=content_hash, file_path=file_path, file_size=file_size, ref_count=0)
+                db.add(stored_file)
+            stored_file.ref_count = (stored_file.ref_count or 0) + 1
+            db.commit()
+        except Exception:
+            db.rollback()
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    return stored_file.file_path
+
+def release_stored_file(db: Session, content_hash: str, store: Optional[FileStore] = None) -> bool:
+    """Verlaag de referentieteller (met eigen commit); verwijdert het object als niemand het meer gebruikt
+
+    Geeft True terug als het bestand van schijf is verwijderd.
+    """
+    with _stored_files_lock:
+        stored_file = db.query(StoredFile).filter(StoredFile.content_hash == content_hash).with_for_update().first()
+        if stored_file is None:
+            return False
+        file_path = _unreference(db, stored_file)
+        db.commit()
+        return remove_unused_file(db, file_path, store)
+
+def unreference_document_file(db: Session, document) -> Optional[str]:
+    """Geef het bestand van een te verwijderen document vrij, zonder commit
+
+    Werkt alleen de referentieteller bij in de transactie van de aanroeper en
+    geeft het pad terug dat na diens commit met remove_unused_file weg mag
+    (of None). Oude documenten (van vóór de content-addressed opslag) kunnen
+    door reprocess_documents wel een content_hash hebben, maar hebben geen
+    StoredFile en een eigen pad; dat pad komt direct terug.
+    """
+    if document.content_hash:
+        with _stored_files_lock:
+            stored_file = db.query(StoredFile).filter(StoredFile.content_hash == document.content_hash).with_for_update().first()
+            if stored_file is not None and stored_file.file_path == document.file_path:
+                return _unreference(db, stored_file)
+    return document.file_path
+
+def remove_unused_file(db: Session, file_path: str, store: Optional[FileStore] = None) -> bool:
+    """Verwijder een bestand na de commit, als geen StoredFile het (opnieuw) gebruikt
+
+    Draait onder het proceslock, zodat een gelijktijdige acquire van dezelfde
+    inhoud het object niet kwijtraakt. Geeft True terug als het bestand van
+    schijf is verwijderd.
+    """
+    with _stored_files_lock:
+        still_used = db.query(StoredFile).filter(
+            StoredFile.file_path == file_path,
+            StoredFile.ref_count > 0
+        ).first()
+        if still_used is not None or not os.path.exists(file_path):
+            return False
+        (store or FileStore()).remove(file_path)
+        return True
+
+def _unreference(db: Session, stored_file: StoredFile) -> str:
+    """Verlaag de teller (rij weg bij nul) zonder commit; geeft het pad van het object terug"""
+    stored_file.ref_count = max((stored_file.ref_count or 0) - 1, 0)
+    if stored_file.ref_count == 0:
+        db.delete(stored_file)
+    return stored_file.file_path
@@ -0,0 +1,11 @@
+import os
+import sys
+import tempfile
+
+# Tests draaien tegen een tijdelijke database en map, nooit tegen rag_app.db of /app
+_tmp_dir = tempfile.mkdtemp(prefix="ragopmaat-tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_tmp_dir, 'test.db')}")
+os.environ.setdefault("DOCUMENTS_DIR", os.path.join(_tmp_dir, "documents"))
+os.environ.setdefault("OCR_CACHE_DIR", os.path.join(_tmp_dir, "ocr_cache"))
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,82 @@
+import time
+
+import pytest
+
+from rag.admission import AdmissionController, AdmissionRejected, current_ticket, mark_service_started
+
+
+def make_controller(**kwargs):
+    options = dict(capacity=2, slo_seconds=60, max_inflight=100, max_inflight_per_user=4,
+                   initial_latency=5, enabled=True)
+    options.update(kwargs)
+    return AdmissionController(**options)
+
+
+def test_estimated_latency_counts_rounds_of_capacity():
+    controller = make_controller()
+    assert controller.estimated_latency(0) == 5
+    assert controller.estimated_latency(1) == 5
+    assert controller.estimated_latency(2) == 10
+    assert controller.estimated_latency(5) == 15
+
+
+def test_per_user_limit_gives_429():
+    controller = make_controller(max_inflight_per_user=2)
+    controller.admit("a")
+    controller.admit("a")
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.admit("a")
+    assert rejected.value.status_code == 429
+    assert rejected.value.retry_after >= 1
+    # Andere gebruikers worden nog wel toegelaten
+    controller.admit("b")
+
+
+def test_max_inflight_gives_503():
+    controller = make_controller(max_inflight=2, slo_seconds=0)
+    controller.admit("a")
+    controller.admit("b")
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.admit("c")
+    assert rejected.value.status_code == 503
+
+
+def test_slo_gives_503_and_release_makes_room():
+    controller = make_controller(capacity=1, slo_seconds=12)
+    first = controller.admit("a")
+    controller.admit("b")
+    # Derde query moet drie rondes van 5 seconden wachten
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.admit("c")
+    assert rejected.value.status_code == 503
+    assert rejected.value.retry_after >= 3
+    first.release(record_latency=False)
+    controller.admit("c")
+    assert controller.inflight == 2
+
+
+def test_release_is_idempotent():
+    controller = make_controller()
+    ticket = controller.admit("a")
+    ticket.release(record_latency=False)
+    ticket.release(record_latency=False)
+    assert controller.inflight == 0
+    assert controller._per_user == {}
+
+
+def test_ewma_uses_service_time_not_queue_wait():
+    controller = make_controller(initial_latency=1.0)
+    ticket = controller.admit("a")
+    assert current_ticket.get() is ticket
+    time.sleep(0.2)  # wachttijd in de scheduler
+    mark_service_started()
+    ticket.release()
+    # Zonder de wachttijd blijft de bedieningstijd bijna nul
+    assert controller.latency_estimate == pytest.approx(0.8, abs=0.02)
+
+
+def test_disabled_controller_admits_everything():
+    controller = make_controller(enabled=False, max_inflight=1, max_inflight_per_user=1)
+    for _ in range(3):
+        controller.admit("a")
+    assert controller.inflight == 3
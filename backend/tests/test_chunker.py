@@ -0,0 +1,61 @@
+import pytest
+
+from rag.document_processor import DocumentProcessor
+
+
+def words(count, prefix="woord"):
+    return " ".join(f"{prefix}{i}" for i in range(count))
+
+
+def test_char_chunks_overlap_and_cover_the_text():
+    processor = DocumentProcessor(chunk_size=200, chunk_overlap=50, chunk_unit="chars")
+    text, page_starts = processor._join_pages([words(150)])
+    chunks = processor._chunk_spans(text, page_starts)
+
+    assert len(chunks) > 1
+    assert chunks[0]['char_start'] == 0
+    assert chunks[-1]['char_end'] == len(text)
+    for previous, chunk in zip(chunks, chunks[1:]):
+        assert chunk['content'] == text[chunk['char_start']:chunk['char_end']]
+        assert len(chunk['content']) <= 200
+        # Elke chunk begint vóór het einde van de vorige, op een woordgrens
+        assert previous['char_start'] < chunk['char_start'] < previous['char_end']
+        assert previous['char_end'] - chunk['char_start'] <= 50
+        assert text[chunk['char_start'] - 1] == " "
+
+
+def test_no_overlap_gives_adjacent_chunks():
+    processor = DocumentProcessor(chunk_size=200, chunk_overlap=0, chunk_unit="chars")
+    text, page_starts = processor._join_pages([words(150)])
+    chunks = processor._chunk_spans(text, page_starts)
+
+    assert len(chunks) > 1
+    for previous, chunk in zip(chunks, chunks[1:]):
+        assert text[previous['char_end']:chunk['char_start']].strip() == ""
+
+
+def test_token_chunks_overlap_by_token_count():
+    processor = DocumentProcessor(chunk_size=40, chunk_overlap=10, chunk_unit="tokens")
+    text, page_starts = processor._join_pages([words(200)])
+    chunks = processor._chunk_spans(text, page_starts)
+
+    assert len(chunks) > 1
+    for previous, chunk in zip(chunks, chunks[1:]):
+        assert len(chunk['content'].split()) <= 40
+        shared = text[chunk['char_start']:previous['char_end']].split()
+        assert shared == previous['content'].split()[-10:]
+
+
+def test_chunks_know_their_pages():
+    processor = DocumentProcessor(chunk_size=300, chunk_overlap=50, chunk_unit="chars")
+    chunks = processor.chunk_pages([words(60, "een"), "", words(60, "drie")])
+
+    assert chunks[0]['page_start'] == 1
+    assert chunks[-1]['page_end'] == 3
+    assert any(chunk['page_start'] == 1 and chunk['page_end'] == 3 for chunk in chunks)
+    assert all("een" not in chunk['content'] for chunk in chunks if chunk['page_start'] == 3)
+
+
+def test_invalid_overlap_is_rejected():
+    with pytest.raises(ValueError):
+        DocumentProcessor(chunk_size=100, chunk_overlap=100)
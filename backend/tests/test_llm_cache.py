@@ -0,0 +1,65 @@
+from rag.llm import LLMResponseCache, is_error_answer, set_llm_cache_mode
+
+
+def make_key(cache, **overrides):
+    fields = dict(provider="openai", model="gpt-4o-mini", temperature=0.1, max_tokens=500,
+                  kind="generate_with_sources", payload={"question": "Wat is de huur?", "sources": [{"id": 1}]})
+    fields.update(overrides)
+    return cache.key(**fields)
+
+
+def test_key_is_deterministic():
+    cache = LLMResponseCache(enabled=True)
+    assert make_key(cache) == make_key(cache)
+    # Volgorde van dict-sleutels in de invoer maakt niet uit
+    assert make_key(cache, payload={"sources": [{"id": 1}], "question": "Wat is de huur?"}) == make_key(cache)
+
+
+def test_key_differs_per_field():
+    cache = LLMResponseCache(enabled=True)
+    base = make_key(cache)
+    variants = [
+        dict(provider="ollama"),
+        dict(model="gpt-4o"),
+        dict(temperature=0.0),
+        dict(max_tokens=400),
+        dict(kind="generate"),
+        dict(payload={"question": "Wat is de huur?", "sources": [{"id": 2}]}),
+    ]
+    keys = {make_key(cache, **variant) for variant in variants}
+    assert base not in keys
+    assert len(keys) == len(variants)
+
+
+def test_key_changes_with_cache_version():
+    cache = LLMResponseCache(enabled=True)
+    base = make_key(cache)
+    cache.version = "2"
+    assert make_key(cache) != base
+
+
+def test_cacheable_depends_on_temperature_and_enabled():
+    cache = LLMResponseCache(enabled=True, max_temperature=0.2)
+    assert cache.cacheable(0.2)
+    assert not cache.cacheable(0.8)
+    assert not cache.cacheable(None)
+    assert not LLMResponseCache(enabled=False).cacheable(0.0)
+
+
+def test_is_error_answer():
+    assert is_error_answer("")
+    assert is_error_answer("   ")
+    assert is_error_answer(None)
+    assert is_error_answer("Error: timeout")
+    assert is_error_answer({"answer": "Error: rate limit"})
+    assert not is_error_answer("De huur is 950 euro.")
+    assert not is_error_answer({"answer": "ok"})
+
+
+def test_only_the_explicit_header_bypasses_the_cache():
+    assert set_llm_cache_mode({}) == "use"
+    assert set_llm_cache_mode({"x-llm-cache": "refresh"}) == "refresh"
+    assert set_llm_cache_mode({"x-llm-cache": " Bypass "}) == "off"
+    # Browsers en proxies sturen dit routinematig; het mag de cache niet uitschakelen
+    assert set_llm_cache_mode({"cache-control": "no-cache"}) == "use"
+    assert set_llm_cache_mode({"cache-control": "no-store"}) == "use"
@@ -0,0 +1,33 @@
+from rag.ocr_cache import OCRCache
+
+
+def put_pages(cache, count, size=100, prefix="pdf"):
+    for page in range(count):
+        cache.put(cache.make_key(prefix, page, 200, "nld", "tesserocr"), "x" * size)
+
+
+def test_size_is_shared_between_instances_without_rescanning(tmp_path, monkeypatch):
+    put_pages(OCRCache(str(tmp_path), 10_000), 5)
+
+    def no_scan(self):
+        raise AssertionError("cache directory should not be scanned")
+
+    monkeypatch.setattr(OCRCache, "_scan_size", no_scan)
+    cache = OCRCache(str(tmp_path), 10_000)
+    put_pages(cache, 5, prefix="ander")
+    assert cache._read_size() == 1000
+
+
+def test_overwrite_counts_only_the_difference(tmp_path):
+    cache = OCRCache(str(tmp_path), 10_000)
+    key = cache.make_key("pdf", 1, 200, "nld", "tesserocr")
+    cache.put(key, "x" * 100)
+    cache.put(key, "y" * 300)
+    assert cache._read_size() == cache._scan_size() == 300
+    assert cache.get(key) == "y" * 300
+
+
+def test_eviction_keeps_size_in_sync(tmp_path):
+    cache = OCRCache(str(tmp_path), 1_000)
+    put_pages(cache, 15)
+    assert cache._read_size() == cache._scan_size() <= 1_000
@@ -0,0 +1,30 @@
+import pytest
+
+from rag import document_processor
+from rag.document_processor import DocumentProcessor, OCREngine, get_ocr_engine
+
+
+class BrokenEngine(OCREngine):
+    name = "broken"
+
+    def __init__(self, lang):
+        raise OSError("traineddata ontbreekt")
+
+
+def test_unknown_engine_name_is_rejected():
+    with pytest.raises(ValueError):
+        get_ocr_engine("tesserocrr")
+
+
+def test_unknown_engine_in_config_is_rejected(monkeypatch):
+    monkeypatch.setenv("OCR_ENGINE", "tesserocrr")
+    with pytest.raises(ValueError):
+        DocumentProcessor()
+
+
+def test_no_available_engine_raises_with_reasons(monkeypatch):
+    monkeypatch.setattr(document_processor, "OCR_ENGINES", {"tesserocr": BrokenEngine, "pytesseract": BrokenEngine})
+    with pytest.raises(RuntimeError) as error:
+        get_ocr_engine("auto", "test")
+    assert "tesserocr: traineddata ontbreekt" in str(error.value)
+    assert "pytesseract: traineddata ontbreekt" in str(error.value)
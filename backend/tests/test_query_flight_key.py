@@ -0,0 +1,17 @@
+import pytest
+
+pytest.importorskip("sentence_transformers")
+
+from api.query import query_flight_key
+
+
+def test_flight_key_normalizes_case_and_whitespace():
+    assert query_flight_key("Wat is  de\tHUUR?", None, 3, "openai") == query_flight_key("wat is de huur?", "", 3, "openai")
+
+
+def test_flight_key_separates_filter_generation_provider_and_cache_mode():
+    base = query_flight_key("wat is de huur?", None, 1, "openai")
+    assert base != query_flight_key("wat is de huur?", "contract.pdf", 1, "openai")
+    assert base != query_flight_key("wat is de huur?", None, 2, "openai")
+    assert base != query_flight_key("wat is de huur?", None, 1, "ollama")
+    assert base != query_flight_key("wat is de huur?", None, 1, "openai", cache_mode="refresh")
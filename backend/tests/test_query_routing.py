@@ -0,0 +1,29 @@
+import pytest
+
+pytest.importorskip("sentence_transformers")
+
+from api.query import is_overview_question
+
+
+@pytest.mark.parametrize("question", [
+    "Geef een samenvatting",
+    "geef een samenvatting van dit document.",
+    "Maak een korte samenvatting van alle documenten",
+    "Vat het contract samen",
+    "Waar gaat dit document over?",
+    "Kun je een samenvatting van deze stukken geven?",
+    "Geef me een overzicht van mijn documenten",
+])
+def test_overview_questions(question):
+    assert is_overview_question(question)
+
+
+@pytest.mark.parametrize("question", [
+    "Waar gaat de huurverhoging in?",
+    "Geef een overzicht van de bedragen",
+    "Wat staat er in de samenvatting over de opzegtermijn?",
+    "Wanneer moet de factuur betaald worden?",
+    "Samenvatting van de betalingsvoorwaarden graag, en de boete",
+])
+def test_factual_questions_are_not_overview(question):
+    assert not is_overview_question(question)
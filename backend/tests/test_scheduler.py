@@ -0,0 +1,98 @@
+import asyncio
+
+from rag.llm import LLMScheduler, current_tier, current_user_id
+
+
+async def run_in_order(scheduler, callers):
+    """Houd de enige plek bezet, zet alle callers in de rij en geef de volgorde terug waarin ze een plek krijgen"""
+    order = []
+    release = asyncio.Event()
+
+    async def holder():
+        async with scheduler.slot("x"):
+            await release.wait()
+
+    async def caller(name, tier, user_id):
+        current_tier.set(tier)
+        current_user_id.set(user_id)
+        async with scheduler.slot("x"):
+            order.append(name)
+
+    held = asyncio.ensure_future(holder())
+    await asyncio.sleep(0)
+    tasks = []
+    for name, tier, user_id in callers:
+        tasks.append(asyncio.ensure_future(caller(name, tier, user_id)))
+        await asyncio.sleep(0)  # vaste volgorde van binnenkomst
+    release.set()
+    await asyncio.gather(held, *tasks)
+    return order
+
+
+def test_higher_tier_goes_first():
+    scheduler = LLMScheduler(limits={"x": 1}, aging=0)
+    order = asyncio.run(run_in_order(scheduler, [
+        ("basic", "basic", 1),
+        ("premium", "premium", 2),
+        ("white_label", "white_label", 3),
+    ]))
+    assert order == ["white_label", "premium", "basic"]
+
+
+def test_users_take_turns_within_a_tier():
+    scheduler = LLMScheduler(limits={"x": 1}, aging=0)
+    order = asyncio.run(run_in_order(scheduler, [
+        ("a1", "basic", "a"),
+        ("a2", "basic", "a"),
+        ("a3", "basic", "a"),
+        ("b1", "basic", "b"),
+        ("b2", "basic", "b"),
+    ]))
+    assert order == ["a1", "b1", "a2", "b2", "a3"]
+
+
+def test_limit_is_respected():
+    scheduler = LLMScheduler(limits={"x": 2})
+    peak = 0
+
+    async def call():
+        nonlocal peak
+        async with scheduler.slot("x"):
+            peak = max(peak, scheduler.stats()["x"]["active"])
+            await asyncio.sleep(0.01)
+
+    async def main():
+        await asyncio.gather(*(call() for _ in range(6)))
+
+    asyncio.run(main())
+    assert peak == 2
+    assert scheduler.stats()["x"] == {"limit": 2, "active": 0, "waiting": 0}
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    scheduler = LLMScheduler(limits={"x": 1})
+
+    async def main():
+        release = asyncio.Event()
+
+        async def holder():
+            async with scheduler.slot("x"):
+                await release.wait()
+
+        async def waiter():
+            async with scheduler.slot("x"):
+                pass
+
+        held = asyncio.ensure_future(holder())
+        await asyncio.sleep(0)
+        waiting = asyncio.ensure_future(waiter())
+        await asyncio.sleep(0)
+        assert scheduler.stats()["x"]["waiting"] == 1
+        waiting.cancel()
+        await asyncio.sleep(0)
+        assert scheduler.stats()["x"]["waiting"] == 0
+        release.set()
+        await held
+
+    asyncio.run(main())
+    assert scheduler.stats()["x"]["active"] == 0
@@ -0,0 +1,126 @@
+import asyncio
+
+import pytest
+
+from rag.admission import AdmissionController, mark_service_started
+from rag.deadline import Deadline, DeadlinePolicy
+from rag.singleflight import SingleFlight
+
+
+def test_concurrent_calls_share_one_computation():
+    flights = SingleFlight("test")
+    calls = 0
+
+    async def compute():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return "antwoord"
+
+    async def main():
+        return await asyncio.gather(*(flights.do("key", compute) for _ in range(5)))
+
+    assert asyncio.run(main()) == ["antwoord"] * 5
+    assert calls == 1
+    assert flights.inflight() == 0
+
+
+def test_exception_reaches_every_waiter():
+    flights = SingleFlight("test")
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("kapot")
+
+    async def main():
+        return await asyncio.gather(*(flights.do("key", fail) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+def test_cancelled_follower_does_not_cancel_the_leader():
+    flights = SingleFlight("test")
+
+    async def compute():
+        await asyncio.sleep(0.02)
+        return "klaar"
+
+    async def main():
+        leader = asyncio.ensure_future(flights.do("key", compute))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flights.do("key", compute))
+        await asyncio.sleep(0)
+        follower.cancel()
+        return await leader
+
+    assert asyncio.run(main()) == "klaar"
+
+
+def test_not_joinable_computes_separately():
+    flights = SingleFlight("test")
+    calls = 0
+
+    async def compute():
+        nonlocal calls
+        calls += 1
+        number = calls
+        await asyncio.sleep(0.01)
+        return number
+
+    async def main():
+        leader = asyncio.ensure_future(flights.do("key", compute, context="kort"))
+        await asyncio.sleep(0)
+        follower = flights.do("key", compute, context="lang", joinable=lambda leader: leader == "lang")
+        return await asyncio.gather(leader, follower)
+
+    assert sorted(asyncio.run(main())) == [1, 2]
+
+
+def test_follower_marks_its_own_ticket_on_join():
+    flights = SingleFlight("test")
+    controller = AdmissionController(capacity=1, slo_seconds=0, max_inflight=0, max_inflight_per_user=0,
+                                     initial_latency=1, enabled=True)
+    tickets = {}
+
+    async def compute():
+        await asyncio.sleep(0.01)
+        mark_service_started()  # zoals de scheduler doet in de context van de leader
+        return "antwoord"
+
+    async def call(name):
+        tickets[name] = controller.admit(name)
+        return await flights.do("key", compute, on_join=mark_service_started)
+
+    async def main():
+        leader = asyncio.ensure_future(call("leader"))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(call("follower"))
+        await asyncio.sleep(0)
+        assert tickets["follower"].service_started is not None
+        assert tickets["leader"].service_started is None
+        await asyncio.gather(leader, follower)
+
+    asyncio.run(main())
+    assert tickets["leader"].service_started is not None
+
+
+@pytest.fixture
+def policy(monkeypatch):
+    for name, value in {
+        "QUERY_SOURCES_ONLY_BELOW": "5",
+        "QUERY_DEGRADE_CHUNKS_BELOW": "30",
+        "QUERY_DEGRADE_MODEL_BELOW": "30",
+        "QUERY_DEGRADE_TOKENS_BELOW": "60",
+    }.items():
+        monkeypatch.setenv(name, value)
+    return DeadlinePolicy()
+
+
+def test_can_share_only_with_an_equal_or_larger_budget(policy):
+    assert policy.can_share(None, Deadline(10))
+    assert policy.can_share(Deadline(120), Deadline(90))
+    assert policy.can_share(Deadline(20), Deadline(10))
+    # Een leader die al tokens inlevert deelt niet met een follower die dat niet hoeft
+    assert not policy.can_share(Deadline(45), Deadline(120))
+    assert not policy.can_share(Deadline(3), Deadline(20))
@@ -0,0 +1,118 @@
+import io
+import os
+
+import pytest
+
+from db import Base, SessionLocal, engine
+from models import Document, StoredFile
+from storage import (
+    FileStore, FileTooLargeError, acquire_stored_file, release_stored_file,
+    unreference_document_file, remove_unused_file
+)
+
+
+@pytest.fixture
+def db():
+    Base.metadata.create_all(bind=engine)
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.query(StoredFile).delete()
+        session.commit()
+        session.close()
+
+
+@pytest.fixture
+def store(tmp_path):
+    return FileStore(str(tmp_path))
+
+
+def save(store, data):
+    return store.save_stream(io.BytesIO(data), ".txt")
+
+
+def test_save_stream_hashes_and_writes_tmp(store):
+    content_hash, size, tmp_path = save(store, b"hallo")
+    assert size == 5
+    assert content_hash == "d3751d33f9cd5049c4af2b462735457e4d3baf130bcbb87f389e349fbaeb20b9"
+    with open(tmp_path, "rb") as f:
+        assert f.read() == b"hallo"
+
+
+def test_save_stream_rejects_too_large(store):
+    with pytest.raises(FileTooLargeError):
+        store.save_stream(io.BytesIO(b"x" * 10), ".txt", max_size=5)
+    assert os.listdir(store.tmp_dir) == []
+
+
+def test_identical_uploads_share_one_object(db, store):
+    content_hash, size, tmp_path = save(store, b"zelfde inhoud")
+    first = acquire_stored_file(db, content_hash, tmp_path, size, ".txt", store)
+    content_hash, size, tmp_path = save(store, b"zelfde inhoud")
+    second = acquire_stored_file(db, content_hash, tmp_path, size, ".txt", store)
+
+    assert first == second == store.path_for(content_hash, ".txt")
+    assert not os.path.exists(tmp_path)
+    assert db.query(StoredFile).filter(StoredFile.content_hash == content_hash).one().ref_count == 2
+
+
+def test_object_is_removed_after_last_release(db, store):
+    content_hash, size, tmp_path = save(store, b"gedeeld")
+    file_path = acquire_stored_file(db, content_hash, tmp_path, size, ".txt", store)
+    content_hash, size, tmp_path = save(store, b"gedeeld")
+    acquire_stored_file(db, content_hash, tmp_path, size, ".txt", store)
+
+    assert release_stored_file(db, content_hash, store) is False
+    assert os.path.exists(file_path)
+    assert release_stored_file(db, content_hash, store) is True
+    assert not os.path.exists(file_path)
+    assert db.query(StoredFile).filter(StoredFile.content_hash == content_hash).first() is None
+    # Een extra release is een no-op
+    assert release_stored_file(db, content_hash, store) is False
+
+
+def test_document_file_is_removed_only_after_commit(db, store):
+    content_hash, size, tmp_path = save(store, b"document")
+    file_path = acquire_stored_file(db, content_hash, tmp_path, size, ".txt", store)
+    document = Document(filename="a.txt", file_path=file_path, content_hash=content_hash)
+
+    assert unreference_document_file(db, document) == file_path
+    # Tot de commit staat het bestand er nog; een rollback laat alles intact
+    assert os.path.exists(file_path)
+    db.rollback()
+    assert db.query(StoredFile).filter(StoredFile.content_hash == content_hash).one().ref_count == 1
+
+    assert unreference_document_file(db, document) == file_path
+    db.commit()
+    assert remove_unused_file(db, file_path, store) is True
+    assert not os.path.exists(file_path)
+
+
+def test_shared_object_survives_removal_check(db, store):
+    content_hash, size, tmp_path = save(store, b"gedeeld document")
+    file_path = acquire_stored_file(db, content_hash, tmp_path, size, ".txt", store)
+    content_hash, size, tmp_path = save(store, b"gedeeld document")
+    acquire_stored_file(db, content_hash, tmp_path, size, ".txt", store)
+    document = Document(filename="a.txt", file_path=file_path, content_hash=content_hash)
+
+    assert unreference_document_file(db, document) == file_path
+    db.commit()
+    assert remove_unused_file(db, file_path, store) is False
+    assert os.path.exists(file_path)
+
+
+def test_legacy_document_file_is_removed(db, store, tmp_path):
+    # Oud document met eigen pad; een nieuwer object met dezelfde inhoud blijft staan
+    content_hash, size, tmp = save(store, b"oud")
+    shared_path = acquire_stored_file(db, content_hash, tmp, size, ".txt", store)
+    legacy_path = tmp_path / "legacy.txt"
+    legacy_path.write_bytes(b"oud")
+    document = Document(filename="legacy.txt", file_path=str(legacy_path), content_hash=content_hash)
+
+    assert unreference_document_file(db, document) == str(legacy_path)
+    db.commit()
+    assert remove_unused_file(db, str(legacy_path), store) is True
+    assert not legacy_path.exists()
+    assert os.path.exists(shared_path)
+    assert db.query(StoredFile).filter(StoredFile.content_hash == content_hash).one().ref_count == 1
@@ -0,0 +1,62 @@
+import asyncio
+
+from rag import summaries
+from rag.summaries import REDUCE_PROMPT, SummaryCache, reduce_context, summarize_per_document
+
+
+class FakeLLM:
+    provider = "fake"
+
+    def __init__(self, reduce_answer="Samengevoegd overzicht"):
+        self.reduce_answer = reduce_answer
+        self.calls = []
+
+    async def generate(self, prompt, context="", **options):
+        self.calls.append((prompt, context))
+        if prompt == REDUCE_PROMPT:
+            return self.reduce_answer
+        return f"Samenvatting: {context[:20]}"
+
+
+class FakeVectorStore:
+    def document_chunks(self, document_id):
+        return [f"Tekst van document {document_id}. " * 100]
+
+
+def sources(*document_ids):
+    return [
+        {"content": "chunk", "metadata": {"document_id": i, "content_hash": f"hash{i}", "original_filename": f"doc{i}.pdf"}}
+        for i in document_ids
+    ]
+
+
+def summarize(llm, document_ids, monkeypatch):
+    monkeypatch.setattr(summaries, "summary_cache", SummaryCache())
+    return asyncio.run(summarize_per_document(llm, FakeVectorStore(), sources(*document_ids)))
+
+
+def test_reduce_merges_the_document_summaries(monkeypatch):
+    llm = FakeLLM()
+    assert summarize(llm, [1, 2, 3], monkeypatch) == "Samengevoegd overzicht"
+    reduce_calls = [context for prompt, context in llm.calls if prompt == REDUCE_PROMPT]
+    assert len(reduce_calls) == 1
+    assert "Document 1 (doc1.pdf)" in reduce_calls[0] and "Document 3 (doc3.pdf)" in reduce_calls[0]
+
+
+def test_single_document_needs_no_reduce(monkeypatch):
+    llm = FakeLLM()
+    answer = summarize(llm, [1], monkeypatch)
+    assert answer.startswith("Document 1 (doc1.pdf)")
+    assert all(prompt != REDUCE_PROMPT for prompt, _ in llm.calls)
+
+
+def test_failed_reduce_falls_back_to_the_summaries(monkeypatch):
+    answer = summarize(FakeLLM(reduce_answer="Error: timeout"), [1, 2], monkeypatch)
+    assert answer.startswith("Document 1 (doc1.pdf)")
+    assert "Document 2 (doc2.pdf)" in answer
+
+
+def test_reduce_context_stays_within_budget():
+    context = reduce_context(["x" * 10_000] * 3, max_chars=3_000)
+    assert len(context) <= 3_000
+    assert context.count("...") == 3